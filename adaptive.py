@@ -0,0 +1,243 @@
+import numpy as np
+import pandas as pd
+
+from instrumentation import PROFILER
+from pipeline import COLUMNS, MODES, STATUS_CIJ_INVALID, STATUS_OK
+
+# Quantities whose variation drives the refinement
+DEFAULT_QUANTITIES = ("C44", "Vp_h", "Vs_h")
+
+# Temperatures bracketing the softening temperature in pressure mode (K)
+DEFAULT_T_BRACKET = (10.0, 10000.0)
+
+
+def softening_temperature_at_pressure(pipeline, pressures, T_bracket=DEFAULT_T_BRACKET, T_tol=1e-6, max_iterations=60):
+    """
+    Solve T = T_c(rho(P, T)) for the softening temperature at given pressures, with a vectorized bracketed
+    Newton iteration. Along an isobar the density decreases with temperature and T_c increases with
+    density, so T - T_c(rho(P, T)) increases monotonically and has a single root.
+    pipeline: ElasticPipeline instance
+    pressures: Pressures (GPa)
+    T_bracket: Temperatures (K) bracketing the root
+    T_tol: Convergence tolerance (K)
+    max_iterations: Maximum number of iterations
+    Returns: Softening temperatures (K); NaN where no root was found in T_bracket
+    """
+    thermal, calculator = pipeline.thermal, pipeline.calculator
+    P = np.atleast_1d(np.asarray(pressures, dtype=float))
+    shape = P.shape
+    P = P.ravel()
+    lower = np.full(P.size, float(T_bracket[0]))
+    upper = np.full(P.size, float(T_bracket[1]))
+    T = 0.5 * (lower + upper)
+    T_c = np.full(P.size, np.nan)
+    iterations = np.zeros(P.size, dtype=np.int64)
+    active = np.isfinite(P)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for _ in range(max_iterations):
+            index = np.flatnonzero(active)
+            if index.size == 0:
+                break
+            iterations[index] += 1
+            V, solved = pipeline.inverse.solve_volumes(P[index], T[index])
+            rho = thermal.V_to_rho(V)
+            g = T[index] - calculator.softening_temperature(rho)
+            # d(rho)/dT at constant P = -rho / V * dV/dT, with dV/dT = -(dP/dT)_V / (dP/dV)_T
+            dV_dT = -thermal.dP_dT(V, T[index]) / thermal.dP_dV(V, T[index])
+            dg = 1 + calculator.softening_temperature_derivative(rho) * rho / V * dV_dT
+            valid = solved & np.isfinite(g) & np.isfinite(dg)
+
+            lower[index] = np.where(valid & (g < 0), T[index], lower[index])
+            # Without a volume (too hot for the EOS at this pressure) the root lies at lower temperature
+            upper[index] = np.where(~valid | (g > 0), T[index], upper[index])
+            T_new = T[index] - g / dg
+            inside = valid & (T_new > lower[index]) & (T_new < upper[index])
+            T_new = np.where(inside, T_new, 0.5 * (lower[index] + upper[index]))
+
+            done = valid & (np.abs(T_new - T[index]) <= T_tol)
+            T_c[index[done]] = T_new[done]
+            stalled = upper[index] - lower[index] <= T_tol
+            active[index[done | stalled]] = False
+            T[index] = T_new
+
+    if PROFILER.enabled:
+        PROFILER.record_iterations("softening_temperature", iterations)
+    return T_c.reshape(shape)
+
+
+def softening_temperatures(pipeline, mode, values):
+    """
+    Calculate the softening temperature T_c(rho) or T_c(P) below which Cij_fit is undefined.
+    pipeline: ElasticPipeline instance
+    mode: 'density' if values are densities (g/cm³), 'pressure' if values are pressures (GPa)
+    values: Densities or pressures
+    Returns: Softening temperatures (K)
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+    if mode == "density":
+        return pipeline.calculator.softening_temperature(values)
+    return softening_temperature_at_pressure(pipeline, values)
+
+
+class AdaptiveSample:
+    def __init__(self, mode, points, cells, boundary, n_evaluated, n_masked):
+        """
+        Result of adaptive_sample.
+        mode: 'density' or 'pressure'
+        points: DataFrame of the sampled state points with the columns of COLUMNS, 'status' and 'level'
+                (the refinement level at which the point was added)
+        cells: DataFrame of the leaf cells of the quadtree with the columns T_min, T_max, <x>_min, <x>_max
+               and level, where <x> is rho or P
+        boundary: DataFrame of the softening temperature 'Tc' (K) on the density or pressure values of the
+                  finest level
+        n_evaluated: Number of points run through the pipeline
+        n_masked: Number of points below the softening temperature, which were not run through the pipeline
+        """
+        self.mode = mode
+        self.points = points
+        self.cells = cells
+        self.boundary = boundary
+        self.n_evaluated = n_evaluated
+        self.n_masked = n_masked
+
+    def save(self, filename):
+        """
+        Write the leaf cells and the softening-temperature boundary to an .npz archive, with the arrays
+        'cells_<column>' and 'boundary_<column>'.
+        filename: Output file name
+        """
+        arrays = {f"cells_{column}": self.cells[column].to_numpy() for column in self.cells}
+        arrays.update({f"boundary_{column}": self.boundary[column].to_numpy() for column in self.boundary})
+        np.savez(filename, **arrays)
+
+
+def adaptive_sample(pipeline, mode, T_range, value_range, n_initial=(9, 9), max_level=6, tolerance=0.01,
+                    variation=0.25, quantities=DEFAULT_QUANTITIES, max_points=None):
+    """
+    Sample a temperature x density (or pressure) domain on a quadtree refined around the C44 softening and
+    wherever the properties change fast.
+    The softening temperature T_c is calculated first on the density or pressure values of the finest level,
+    and points below it are marked with the status 'below softening temperature' without running the
+    pipeline (in pressure mode this skips their EOS solves). Starting from a uniform grid of cells, every
+    cell crossed by T_c or with both valid and invalid points is split into four, as is every cell where,
+    for any of the quantities, the value at the centre differs from the mean of the corners by more than
+    tolerance, or the corners differ by more than variation (both relative to the range of the quantity
+    over the valid points sampled so far, 1st to 99th percentile). Points shared by neighbouring cells are
+    evaluated once; each level is evaluated as one batch.
+    pipeline: ElasticPipeline instance
+    mode: 'density' or 'pressure'
+    T_range: (lower, upper) temperature limits (K)
+    value_range: (lower, upper) density (g/cm³) or pressure (GPa) limits
+    n_initial: Number of (temperature, value) points of the initial grid, at least 2 each
+    max_level: Maximum number of refinements of an initial cell
+    tolerance: Relative interpolation error above which a cell is refined
+    variation: Relative variation across a cell above which it is refined; None to not use it
+    quantities: Result columns checked for refinement
+    max_points: Optional budget; no level is refined further once this many points have been sampled
+    Returns: AdaptiveSample
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+    n_T, n_x = (int(n) for n in n_initial)
+    if n_T < 2 or n_x < 2:
+        raise ValueError("The initial grid needs at least 2 points along each axis")
+    x_name = "rho" if mode == "density" else "P"
+
+    # Points live on the lattice of the finest level; a cell of level L spans 2**(max_level - L) lattice steps
+    unit = 2**max_level
+    n_i, n_j = (n_T - 1) * unit, (n_x - 1) * unit
+    T_axis = np.linspace(T_range[0], T_range[1], n_i + 1)
+    x_axis = np.linspace(value_range[0], value_range[1], n_j + 1)
+    with PROFILER.stage("softening"):
+        T_c = softening_temperatures(pipeline, mode, x_axis)
+
+    columns = COLUMNS + ["status", "level"]
+    batches = []
+    keys = np.empty(0, dtype=np.int64)
+    data = {}
+    n_evaluated = n_masked = 0
+
+    def evaluate(i, j, level):
+        # Run the pipeline on the lattice points not sampled yet, skipping those below T_c
+        nonlocal keys, data, n_evaluated, n_masked
+        new = np.unique(i * (n_j + 1) + j)
+        new = new[~np.isin(new, keys)]
+        if new.size:
+            new_i, new_j = np.divmod(new, n_j + 1)
+            T, x = T_axis[new_i], x_axis[new_j]
+            masked = T <= T_c[new_j]
+            batch = {column: np.full(new.size, np.nan) for column in COLUMNS}
+            batch["T"], batch[x_name] = T, x
+            batch["status"] = np.full(new.size, STATUS_CIJ_INVALID, dtype=np.int8)
+            batch["level"] = np.full(new.size, level, dtype=np.int8)
+            if (~masked).any():
+                results = pipeline.compute(mode, T[~masked], x[~masked])
+                for column in COLUMNS + ["status"]:
+                    batch[column][~masked] = results[column]
+            n_evaluated += np.count_nonzero(~masked)
+            n_masked += np.count_nonzero(masked)
+            batches.append((new, batch))
+            keys = np.concatenate([batch_keys for batch_keys, _ in batches])
+            order = np.argsort(keys)
+            keys = keys[order]
+            data = {column: np.concatenate([values[column] for _, values in batches])[order] for column in columns}
+
+    def lookup(i, j, column):
+        return data[column][np.searchsorted(keys, i * (n_j + 1) + j)]
+
+    cell_i, cell_j = (grid.ravel() for grid in np.meshgrid(np.arange(n_T - 1) * unit, np.arange(n_x - 1) * unit,
+                                                           indexing="ij"))
+    leaves = []
+    with PROFILER.stage("adaptive"):
+        for level in range(max_level + 1):
+            size = unit >> level
+            corner_i = np.stack([cell_i, cell_i + size, cell_i, cell_i + size])
+            corner_j = np.stack([cell_j, cell_j, cell_j + size, cell_j + size])
+            if level == max_level:
+                evaluate(corner_i, corner_j, level)
+                leaves.append((cell_i, cell_j, level))
+                break
+            half = size // 2
+            sample_i = np.vstack([corner_i, cell_i + half])
+            sample_j = np.vstack([corner_j, cell_j + half])
+            evaluate(sample_i, sample_j, level)
+
+            valid = lookup(sample_i, sample_j, "status") == STATUS_OK
+            edge_j = np.stack([cell_j, cell_j + half, cell_j + size])
+            crossed = ((T_c[edge_j] > T_axis[cell_i]) & (T_c[edge_j] < T_axis[cell_i + size])).any(axis=0)
+            refine = crossed | (valid.any(axis=0) & ~valid.all(axis=0))
+
+            ok = data["status"] == STATUS_OK
+            for quantity in quantities:
+                if not ok.any():
+                    break
+                low, high = np.percentile(data[quantity][ok], [1, 99])
+                scale = high - low
+                values = lookup(sample_i, sample_j, quantity)
+                error = np.abs(values[4] - values[:4].mean(axis=0))
+                large = error > tolerance * scale
+                if variation is not None:
+                    large |= values[:4].max(axis=0) - values[:4].min(axis=0) > variation * scale
+                refine |= valid.all(axis=0) & large
+
+            if max_points is not None and keys.size >= max_points:
+                refine[:] = False
+            leaves.append((cell_i[~refine], cell_j[~refine], level))
+            if not refine.any():
+                break
+            cell_i, cell_j = cell_i[refine], cell_j[refine]
+            cell_i = np.concatenate([cell_i, cell_i + half, cell_i, cell_i + half])
+            cell_j = np.concatenate([cell_j, cell_j, cell_j + half, cell_j + half])
+
+    cell_i = np.concatenate([i for i, _, _ in leaves])
+    cell_j = np.concatenate([j for _, j, _ in leaves])
+    levels = np.concatenate([np.full(i.size, level, dtype=np.int8) for i, _, level in leaves])
+    sizes = unit >> levels.astype(np.int64)
+    cells = pd.DataFrame({"T_min": T_axis[cell_i], "T_max": T_axis[cell_i + sizes],
+                          f"{x_name}_min": x_axis[cell_j], f"{x_name}_max": x_axis[cell_j + sizes], "level": levels})
+    boundary = pd.DataFrame({x_name: x_axis, "Tc": T_c})
+    # Points in temperature-major order, like the grids of main.build_points
+    points = pd.DataFrame({column: data[column] for column in columns})
+    return AdaptiveSample(mode, points, cells, boundary, n_evaluated, n_masked)
@@ -0,0 +1,251 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from data_io import WRITERS, read_points, save_results
+from pipeline import MODES, STATUS_OK
+from server import DEFAULT_MAX_BATCH, build_pipeline
+
+# Extensions of the input files picked up from a directory
+INPUT_EXTENSIONS = (".dat", ".txt", ".csv", ".xlsx", ".xls")
+
+# Number of threads reading and writing files
+DEFAULT_READERS = 8
+
+DEFAULT_OUTPUT_DIR = "batch_results"
+
+SUMMARY_COLUMNS = ["file", "mode", "output", "rows", "failed", "read_time", "compute_time", "write_time", "error"]
+
+
+class BatchJob:
+    def __init__(self, filename, mode, output=None):
+        """
+        One input file of a batch.
+        filename: Two-column input file (temperature, density/pressure); .dat, .txt, .csv, .xlsx or .xls (needs xlrd)
+        mode: 'density' or 'pressure'
+        output: Output file name; set by assign_outputs if None
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode '{mode}' for {filename}, expected one of {MODES}")
+        self.filename = filename
+        self.mode = mode
+        self.output = output
+
+
+def read_manifest(filename, mode=None):
+    """
+    Read a manifest of input files: one file per line, optionally followed by its mode and its output file,
+    separated by whitespace ('-' keeps the default mode); '#' starts a comment. Relative paths are relative
+    to the directory of the manifest.
+    filename: Manifest file
+    mode: Mode of the files whose line gives none
+    Returns: List of BatchJob
+    """
+    base = os.path.dirname(filename)
+    jobs = []
+    with open(filename) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 3:
+                raise ValueError(f"{filename}:{number}: expected 'file [mode] [output]'")
+            file_mode = fields[1] if len(fields) > 1 and fields[1] != "-" else mode
+            if file_mode is None:
+                raise ValueError(f"{filename}:{number}: no mode given for {fields[0]}")
+            output = os.path.join(base, fields[2]) if len(fields) > 2 else None
+            jobs.append(BatchJob(os.path.join(base, fields[0]), file_mode, output))
+    return jobs
+
+
+def collect_inputs(sources, mode):
+    """
+    Expand directories and glob patterns into input files.
+    sources: Files, directories (their files with one of INPUT_EXTENSIONS) or glob patterns
+    mode: Mode of every file
+    Returns: List of BatchJob, in the order of the sources and sorted by name within each
+    """
+    jobs = []
+    for source in sources:
+        if os.path.isdir(source):
+            files = sorted(os.path.join(source, name) for name in os.listdir(source)
+                           if os.path.splitext(name)[1].lower() in INPUT_EXTENSIONS)
+        elif glob.has_magic(source):
+            files = sorted(name for name in glob.glob(source, recursive=True) if os.path.isfile(name))
+        else:
+            files = [source]
+        if not files:
+            raise ValueError(f"No input files found for '{source}'")
+        jobs.extend(BatchJob(name, mode) for name in files)
+    return jobs
+
+
+def assign_outputs(jobs, output_dir=DEFAULT_OUTPUT_DIR, fmt="dat"):
+    """
+    Name the output of every job without one <output_dir>/<input name>_results.<fmt>.
+    jobs: List of BatchJob
+    output_dir: Output directory
+    fmt: Output format, one of WRITERS
+    """
+    for job in jobs:
+        if job.output is None:
+            name = os.path.splitext(os.path.basename(job.filename))[0]
+            job.output = os.path.join(output_dir, f"{name}_results.{fmt}")
+    outputs = [os.path.abspath(job.output) for job in jobs]
+    duplicates = sorted({output for output in outputs if outputs.count(output) > 1})
+    if duplicates:
+        raise ValueError(f"Several input files would be written to {duplicates}; give their outputs in a manifest")
+
+
+def _read(job):
+    start = time.perf_counter()
+    temperatures, values = read_points(job.filename)
+    return temperatures, values, time.perf_counter() - start
+
+
+def _write(job, results, fmt, precision):
+    start = time.perf_counter()
+    directory = os.path.dirname(job.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    save_results(job.output, results, fmt, precision=precision)
+    return time.perf_counter() - start
+
+
+def run_batch(pipeline, jobs, fmt="dat", precision=6, readers=DEFAULT_READERS, max_batch=DEFAULT_MAX_BATCH):
+    """
+    Compute many input files with one pipeline.
+    The files are read and the results written on a pool of threads, so that waiting on the file system
+    (slow or network disks, many small files) overlaps with parsing and with the pipeline, which runs in the
+    calling thread. Files of the same mode are concatenated into batches of at least max_batch points, or all the
+    remaining points, so that hundreds of small files cost a few vectorized pipeline calls. A file that
+    cannot be read, computed or written is recorded in the summary and does not stop the others.
+    pipeline: ElasticPipeline instance, shared by all files
+    jobs: List of BatchJob with their outputs assigned (see assign_outputs)
+    fmt: Output format, one of WRITERS
+    precision: Number of decimal places (text format only)
+    readers: Number of reading and writing threads
+    max_batch: Number of points above which the files read so far are computed
+    Returns: DataFrame with the columns of SUMMARY_COLUMNS, one row per job in the order of jobs; the times
+             are in s, and the compute time of a batch is shared among its files by their number of points
+    """
+    summary = pd.DataFrame({"file": [job.filename for job in jobs], "mode": [job.mode for job in jobs],
+                            "output": [job.output for job in jobs], "rows": 0, "failed": 0, "read_time": np.nan,
+                            "compute_time": np.nan, "write_time": np.nan, "error": ""})
+    pending = {mode: [] for mode in MODES}
+    writes = {}
+
+    with ThreadPoolExecutor(max_workers=readers) as pool:
+        def compute(mode):
+            # Run the files read so far in one pipeline call and hand the slices to the writers
+            batch, pending[mode] = pending[mode], []
+            sizes = [temperatures.size for _, temperatures, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = pipeline.run(mode, np.concatenate([temperatures for _, temperatures, _ in batch]),
+                                       np.concatenate([values for _, _, values in batch]))
+            except Exception as error:
+                for index, _, _ in batch:
+                    summary.loc[index, "error"] = f"compute: {error}"
+                return
+            elapsed = time.perf_counter() - start
+            offsets = np.cumsum([0] + sizes)
+            for (index, _, _), begin, end in zip(batch, offsets[:-1], offsets[1:]):
+                part = results.iloc[begin:end].reset_index(drop=True)
+                summary.loc[index, ["rows", "failed"]] = [end - begin, np.count_nonzero(part["status"] != STATUS_OK)]
+                summary.loc[index, "compute_time"] = elapsed * (end - begin) / max(offsets[-1], 1)
+                writes[pool.submit(_write, jobs[index], part, fmt, precision)] = index
+
+        reads = {pool.submit(_read, job): index for index, job in enumerate(jobs)}
+        for future in as_completed(reads):
+            index = reads[future]
+            try:
+                temperatures, values, elapsed = future.result()
+            except Exception as error:
+                summary.loc[index, "error"] = f"read: {error}"
+                continue
+            summary.loc[index, "read_time"] = elapsed
+            mode = jobs[index].mode
+            pending[mode].append((index, temperatures, values))
+            if sum(batch[1].size for batch in pending[mode]) >= max_batch:
+                compute(mode)
+        for mode in MODES:
+            if pending[mode]:
+                compute(mode)
+
+        for future in as_completed(writes):
+            index = writes[future]
+            try:
+                summary.loc[index, "write_time"] = future.result()
+            except Exception as error:
+                summary.loc[index, "error"] = f"write: {error}"
+    return summary
+
+
+def main(argv=None):
+    """
+    Compute a batch of input files from the command line.
+    argv: list of arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="Compute many temperature-density or temperature-pressure files "
+                                                 "with one pipeline, reading and writing them concurrently.")
+    parser.add_argument("inputs", nargs="*", metavar="INPUT",
+                        help="input files, directories or glob patterns (quote them), e.g. 'survey/*.xlsx'")
+    parser.add_argument("--manifest", metavar="FILE",
+                        help="text file listing one input per line, optionally followed by its mode and output file")
+    parser.add_argument("--mode", choices=list(MODES),
+                        help="mode of the INPUT files and of the manifest lines that give none")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR,
+                        help=f"directory of the outputs <input name>_results.<format> (default: {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument("--format", choices=list(WRITERS), default="dat", help="output format (default: dat)")
+    parser.add_argument("--precision", type=int, default=6,
+                        help="number of decimal places of the 'dat' output format (default: 6)")
+    parser.add_argument("--readers", type=int, default=DEFAULT_READERS,
+                        help=f"number of threads reading and writing files (default: {DEFAULT_READERS})")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help=f"number of points computed together (default: {DEFAULT_MAX_BATCH})")
+    parser.add_argument("--table", action="store_true",
+                        help="solve the pressure-mode volumes from a tabulated inverse EOS where it covers them")
+    parser.add_argument("--summary", metavar="FILE",
+                        help="tab-separated summary of every file (default: <output-dir>/batch_summary.tsv)")
+    args = parser.parse_args(argv)
+    if not args.inputs and args.manifest is None:
+        parser.error("give INPUT files or --manifest")
+    if args.inputs and args.mode is None:
+        parser.error("INPUT files need --mode")
+
+    jobs = (read_manifest(args.manifest, args.mode) if args.manifest is not None else []) + \
+        collect_inputs(args.inputs, args.mode)
+    assign_outputs(jobs, args.output_dir, args.format)
+
+    start = time.perf_counter()
+    pipeline = build_pipeline(args.table)
+    setup = time.perf_counter() - start
+    summary = run_batch(pipeline, jobs, args.format, args.precision, args.readers, args.max_batch)
+    elapsed = time.perf_counter() - start
+
+    summary_file = args.summary or os.path.join(args.output_dir, "batch_summary.tsv")
+    if os.path.dirname(summary_file):
+        os.makedirs(os.path.dirname(summary_file), exist_ok=True)
+    summary.to_csv(summary_file, sep="\t", index=False, columns=SUMMARY_COLUMNS)
+
+    errors = summary[summary["error"] != ""]
+    for row in errors.itertuples():
+        print(f"{row.file}: {row.error}")
+    rows = int(summary["rows"].sum())
+    print(f"{len(summary) - len(errors)} of {len(summary)} files, {rows} points computed in {elapsed:.2f} s "
+          f"(setup {setup:.2f} s, reading {summary['read_time'].sum():.2f} s, computing "
+          f"{summary['compute_time'].sum():.2f} s and writing {summary['write_time'].sum():.2f} s summed over files)")
+    failed = int(summary["failed"].sum())
+    if failed:
+        print(f"{failed} of {rows} points could not be calculated; their values are NaN")
+    print(f"\nThe results have been saved to '{args.output_dir}' and the summary to '{summary_file}'")
+
+
+if __name__ == "__main__":
+    main()
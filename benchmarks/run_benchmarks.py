@@ -0,0 +1,277 @@
+"""
+Benchmark suite for the elastic-property pipeline.
+
+Times every stage in density and pressure mode over a range of problem sizes, checks the
+fast paths against the reference implementations (the quad Debye integral, the scalar
+bisection solver and the matrix-based modulus calculator), and writes the results as JSON.
+Pass --baseline with an earlier results file to flag timing and accuracy regressions.
+
+Usage: python benchmarks/run_benchmarks.py [--sizes 100 1000 ...] [--output FILE] [--baseline FILE]
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thermal_P import Thermal
+from elastic_constants_calculator import ElasticConstantsCalculator
+from elastic_constants_convertion import ElasticConstantsConvertion
+from elastic_modulus_velocity_calculator import ElasticModulusAndVelocityCalculator, compute_modulus_and_velocity_batch
+from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import ElasticPipeline
+from instrumentation import PROFILER, disable_profiling, enable_profiling
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+
+# Input ranges inside the stability field of cubic CaSiO3
+T_RANGE = (1500.0, 3000.0)
+RHO_RANGE = (4.4, 5.4)
+P_RANGE = (20.0, 120.0)
+
+# Every timing repeats its call until this much time (s) has been spent on it
+MIN_TOTAL_SECONDS = 0.2
+
+# Accuracy limits of the fast paths against the reference implementations
+ACCURACY_LIMITS = {
+    "P_MGD_vs_quad_max_abs_GPa": 1e-8,
+    "find_volumes_residual_max_abs_GPa": 1e-6,
+    "find_volumes_vs_bisection_max_abs_A3": 0.05,
+    "modulus_batch_vs_matrix_max_rel": 1e-10,
+    "find_volumes_along_path_vs_find_volumes_max_abs_A3": 1e-6,
+}
+
+
+def make_inputs(size, seed=0):
+    """
+    Draw random state points.
+    size: number of points
+    seed: random seed
+    Returns: dictionary with temperatures, densities, volumes and pressures
+    """
+    rng = np.random.default_rng(seed)
+    th = Thermal()
+    temperatures = rng.uniform(*T_RANGE, size)
+    densities = rng.uniform(*RHO_RANGE, size)
+    return {
+        "T": temperatures,
+        "rho": densities,
+        "V": th.rho_to_V(densities),
+        "P": rng.uniform(*P_RANGE, size),
+        # Ordered path through the same ranges, like a geotherm sampled in depth
+        "path_T": np.linspace(*T_RANGE, size),
+        "path_P": np.linspace(*P_RANGE, size),
+    }
+
+
+def time_call(function, repeat, min_total=MIN_TOTAL_SECONDS):
+    """
+    Time a call, repeating it until it has run at least repeat times and for at least min_total seconds.
+    function: function without arguments
+    repeat: minimum number of repetitions; the fastest is reported
+    min_total: minimum total time of the repetitions (s), so that short calls are not timed on a single noisy run
+    Returns: best wall time (s)
+    """
+    best = np.inf
+    total = 0.0
+    runs = 0
+    while runs < repeat or total < min_total:
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        total += elapsed
+        runs += 1
+    return best
+
+
+def stage_benchmarks(inputs):
+    """
+    Build the benchmarked calls for one set of inputs.
+    inputs: dictionary returned by make_inputs
+    Returns: dictionary mapping the benchmark name to (function, is_reference)
+    """
+    th = Thermal()
+    inverse = InverseEOSCalculator(th)
+    calculator = ElasticConstantsCalculator()
+    convertion = ElasticConstantsConvertion()
+    pipeline = ElasticPipeline(th, calculator, convertion, inverse)
+    T, rho, V, P = inputs["T"], inputs["rho"], inputs["V"], inputs["P"]
+    c11, c12, c44 = calculator.calculate_elastic_constants(rho, T)
+
+    return {
+        "Thermal.P_MGD": (lambda: th.P_MGD(V, T), False),
+        "Thermal.P_MGD_quad": (lambda: [th.P_MGD_quad(v, t) for v, t in zip(V, T)], True),
+        "Thermal.alpha": (lambda: th.alpha(V, T), False),
+        "InverseEOSCalculator.find_volumes": (lambda: inverse.find_volumes(P, T), False),
+        "InverseEOSCalculator.find_volume": (lambda: [inverse.find_volume(p, t) for p, t in zip(P, T)], True),
+        "InverseEOSCalculator.find_volumes_path":
+            (lambda: inverse.find_volumes(inputs["path_P"], inputs["path_T"]), False),
+        "InverseEOSCalculator.find_volumes_along_path":
+            (lambda: inverse.find_volumes_along_path(inputs["path_P"], inputs["path_T"]), False),
+        "InverseEOSCalculator.calculate_density": (lambda: inverse.calculate_density(P, T), False),
+        "ElasticConstantsCalculator.calculate_elastic_constants":
+            (lambda: calculator.calculate_elastic_constants(rho, T), False),
+        "ElasticConstantsConvertion.adiabatic_elastic_constants":
+            (lambda: convertion.adiabatic_elastic_constants(th, V, T, c11, c12), False),
+        "compute_modulus_and_velocity_batch": (lambda: compute_modulus_and_velocity_batch(c11, c12, c44, rho), False),
+        "ElasticModulusAndVelocityCalculator":
+            (lambda: [ElasticModulusAndVelocityCalculator(*point).compute_modulus_and_velocity()
+                      for point in zip(c11, c12, c44, rho)], True),
+        "ElasticPipeline.density": (lambda: pipeline.compute("density", T, rho), False),
+        "ElasticPipeline.pressure": (lambda: pipeline.compute("pressure", T, P), False),
+    }
+
+
+def check_accuracy(n_points):
+    """
+    Compare the fast paths with the reference implementations.
+    n_points: number of random points checked
+    Returns: dictionary of error measures (see ACCURACY_LIMITS)
+    """
+    inputs = make_inputs(n_points, seed=1)
+    th = Thermal()
+    inverse = InverseEOSCalculator(th)
+    calculator = ElasticConstantsCalculator()
+    T, rho, V, P = inputs["T"], inputs["rho"], inputs["V"], inputs["P"]
+
+    P_fast = th.P_MGD(V, T)
+    P_quad = np.array([th.P_MGD_quad(v, t) for v, t in zip(V, T)])
+
+    V_fast, converged = inverse.find_volumes(P, T)
+    V_bisection = np.array([inverse.find_volume(p, t) for p, t in zip(P, T)])
+
+    # Debye-integral evaluations per point of the continuation solver against independent solves on a path;
+    # every continued point needs at least two pressure evaluations (four integrals) to verify its Newton step
+    counts = {}
+    enable_profiling()
+    try:
+        for name, solver in (("find_volumes", inverse.find_volumes),
+                             ("find_volumes_along_path", inverse.find_volumes_along_path)):
+            PROFILER.reset()
+            V_path = solver(inputs["path_P"], inputs["path_T"])[0]
+            counts[name] = (V_path, PROFILER.report()["counters"]["debye_evaluations"] / n_points)
+    finally:
+        disable_profiling()
+
+    c11, c12, c44 = calculator.calculate_elastic_constants(rho, T)
+    batch = compute_modulus_and_velocity_batch(c11, c12, c44, rho)
+    batch = np.column_stack([batch[key] for key in ("B_hill", "G_hill", "Vp_h", "Vs_h", "Vp_v", "Vs_v", "Vp_r", "Vs_r")])
+    matrix = np.array([ElasticModulusAndVelocityCalculator(*point).compute_modulus_and_velocity()
+                       for point in zip(c11, c12, c44, rho)])
+
+    return {
+        "P_MGD_vs_quad_max_abs_GPa": float(np.max(np.abs(P_fast - P_quad))),
+        "find_volumes_residual_max_abs_GPa": float(np.max(np.abs(th.P_MGD(V_fast, T) - P))),
+        "find_volumes_not_converged": int(np.count_nonzero(~converged)),
+        # The bisection reference stops at a 0.1 GPa pressure tolerance, which bounds this difference
+        "find_volumes_vs_bisection_max_abs_A3": float(np.max(np.abs(V_fast - V_bisection))),
+        "modulus_batch_vs_matrix_max_rel": float(np.nanmax(np.abs(batch - matrix) / np.abs(matrix))),
+        "find_volumes_along_path_vs_find_volumes_max_abs_A3":
+            float(np.max(np.abs(counts["find_volumes_along_path"][0] - counts["find_volumes"][0]))),
+        "find_volumes_debye_evaluations_per_point": counts["find_volumes"][1],
+        "find_volumes_along_path_debye_evaluations_per_point": counts["find_volumes_along_path"][1],
+    }
+
+
+def run(sizes, repeat, reference_max_size, accuracy_points):
+    """
+    Run all benchmarks.
+    sizes: problem sizes
+    repeat: repetitions per timing
+    reference_max_size: largest size at which the per-point reference implementations are timed
+    accuracy_points: number of points of the accuracy check
+    Returns: results dictionary
+    """
+    timings = []
+    for size in sizes:
+        inputs = make_inputs(size)
+        for name, (function, is_reference) in stage_benchmarks(inputs).items():
+            if is_reference and size > reference_max_size:
+                continue
+            seconds = time_call(function, 1 if is_reference else repeat)
+            timings.append({"name": name, "size": size, "seconds": seconds, "points_per_second": size / seconds})
+            print(f"{name:58s} {size:>9d} {seconds:12.6f} s")
+
+    accuracy = check_accuracy(accuracy_points)
+    for name, value in accuracy.items():
+        print(f"{name:58s} {value:.3e}")
+
+    return {
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "timings": timings,
+        "accuracy": accuracy,
+    }
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    Compare results with a baseline.
+    results: results dictionary of this run
+    baseline: results dictionary of the baseline run
+    tolerance: allowed relative slowdown (0.2 = 20 % slower)
+    min_seconds: timings whose baseline is below this are too noisy to compare and are skipped
+    Returns: list of regression messages
+    """
+    regressions = []
+    reference = {(entry["name"], entry["size"]): entry["seconds"] for entry in baseline["timings"]}
+    for entry in results["timings"]:
+        key = (entry["name"], entry["size"])
+        if key not in reference or reference[key] < min_seconds:
+            continue
+        if entry["seconds"] > reference[key] * (1 + tolerance):
+            regressions.append(f"{entry['name']} at {entry['size']} points: {entry['seconds']:.4g} s "
+                               f"vs {reference[key]:.4g} s in the baseline")
+
+    for name, limit in ACCURACY_LIMITS.items():
+        if results["accuracy"][name] > limit:
+            regressions.append(f"{name} = {results['accuracy'][name]:.3e} exceeds {limit:.1e}")
+    if results["accuracy"]["find_volumes_not_converged"]:
+        regressions.append(f"{results['accuracy']['find_volumes_not_converged']} points did not converge")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the elastic-property pipeline stages.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="problem sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per timing (the best is kept)")
+    parser.add_argument("--reference-max-size", type=int, default=1000,
+                        help="largest size at which the per-point reference implementations are timed")
+    parser.add_argument("--accuracy-points", type=int, default=500, help="number of points of the accuracy check")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown against the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="timings whose baseline is below this many seconds are not compared with it")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.reference_max_size, args.accuracy_points)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nThe results have been saved to '{args.output}'")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import numpy as np
+
+from elastic_modulus_velocity_calculator import compute_modulus_and_velocity_batch
+
+# Maximum number of point x direction Christoffel matrices solved at a time
+DEFAULT_MAX_MATRICES = 2**18
+
+# Per-point anisotropy metrics returned by anisotropy_metrics
+ANISOTROPY_COLUMNS = ["zener", "A_universal", "Vp_max", "Vp_min", "Vs_max", "Vs_min",
+                      "AVp", "AVs", "dVs_max", "AVs_split_max"]
+
+
+def fibonacci_sphere(n):
+    """
+    Generate nearly uniformly distributed unit vectors on the sphere (Fibonacci lattice).
+    n: Number of directions
+    Returns: (n, 3) array of unit vectors
+    """
+    i = np.arange(n) + 0.5
+    z = 1 - 2 * i / n
+    r = np.sqrt(1 - z**2)
+    phi = np.pi * (3 - np.sqrt(5)) * i
+    return np.column_stack([r * np.cos(phi), r * np.sin(phi), z])
+
+
+def normalize_directions(directions):
+    """
+    Scale propagation directions to unit length.
+    directions: (n, 3) array of direction vectors, e.g. Miller indices [[1, 0, 0], [1, 1, 0], [1, 1, 1]]
+    Returns: (n, 3) array of unit vectors
+    """
+    directions = np.atleast_2d(np.asarray(directions, dtype=float))
+    if directions.shape[-1] != 3:
+        raise ValueError(f"Directions must have 3 components, got shape {directions.shape}")
+    norm = np.linalg.norm(directions, axis=-1, keepdims=True)
+    if np.any(norm == 0):
+        raise ValueError("Directions must be non-zero vectors")
+    return directions / norm
+
+
+def christoffel_matrices(c11, c12, c44, directions):
+    """
+    Build the Christoffel matrices Gamma_ik = C_ijkl n_j n_l of cubic crystals.
+    c11, c12, c44: Elastic constants (GPa), arrays of shape (m,)
+    directions: (d, 3) array of unit propagation directions
+    Returns: (m, d, 3, 3) array of Christoffel matrices (GPa)
+    """
+    c11 = np.asarray(c11, dtype=float)[:, None]
+    c12 = np.asarray(c12, dtype=float)[:, None]
+    c44 = np.asarray(c44, dtype=float)[:, None]
+    n2 = directions**2
+    gamma = np.empty(c11.shape[:1] + directions.shape[:1] + (3, 3))
+    for i in range(3):
+        # Diagonal: C11 n_i^2 + C44 (1 - n_i^2) for unit n; off-diagonal: (C12 + C44) n_i n_k
+        gamma[:, :, i, i] = c44 + (c11 - c44) * n2[:, i]
+        for k in range(i + 1, 3):
+            gamma[:, :, i, k] = gamma[:, :, k, i] = (c12 + c44) * (directions[:, i] * directions[:, k])
+    return gamma
+
+
+def christoffel_velocities(c11, c12, c44, rho, directions, max_matrices=DEFAULT_MAX_MATRICES):
+    """
+    Solve the Christoffel equation for many state points and propagation directions with stacked
+    symmetric eigen-solves, in chunks of at most max_matrices matrices.
+    c11, c12, c44: Elastic constants (GPa), broadcastable arrays
+    rho: Densities (g/cm³), broadcastable with the constants
+    directions: (d, 3) array of propagation directions (normalized here)
+    max_matrices: Maximum number of 3x3 matrices per eigen-solve
+    Returns: Dictionary of phase velocities (km/s) with the keys 'Vp', 'Vs1' (fast shear) and 'Vs2'
+             (slow shear), each of shape (*points shape, d); NaN where a constant or the density is not finite
+    """
+    directions = normalize_directions(directions)
+    c11, c12, c44, rho = np.broadcast_arrays(*(np.asarray(value, dtype=float) for value in (c11, c12, c44, rho)))
+    shape = c11.shape
+    c11, c12, c44, rho = (np.ravel(value) for value in (c11, c12, c44, rho))
+    eigenvalues = np.full((c11.size, len(directions), 3), np.nan)
+
+    valid = np.flatnonzero(np.isfinite(c11) & np.isfinite(c12) & np.isfinite(c44) & np.isfinite(rho))
+    step = max(1, max_matrices // len(directions))
+    for start in range(0, valid.size, step):
+        index = valid[start:start + step]
+        eigenvalues[index] = np.linalg.eigvalsh(christoffel_matrices(c11[index], c12[index], c44[index], directions))
+
+    # rho v^2 = eigenvalue; GPa / (g/cm³) -> (km/s)^2. Negative eigenvalues (unstable crystals) give NaN
+    with np.errstate(invalid='ignore'):
+        velocities = np.sqrt(eigenvalues / rho[:, None, None])
+    velocities = velocities.reshape(shape + (len(directions), 3))
+    return {"Vp": velocities[..., 2], "Vs1": velocities[..., 1], "Vs2": velocities[..., 0]}
+
+
+def anisotropy_metrics(c11, c12, c44, velocities):
+    """
+    Calculate single-crystal anisotropy metrics of cubic crystals.
+    c11, c12, c44: Elastic constants (GPa), broadcastable arrays
+    velocities: Dictionary returned by christoffel_velocities
+    Returns: Dictionary of arrays with the keys of ANISOTROPY_COLUMNS:
+             zener: Zener ratio 2 C44 / (C11 - C12) (1 for an isotropic crystal)
+             A_universal: Universal anisotropy index 5 G_V / G_R + B_V / B_R - 6
+             Vp_max, Vp_min, Vs_max, Vs_min: Extreme P and S velocities over the directions (km/s)
+             AVp, AVs: Velocity anisotropy 200 (max - min) / (max + min) of P and S waves (%)
+             dVs_max: Maximum shear-wave splitting Vs1 - Vs2 over the directions (km/s)
+             AVs_split_max: Maximum relative shear-wave splitting 200 (Vs1 - Vs2) / (Vs1 + Vs2) (%)
+    """
+    c11, c12, c44 = (np.asarray(value, dtype=float) for value in (c11, c12, c44))
+    moduli = compute_modulus_and_velocity_batch(c11, c12, c44, 1.0)
+    Vp, Vs1, Vs2 = velocities["Vp"], velocities["Vs1"], velocities["Vs2"]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        metrics = {
+            "zener": 2 * c44 / (c11 - c12),
+            "A_universal": 5 * moduli["G_voigt"] / moduli["G_reuss"] + moduli["B_voigt"] / moduli["B_reuss"] - 6,
+            "Vp_max": Vp.max(axis=-1),
+            "Vp_min": Vp.min(axis=-1),
+            "Vs_max": Vs1.max(axis=-1),
+            "Vs_min": Vs2.min(axis=-1),
+            "dVs_max": (Vs1 - Vs2).max(axis=-1),
+            "AVs_split_max": (200 * (Vs1 - Vs2) / (Vs1 + Vs2)).max(axis=-1),
+        }
+        metrics["AVp"] = 200 * (metrics["Vp_max"] - metrics["Vp_min"]) / (metrics["Vp_max"] + metrics["Vp_min"])
+        metrics["AVs"] = 200 * (metrics["Vs_max"] - metrics["Vs_min"]) / (metrics["Vs_max"] + metrics["Vs_min"])
+    shape = Vp.shape[:-1]
+    return {key: np.broadcast_to(metrics[key], shape) for key in ANISOTROPY_COLUMNS}
+
+
+def directional_velocities(c11, c12, c44, rho, directions=None, n_directions=500, max_matrices=DEFAULT_MAX_MATRICES):
+    """
+    Calculate phase velocities over a set of directions and the anisotropy metrics.
+    c11, c12, c44: Elastic constants (GPa), broadcastable arrays
+    rho: Densities (g/cm³)
+    directions: (d, 3) array of propagation directions; a Fibonacci sphere of n_directions points if None
+    n_directions: Number of directions of the Fibonacci sphere
+    max_matrices: Maximum number of 3x3 matrices per eigen-solve
+    Returns: Unit directions, dictionary of velocities (see christoffel_velocities) and dictionary of metrics
+             (see anisotropy_metrics)
+    """
+    directions = fibonacci_sphere(n_directions) if directions is None else normalize_directions(directions)
+    velocities = christoffel_velocities(c11, c12, c44, rho, directions, max_matrices)
+    return directions, velocities, anisotropy_metrics(c11, c12, c44, velocities)
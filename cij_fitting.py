@@ -0,0 +1,314 @@
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from scipy.optimize import least_squares
+
+from elastic_constants_calculator import ElasticConstantsCalculator
+
+# Fitted constants, in the order of popt1, popt2 and popt3
+CIJ_NAMES = ("C11", "C12", "C44")
+
+# Reference density of the finite strain in ElasticConstantsCalculator.Cij_fit (g/cm³)
+REFERENCE_DENSITY = 4.17
+
+# Names of the entries of the full parameter vector, and the covariance key understood by uncertainty.sample_parameters
+FIT_PARAMETER_NAMES = [f"popt{i}[{j}]" for i in (1, 2, 3) for j in range(9)] + ["e0", "e1", "e2"]
+COVARIANCE_KEY = "popt1,popt2,popt3,e0,e1,e2"
+
+# Distances to the softening temperature below this value (K) are clamped while fitting
+MIN_SOFTENING_GAP = 1e-3
+
+
+def finite_strain(density):
+    """
+    Calculate the finite strain f used by Cij_fit.
+    density: Densities (g/cm³)
+    Returns: f = ((rho / rho0)^(2/3) - 1) / 2
+    """
+    return ((np.asarray(density, dtype=float) / REFERENCE_DENSITY) ** (2 / 3) - 1) * 0.5
+
+
+def design_matrix(f, t, e):
+    """
+    Build the basis of Cij_fit, which is linear in its nine coefficients a0..c2 for fixed e0, e1, e2.
+    f: Finite strains
+    t: Temperatures (K)
+    e: Softening-temperature terms (e0, e1, e2)
+    Returns: (n, 9) design matrix, and the distance to the softening temperature t - e0 - e1 f - e2 f^2 (K)
+    """
+    gap = t - e[0] - e[1] * f - e[2] * f**2
+    s = 1 / np.sqrt(np.maximum(gap, MIN_SOFTENING_GAP))
+    return np.column_stack([np.ones_like(f), f, f**2, t, f * t, f**2 * t, s, f * s, f**2 * s]), gap
+
+
+def _linear_fit(e, f, t, y, w):
+    """
+    Solve the linear coefficients of the three constants for fixed softening terms.
+    e: Softening-temperature terms (e0, e1, e2)
+    f, t: Finite strains and temperatures
+    y: (3, n) array of C11, C12 and C44 (GPa)
+    w: (3, n) array of weights (inverse uncertainties)
+    Returns: (3, 9) coefficients, (3, n) weighted residuals, (3, n) d(model)/d(gap) factors, the distance
+             to the softening temperature and the orthonormal bases of the three weighted design matrices
+    """
+    phi, gap = design_matrix(f, t, e)
+    coefficients = np.empty((3, 9))
+    residuals = np.empty_like(y)
+    bases = []
+    for i in range(3):
+        # Equilibrate the columns, whose magnitudes differ by several orders, before the QR factorization
+        A = w[i][:, None] * phi
+        scale = np.linalg.norm(A, axis=0)
+        scale[scale == 0] = 1
+        Q, R = np.linalg.qr(A / scale)
+        coefficients[i] = np.linalg.solve(R, Q.T @ (w[i] * y[i])) / scale
+        residuals[i] = w[i] * y[i] - A @ coefficients[i]
+        bases.append(Q)
+
+    # d(model)/de_k = (c0 + c1 f + c2 f^2) / 2 * gap^(-3/2) * (1, f, f^2)_k where the gap is not clamped
+    singular = coefficients[:, 6:9] @ np.vstack([np.ones_like(f), f, f**2])
+    factor = np.where(gap > MIN_SOFTENING_GAP, 0.5 * singular * np.maximum(gap, MIN_SOFTENING_GAP) ** -1.5, 0.0)
+    return coefficients, residuals, factor, gap, bases
+
+
+def _projected_residuals(e, f, t, y, w):
+    """
+    Weighted residuals of the three constants with their linear coefficients eliminated (variable projection).
+    e: Softening-temperature terms (e0, e1, e2)
+    f, t: Finite strains and temperatures
+    y: (3, n) array of C11, C12 and C44 (GPa)
+    w: (3, n) array of weights
+    Returns: (3 n,) residuals
+    """
+    return _linear_fit(e, f, t, y, w)[1].ravel()
+
+
+def _projected_jacobian(e, f, t, y, w):
+    """
+    Kaufman's approximation of the Jacobian of the variable-projection residuals with respect to e0, e1, e2.
+    """
+    coefficients, residuals, factor, gap, bases = _linear_fit(e, f, t, y, w)
+    powers = np.vstack([np.ones_like(f), f, f**2])
+    jacobian = np.empty((3, f.size, 3))
+    for i, Q in enumerate(bases):
+        derivative = w[i][:, None] * (factor[i][:, None] * powers.T)
+        jacobian[i] = -(derivative - Q @ (Q.T @ derivative))
+    return jacobian.reshape(3 * f.size, 3)
+
+
+def full_jacobian(e, coefficients, f, t, w):
+    """
+    Jacobian of the weighted residuals of all three constants with respect to the 30 parameters
+    (popt1, popt2, popt3, e0, e1, e2), see FIT_PARAMETER_NAMES.
+    e: Softening-temperature terms
+    coefficients: (3, 9) coefficients
+    f, t: Finite strains and temperatures
+    w: (3, n) weights
+    Returns: (3 n, 30) Jacobian
+    """
+    phi, gap = design_matrix(f, t, e)
+    singular = coefficients[:, 6:9] @ np.vstack([np.ones_like(f), f, f**2])
+    factor = np.where(gap > MIN_SOFTENING_GAP, 0.5 * singular * np.maximum(gap, MIN_SOFTENING_GAP) ** -1.5, 0.0)
+    jacobian = np.zeros((3, f.size, 30))
+    for i in range(3):
+        jacobian[i, :, 9 * i:9 * i + 9] = -w[i][:, None] * phi
+        jacobian[i, :, 27:30] = -(w[i] * factor[i])[:, None] * np.vstack([np.ones_like(f), f, f**2]).T
+    return jacobian.reshape(3 * f.size, 30)
+
+
+def _solve_start(e_start, f, t, y, w, max_evaluations):
+    """
+    Run one local variable-projection fit from a starting point of the softening terms.
+    Returns: Fitted softening terms, final cost and whether the optimizer reported success
+    """
+    solution = least_squares(_projected_residuals, e_start, jac=_projected_jacobian, args=(f, t, y, w),
+                             method="trf", x_scale="jac", max_nfev=max_evaluations)
+    return solution.x, solution.cost, bool(solution.success)
+
+
+def generate_starts(e_initial, f, t, n_starts, spread=0.5, seed=None):
+    """
+    Generate starting points of the softening terms around an initial guess. Only points whose softening
+    temperature lies below every data temperature are kept.
+    e_initial: Initial (e0, e1, e2)
+    f, t: Finite strains and temperatures of the data
+    n_starts: Number of starting points, including the initial guess
+    spread: Relative standard deviation of the perturbations
+    seed: Seed of the random number generator
+    Returns: (n, 3) array of starting points
+    """
+    e_initial = np.asarray(e_initial, dtype=float)
+    if np.any(t - e_initial[0] - e_initial[1] * f - e_initial[2] * f**2 <= 0):
+        raise ValueError("The initial softening terms put data points at or below the softening temperature")
+    rng = np.random.default_rng(seed)
+    scale = spread * np.maximum(np.abs(e_initial), 1.0)
+    starts = [e_initial]
+    for _ in range(100 * n_starts):
+        if len(starts) >= n_starts:
+            break
+        candidate = e_initial + scale * rng.standard_normal(3)
+        if np.all(t - candidate[0] - candidate[1] * f - candidate[2] * f**2 > 0):
+            starts.append(candidate)
+    return np.array(starts)
+
+
+class CijFitResult:
+    def __init__(self, coefficients, e, covariance, residuals, cost, n_points, n_starts, n_successful):
+        """
+        Result of fit_elastic_constants.
+        coefficients: (3, 9) coefficients of C11, C12 and C44 (popt1, popt2, popt3)
+        e: Softening-temperature terms (e0, e1, e2)
+        covariance: (30, 30) covariance of the parameters, ordered as FIT_PARAMETER_NAMES
+        residuals: (3, n) unweighted residuals, data minus model (GPa)
+        cost: Half the sum of squared weighted residuals
+        n_points: Number of data points per constant
+        n_starts: Number of starting points tried
+        n_successful: Number of local fits that converged
+        """
+        self.popt1, self.popt2, self.popt3 = (list(map(float, row)) for row in coefficients)
+        self.e0, self.e1, self.e2 = map(float, e)
+        self.covariance = covariance
+        self.residuals = residuals
+        self.cost = cost
+        self.n_points = n_points
+        self.n_starts = n_starts
+        self.n_successful = n_successful
+
+    def rms(self):
+        """
+        Returns: Dictionary of the root-mean-square residual of C11, C12 and C44 (GPa)
+        """
+        return {name: float(np.sqrt(np.mean(residual**2))) for name, residual in zip(CIJ_NAMES, self.residuals)}
+
+    def standard_errors(self):
+        """
+        Returns: Dictionary mapping each name of FIT_PARAMETER_NAMES to its standard error
+        """
+        return dict(zip(FIT_PARAMETER_NAMES, np.sqrt(np.diag(self.covariance)).tolist()))
+
+    def covariances(self):
+        """
+        Returns: The covariance under COVARIANCE_KEY, as taken by uncertainty.sample_parameters
+        """
+        return {COVARIANCE_KEY: self.covariance}
+
+    def apply(self, calculator):
+        """
+        Set the fitted parameters on an ElasticConstantsCalculator.
+        calculator: An instance of the ElasticConstantsCalculator class
+        """
+        calculator.set_fitting_parameters(self.popt1, self.popt2, self.popt3, self.e0, self.e1, self.e2)
+
+    def save(self, filename):
+        """
+        Write the parameters, the fit statistics and the covariance as JSON; the file can be passed to
+        uncertainty.load_parameter_uncertainties (main.py --uncertainty).
+        filename: Output file name
+        """
+        data = {"popt1": self.popt1, "popt2": self.popt2, "popt3": self.popt3,
+                "e0": self.e0, "e1": self.e1, "e2": self.e2,
+                "rms": self.rms(), "n_points": self.n_points,
+                "starts": {"tried": self.n_starts, "converged": self.n_successful},
+                "covariance": {COVARIANCE_KEY: self.covariance.tolist()}}
+        with open(filename, 'w') as f:
+            json.dump(data, f, indent=2)
+
+
+def fit_elastic_constants(density, temperature, constants, sigma=None, absolute_sigma=False, initial=None,
+                          n_starts=16, spread=0.5, workers=None, seed=None, max_evaluations=200):
+    """
+    Fit Cij_fit jointly to tabulated C11, C12 and C44, with the softening-temperature terms e0, e1, e2 shared
+    by the three constants.
+    For fixed e0, e1, e2 the model is linear in the 27 coefficients, which are eliminated by weighted linear
+    least squares (variable projection); the remaining 3-parameter problem is solved with an analytic Jacobian
+    from several starting points, in parallel when workers > 1, and the best fit is kept. The covariance is
+    computed from the analytic Jacobian of all 30 parameters at the optimum.
+    density: Densities (g/cm³)
+    temperature: Temperatures (K)
+    constants: (3, n) array of C11, C12 and C44 (GPa)
+    sigma: Optional uncertainties of the constants (GPa), broadcastable to (3, n)
+    absolute_sigma: If True, sigma are absolute uncertainties; otherwise the covariance is scaled by the
+                    reduced chi-square, as in scipy.optimize.curve_fit
+    initial: ElasticConstantsCalculator providing the initial e0, e1, e2 (default parameters if None)
+    n_starts: Number of starting points of the softening terms, see generate_starts
+    spread: Relative spread of the starting points
+    workers: Number of worker processes for the starting points; run in this process if None or 1
+    seed: Seed of the starting points
+    max_evaluations: Maximum number of residual evaluations per start
+    Returns: CijFitResult
+    """
+    density = np.ravel(np.asarray(density, dtype=float))
+    t = np.ravel(np.asarray(temperature, dtype=float))
+    y = np.asarray(constants, dtype=float).reshape(3, -1)
+    w = 1 / np.broadcast_to(np.asarray(1.0 if sigma is None else sigma, dtype=float), y.shape)
+    if not (density.size == t.size == y.shape[1]):
+        raise ValueError("density, temperature and constants must have the same number of points")
+    if density.size < 10:
+        raise ValueError("At least 10 points are needed to fit the 9 coefficients of each constant")
+    f = finite_strain(density)
+
+    initial = initial if initial is not None else ElasticConstantsCalculator()
+    starts = generate_starts([initial.e0, initial.e1, initial.e2], f, t, n_starts, spread, seed)
+    solve = partial(_solve_start, f=f, t=t, y=y, w=w, max_evaluations=max_evaluations)
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            solutions = list(executor.map(solve, starts))
+    else:
+        solutions = [solve(start) for start in starts]
+
+    # Keep the best start whose softening temperature stays below every data point
+    feasible = [solution for solution in solutions
+                if np.all(t - solution[0][0] - solution[0][1] * f - solution[0][2] * f**2 > MIN_SOFTENING_GAP)]
+    if not feasible:
+        raise RuntimeError("No start converged to softening terms below the data temperatures")
+    e = min(feasible, key=lambda solution: solution[1])[0]
+    coefficients, weighted_residuals = _linear_fit(e, f, t, y, w)[:2]
+    cost = 0.5 * float(np.sum(weighted_residuals**2))
+
+    # Covariance from the SVD of the column-equilibrated Jacobian; singular directions are dropped
+    jacobian = full_jacobian(e, coefficients, f, t, w)
+    scale = np.linalg.norm(jacobian, axis=0)
+    scale[scale == 0] = 1
+    _, singular_values, vt = np.linalg.svd(jacobian / scale, full_matrices=False)
+    keep = singular_values > np.finfo(float).eps * max(jacobian.shape) * singular_values[0]
+    covariance = (vt[keep].T / singular_values[keep]**2) @ vt[keep] / np.outer(scale, scale)
+    if not absolute_sigma:
+        covariance *= 2 * cost / max(y.size - 30, 1)
+
+    return CijFitResult(coefficients, e, covariance, weighted_residuals / w, cost, density.size,
+                        len(starts), sum(solution[2] for solution in solutions))
+
+
+def main(argv=None):
+    """
+    Fit Cij_fit to a table of elastic constants from the command line and write the parameters as JSON.
+    argv: list of arguments (defaults to sys.argv[1:])
+    """
+    from data_io import read_cij_table
+
+    parser = argparse.ArgumentParser(description="Fit the Cij_fit parameterization to tabulated C11, C12 and C44.")
+    parser.add_argument("input", help="table with the columns density (g/cm^3), temperature (K), C11, C12, C44 (GPa) "
+                                      "and optionally their uncertainties; .dat, .csv or .xlsx")
+    parser.add_argument("--output", default="cij_fit.json", help="output JSON file (default: cij_fit.json)")
+    parser.add_argument("--starts", type=int, default=16, help="number of starting points (default: 16)")
+    parser.add_argument("--workers", type=int, metavar="N", help="run the starting points on N worker processes")
+    parser.add_argument("--seed", type=int, help="random seed of the starting points")
+    parser.add_argument("--absolute-sigma", action="store_true",
+                        help="treat the uncertainty columns as absolute instead of relative weights")
+    args = parser.parse_args(argv)
+
+    density, temperature, constants, sigma = read_cij_table(args.input)
+    result = fit_elastic_constants(density, temperature, constants, sigma, args.absolute_sigma,
+                                   n_starts=args.starts, workers=args.workers, seed=args.seed)
+    result.save(args.output)
+    for name, rms in result.rms().items():
+        print(f"{name}: RMS residual {rms:.4f} GPa")
+    print(f"e0 = {result.e0:.6g}, e1 = {result.e1:.6g}, e2 = {result.e2:.6g}")
+    print(f"\nThe fitted parameters have been saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import PROFILER
+from pipeline import COLUMNS, status_summary
+
+# Number of rows read, computed and written at a time in streaming mode
+DEFAULT_CHUNK_SIZE = 100000
+
+# Columns of the pipeline results written to .dat files, and their header
+DAT_COLUMNS = ["T", "rho", "P", "V", "C11", "C12", "C44", "B_hill", "G_hill", "Vp_h", "Vs_h"]
+DAT_HEADER = "# Temperature(K)\tDensity(g/cm^3)\tPressure(GPa)\tVolume(A^3)\tC11(GPa)\tC12(GPa)\tC44(GPa)\tB(GPa)\tG(GPa)\tVp_h(km/s)\tVs_h(km/s)\n"
+
+# Columns written by the output writers: every pipeline column and the per-point status
+RESULT_COLUMNS = COLUMNS + ["status"]
+
+# Units of the result columns
+COLUMN_UNITS = {"model": "", "depth": "km", "Tp": "K", "level": "", "T": "K", "rho": "g/cm^3", "P": "GPa", "V": "A^3",
+                "status": ""}
+COLUMN_UNITS.update({column: "GPa" for column in COLUMNS if column[0] in "CBG"})
+COLUMN_UNITS.update({column: "km/s" for column in COLUMNS if column.startswith("V") and column != "V"})
+COLUMN_UNITS.update({"zener": "", "A_universal": "", "Vp_max": "km/s", "Vp_min": "km/s", "Vs_max": "km/s",
+                     "Vs_min": "km/s", "AVp": "%", "AVs": "%", "dVs_max": "km/s", "AVs_split_max": "%"})
+COLUMN_UNITS.update({"drho_dT": "g/cm^3/K", "drho_dP": "g/cm^3/GPa", "dVp_dT": "km/s/K", "dVs_dT": "km/s/K",
+                     "dVp_dP": "km/s/GPa", "dVs_dP": "km/s/GPa"})
+COLUMN_UNITS.update({"Vp_obs": "km/s", "Vs_obs": "km/s", "Vp": "km/s", "Vs": "km/s", "misfit": "", "converged": "",
+                     "n_solutions": "", "T_alt": "K", "P_alt": "GPa", "misfit_alt": "", "iterations": ""})
+
+# Integer columns: the per-point status, the model index of multi-model runs, the refinement level of adaptive
+# samples and the inversion flags and counts
+INTEGER_COLUMNS = {"status": np.int8, "model": np.int32, "level": np.int8, "converged": np.int8,
+                   "n_solutions": np.int32, "iterations": np.int32}
+
+# First bytes of the raw binary result files
+BINARY_MAGIC = b"CAPVRES1"
+
+
+def file_type_from_name(filename):
+    """
+    Infer the input file type from the file extension
+    filename: file path
+    Returns: 'dat', 'csv' or 'xlsx'
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".xlsx", ".xls"):
+        return "xlsx"
+    if extension == ".csv":
+        return "csv"
+    return "dat"
+
+
+def read_data_chunks(filename, filetype=None, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Read temperature and density or pressure data from a file in fixed-size chunks
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    chunksize: number of rows per chunk
+    Yields: arrays of temperatures and density or pressure for each chunk
+    """
+    filetype = filetype or file_type_from_name(filename)
+    if filetype in ('dat', 'csv'):
+        # pandas' C parser reads the text in chunks without loading the whole file
+        separator = r'\s+' if filetype == 'dat' else ','
+        reader = pd.read_csv(filename, sep=separator, header=None, comment='#', usecols=[0, 1],
+                             dtype=float, engine='c', chunksize=chunksize)
+        with reader:
+            for chunk in reader:
+                data = chunk.to_numpy()
+                yield data[:, 0], data[:, 1]
+    elif filetype == 'xlsx' and os.path.splitext(filename)[1].lower() == '.xls':
+        # openpyxl cannot open the legacy binary format; xlrd reads it whole
+        try:
+            data = pd.read_excel(filename, engine='xlrd', usecols=[0, 1]).to_numpy(dtype=float)
+        except ImportError:
+            raise ValueError(f"Reading the legacy .xls file {filename} needs the xlrd package; "
+                             f"install it or save the file as .xlsx") from None
+        for start in range(0, len(data), chunksize):
+            yield data[start:start + chunksize, 0], data[start:start + chunksize, 1]
+    elif filetype == 'xlsx':
+        # openpyxl's read-only mode streams the rows; the first row is the header, as with pd.read_excel
+        from openpyxl import load_workbook
+        workbook = load_workbook(filename, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(min_row=2, max_col=2, values_only=True)
+            while True:
+                data = np.array([row for _, row in zip(range(chunksize), rows)], dtype=float)
+                if data.size == 0:
+                    break
+                yield data[:, 0], data[:, 1]
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Unsupported file type")
+
+
+def read_points(filename, filetype=None):
+    """
+    Read a whole two-column file of temperatures and densities or pressures with the chunked readers of
+    read_data_chunks (pandas' C parser for text, openpyxl's read-only mode for Excel)
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    Returns: arrays of temperatures and density or pressure
+    """
+    chunks = list(read_data_chunks(filename, filetype))
+    if not chunks:
+        return np.empty(0), np.empty(0)
+    return np.concatenate([chunk[0] for chunk in chunks]), np.concatenate([chunk[1] for chunk in chunks])
+
+
+def _read_table(filename, filetype=None, n_columns=None):
+    """
+    Read a whole numeric table
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    n_columns: accepted numbers of columns; any if None
+    Returns: 2-D array with one row per line
+    """
+    filetype = filetype or file_type_from_name(filename)
+    if filetype == 'dat':
+        data = np.loadtxt(filename, ndmin=2)
+    elif filetype == 'csv':
+        data = np.loadtxt(filename, delimiter=',', ndmin=2)
+    elif filetype == 'xlsx':
+        data = pd.read_excel(filename).to_numpy(dtype=float)
+    else:
+        raise ValueError("Unsupported file type")
+    if n_columns is not None and data.shape[1] not in n_columns:
+        raise ValueError(f"{filename} has {data.shape[1]} columns, expected {' or '.join(map(str, n_columns))}")
+    return data
+
+
+def read_depth_table(filename, filetype=None):
+    """
+    Read an ordered depth profile with the columns depth (km), temperature (K) and pressure (GPa)
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    Returns: arrays of depths, temperatures and pressures
+    """
+    data = _read_table(filename, filetype, n_columns=(3,))
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def read_cij_table(filename, filetype=None):
+    """
+    Read tabulated elastic constants with the columns density (g/cm³), temperature (K), C11, C12 and C44 (GPa),
+    optionally followed by the uncertainties of C11, C12 and C44 (GPa)
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    Returns: arrays of densities and temperatures, a (3, n) array of C11, C12 and C44, and a (3, n) array of
+             their uncertainties or None
+    """
+    data = _read_table(filename, filetype, n_columns=(5, 8))
+    sigma = data[:, 5:8].T if data.shape[1] == 8 else None
+    return data[:, 0], data[:, 1], data[:, 2:5].T, sigma
+
+
+def read_observations(filename, filetype=None):
+    """
+    Read observed velocities with the columns pressure (GPa), Vp and Vs (km/s), or only Vp and Vs
+    filename: file path
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    Returns: arrays of Vp and Vs, and the array of pressures or None
+    """
+    data = _read_table(filename, filetype, n_columns=(2, 3))
+    if data.shape[1] == 2:
+        return data[:, 0], data[:, 1], None
+    return data[:, 1], data[:, 2], data[:, 0]
+
+
+class TextWriter:
+    def __init__(self, filename, columns=RESULT_COLUMNS, precision=6):
+        """
+        Write pipeline results to a tab-separated text file, appending chunk by chunk.
+        filename: output file name
+        columns: result columns to write
+        precision: number of decimal places of the floating-point columns
+        """
+        self.filename = filename
+        self.columns = list(columns)
+        self.fmt = "\t".join("%d" if column in INTEGER_COLUMNS else f"%.{precision}f" for column in self.columns)
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.filename, 'w')
+        self.file.write("# " + "\t".join(f"{column}({COLUMN_UNITS[column]})" if COLUMN_UNITS.get(column) else column
+                                         for column in self.columns) + "\n")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+    def write(self, results):
+        """
+        Append a chunk of results.
+        results: DataFrame returned by ElasticPipeline.run
+        """
+        np.savetxt(self.file, results[self.columns].to_numpy(), fmt=self.fmt)
+
+
+class NpyWriter:
+    def __init__(self, filename, columns=RESULT_COLUMNS):
+        """
+        Write pipeline results to a .npy file holding a structured array with one field per column.
+        Chunks are collected in memory and written when the writer is closed.
+        filename: output file name
+        columns: result columns to write
+        """
+        self.filename = filename
+        self.columns = list(columns)
+        self.chunks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save(pd.concat(self.chunks, ignore_index=True) if self.chunks else pd.DataFrame(columns=self.columns))
+
+    def write(self, results):
+        """
+        Add a chunk of results.
+        results: DataFrame returned by ElasticPipeline.run
+        """
+        self.chunks.append(results[self.columns])
+
+    def save(self, results):
+        """
+        Write the collected results.
+        results: DataFrame of all chunks
+        """
+        dtype = [(column, INTEGER_COLUMNS.get(column, np.float64)) for column in self.columns]
+        array = np.zeros(len(results), dtype=dtype)
+        for column in self.columns:
+            array[column] = results[column].to_numpy()
+        np.save(self.filename, array)
+
+
+class NpzWriter(NpyWriter):
+    """
+    Write pipeline results to an .npz archive holding one array per column.
+    """
+    def save(self, results):
+        """
+        Write the collected results.
+        results: DataFrame of all chunks
+        """
+        np.savez(self.filename, **{column: results[column].to_numpy(dtype=INTEGER_COLUMNS.get(column, np.float64))
+                                   for column in self.columns})
+
+
+class BinaryWriter:
+    def __init__(self, filename, columns=RESULT_COLUMNS):
+        """
+        Write pipeline results to a raw little-endian float64 file, appending chunk by chunk.
+        The file starts with BINARY_MAGIC, the row count and column count (uint64), the length of a
+        JSON header (uint64) and the header itself, padded to a multiple of 64 bytes; the row-major
+        (rows, columns) data follows and can be memory-mapped with read_binary.
+        filename: output file name
+        columns: result columns to write
+        """
+        self.filename = filename
+        self.columns = list(columns)
+        self.rows = 0
+        self.file = None
+
+    def __enter__(self):
+        header = json.dumps({"columns": self.columns, "units": [COLUMN_UNITS.get(column, "") for column in self.columns],
+                             "dtype": "<f8"}).encode()
+        prefix_size = len(BINARY_MAGIC) + 3 * 8
+        header += b" " * (-(prefix_size + len(header)) % 64)
+        self.file = open(self.filename, 'wb')
+        self.file.write(BINARY_MAGIC)
+        self.file.write(np.array([0, len(self.columns), len(header)], dtype="<u8").tobytes())
+        self.file.write(header)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The row count is only known at the end, so patch it into the prefix
+        self.file.seek(len(BINARY_MAGIC))
+        self.file.write(np.array([self.rows], dtype="<u8").tobytes())
+        self.file.close()
+
+    def write(self, results):
+        """
+        Append a chunk of results.
+        results: DataFrame returned by ElasticPipeline.run
+        """
+        self.file.write(np.ascontiguousarray(results[self.columns].to_numpy(dtype="<f8")).tobytes())
+        self.rows += len(results)
+
+
+def read_binary(filename):
+    """
+    Memory-map a file written by BinaryWriter.
+    filename: file name
+    Returns: read-only (rows, columns) float64 memory map and the list of column names
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{filename} is not a result binary file")
+        rows, n_columns, header_size = np.frombuffer(f.read(3 * 8), dtype="<u8")
+        header = json.loads(f.read(int(header_size)).decode())
+    offset = len(BINARY_MAGIC) + 3 * 8 + int(header_size)
+    data = np.memmap(filename, dtype="<f8", mode='r', offset=offset, shape=(int(rows), int(n_columns)))
+    return data, header["columns"]
+
+
+# Output writers by format name
+WRITERS = {
+    "dat": TextWriter,
+    "npy": NpyWriter,
+    "npz": NpzWriter,
+    "bin": BinaryWriter,
+}
+
+
+def open_writer(filename, fmt="dat", columns=RESULT_COLUMNS, precision=6):
+    """
+    Create the writer for an output format.
+    filename: output file name
+    fmt: output format, one of WRITERS
+    columns: result columns to write
+    precision: number of decimal places (text format only)
+    Returns: writer, to be used as a context manager
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported output format '{fmt}', expected one of {list(WRITERS)}")
+    if fmt == "dat":
+        return TextWriter(filename, columns, precision)
+    return WRITERS[fmt](filename, columns)
+
+
+def save_results(filename, results, fmt="dat", columns=RESULT_COLUMNS, precision=6):
+    """
+    Save pipeline results in one of the output formats.
+    filename: output file name
+    results: DataFrame returned by ElasticPipeline.run
+    fmt: output format, one of WRITERS
+    columns: result columns to write
+    precision: number of decimal places (text format only)
+    """
+    with open_writer(filename, fmt, columns, precision) as writer:
+        writer.write(results)
+
+
+def stream_file(pipeline, mode, input_filename, output_filename, filetype=None, chunksize=DEFAULT_CHUNK_SIZE,
+                fmt="dat", precision=6):
+    """
+    Compute a large input file chunk by chunk and append the results to the output file,
+    so that memory use does not depend on the file size.
+    pipeline: ElasticPipeline instance
+    mode: 'density' or 'pressure'
+    input_filename: two-column input file (temperature, density/pressure)
+    output_filename: output file
+    filetype: input file type, inferred from the extension if None
+    chunksize: number of rows per chunk
+    fmt: output format, one of WRITERS; the 'npy' and 'npz' writers hold all results until the end
+    precision: number of decimal places (text format only)
+    Returns: number of rows processed and a dictionary of failure reasons and their counts
+    """
+    total = 0
+    failures = {}
+    chunks = read_data_chunks(input_filename, filetype, chunksize)
+    with open_writer(output_filename, fmt, precision=precision) as writer:
+        while True:
+            with PROFILER.stage("read"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            results = pipeline.run(mode, *chunk)
+            with PROFILER.stage("write"):
+                writer.write(results)
+            total += len(results)
+            for reason, count in status_summary(results["status"]).items():
+                failures[reason] = failures.get(reason, 0) + count
+    return total, failures
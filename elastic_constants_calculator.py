@@ -32,6 +32,45 @@ class ElasticConstantsCalculator:
                  (c0 + c1 * f + c2 * f ** 2) / np.sqrt(denominator)
         return result
 
+    def Cij_fit_derivatives(self, d, t, a0, a1, a2, b0, b1, b2, c0, c1, c2):
+        """
+        Partial derivatives of the fitting function with respect to density and temperature.
+        d: Input density (g/cm³)
+        t: Input temperature (K)
+        Returns: dCij/d(density) (GPa/(g/cm³)) and dCij/dT (GPa/K); NaN where Cij_fit is undefined
+        """
+        d0 = 4.17
+        f = ((d / d0) ** (2 / 3) - 1) * 0.5
+        df_dd = (2 * f + 1) / (3 * d)
+        denominator = (t - self.e0 - self.e1 * f - self.e2 * f ** 2)
+        denominator = np.where(denominator > 0, denominator, np.nan)
+        singular = c0 + c1 * f + c2 * f ** 2
+        dC_dt = (b0 + b1 * f + b2 * f ** 2) - 0.5 * singular * denominator ** -1.5
+        dC_df = (a1 + 2 * a2 * f) + (b1 + 2 * b2 * f) * t + (c1 + 2 * c2 * f) / np.sqrt(denominator) + \
+                0.5 * singular * denominator ** -1.5 * (self.e1 + 2 * self.e2 * f)
+        return dC_df * df_dd, dC_dt
+
+    def softening_temperature(self, density_value):
+        """
+        Calculate the softening temperature e0 + e1 * f + e2 * f^2 below which Cij_fit is undefined.
+        density_value: Density (g/cm³)
+        Returns: Softening temperature (K)
+        """
+        d0 = 4.17
+        f = ((np.asarray(density_value, dtype=float) / d0) ** (2 / 3) - 1) * 0.5
+        return self.e0 + self.e1 * f + self.e2 * f ** 2
+
+    def softening_temperature_derivative(self, density_value):
+        """
+        Calculate the derivative of the softening temperature with respect to density.
+        density_value: Density (g/cm³)
+        Returns: dT_c/d(density) (K/(g/cm³))
+        """
+        d0 = 4.17
+        density_value = np.asarray(density_value, dtype=float)
+        f = ((density_value / d0) ** (2 / 3) - 1) * 0.5
+        return (self.e1 + 2 * self.e2 * f) * (2 * f + 1) / (3 * density_value)
+
     def calculate_elastic_constants(self, density_value, temperature_value):
         """
         Calculate the elastic constants C11, C12, and C44 for the given density and temperature.
@@ -42,13 +81,29 @@ class ElasticConstantsCalculator:
 
         return c11_value, c12_value, c44_value
 
-    def set_fitting_parameters(self, popt1, popt2, popt3):
+    def elastic_constant_derivatives(self, density_value, temperature_value):
+        """
+        Calculate the partial derivatives of C11, C12 and C44 with respect to density and temperature.
+        Returns: Tuples (dC11, dC12, dC44) with respect to density (GPa/(g/cm³)) and to temperature (GPa/K)
+        """
+        derivatives = [self.Cij_fit_derivatives(density_value, temperature_value, *popt)
+                       for popt in (self.popt1, self.popt2, self.popt3)]
+        return tuple(d[0] for d in derivatives), tuple(d[1] for d in derivatives)
+
+    def set_fitting_parameters(self, popt1, popt2, popt3, e0=None, e1=None, e2=None):
         """
         Set fitting parameters. Use this method to update the fitting parameters if new ones are available.
+        e0, e1, e2: Optional new softening-temperature terms shared by the three constants; kept if None
         """
         self.popt1 = popt1
         self.popt2 = popt2
         self.popt3 = popt3
+        if e0 is not None:
+            self.e0 = e0
+        if e1 is not None:
+            self.e1 = e1
+        if e2 is not None:
+            self.e2 = e2
 # In[10]:
 
 
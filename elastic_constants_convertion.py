@@ -35,3 +35,18 @@ class ElasticConstantsConvertion:
         corrected_c11 = c11 + dc
         corrected_c12 = c12 + dc
         return corrected_c11, corrected_c12
+
+    def adiabatic_correction_derivatives(self, th, volume, temperature):
+        """
+        Calculate the partial derivatives of the adiabatic correction dc = T alpha Bt0 gamma added to C11 and C12.
+        th: An instance of the Thermal class used to calculate the thermal expansion coefficient alpha
+        volume: Current volume (A^3)
+        temperature: Current temperature (K)
+        Returns: d(dc)/dV at constant temperature (GPa/A^3) and d(dc)/dT at constant volume (GPa/K)
+        """
+        alpha = th.alpha(volume, temperature)
+        dalpha_dV, dalpha_dT = th.alpha_derivatives(volume, temperature)
+        gamma = self.gamma(volume)
+        ddc_dV = temperature * self.Bt0 * (dalpha_dV * gamma + alpha * self.q * gamma / volume)
+        ddc_dT = self.Bt0 * gamma * (alpha + temperature * dalpha_dT)
+        return ddc_dV, ddc_dT
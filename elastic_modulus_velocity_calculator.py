@@ -49,3 +49,78 @@ class ElasticModulusAndVelocityCalculator:
 
         return B_hill, G_hill, Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r
 
+
+def compute_modulus_and_velocity_batch(c11, c12, c44, rho):
+    """
+    Calculate the elastic moduli and wave velocities for arrays of data points with the
+    closed-form Voigt and Reuss bounds of a cubic crystal.
+    c11: C11 elastic constants (GPa), scalar or array
+    c12: C12 elastic constants (GPa), broadcastable with c11
+    c44: C44 elastic constants (GPa), broadcastable with c11
+    rho: Densities (g/cm³), broadcastable with c11
+    Returns: Dictionary of arrays with the keys B_voigt, G_voigt, B_reuss, G_reuss, B_hill, G_hill,
+             Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r
+    """
+    c11 = np.asarray(c11, dtype=float)
+    c12 = np.asarray(c12, dtype=float)
+    c44 = np.asarray(c44, dtype=float)
+    rho = np.asarray(rho, dtype=float)
+
+    # For cubic symmetry the Voigt and Reuss bulk moduli coincide; copied so that the two results are separate arrays
+    B_voigt = (c11 + 2 * c12) / 3
+    B_reuss = B_voigt.copy()
+    G_voigt = (c11 - c12 + 3 * c44) / 5
+    G_reuss = 5 * (c11 - c12) * c44 / (4 * c44 + 3 * (c11 - c12))
+
+    B_hill = 0.5 * (B_voigt + B_reuss)
+    G_hill = 0.5 * (G_voigt + G_reuss)
+
+    # GPa / (g/cm³) -> (km/s)^2
+    scale = 1e9 / (rho * 1000) / 1e6
+    results = {
+        "B_voigt": B_voigt,
+        "G_voigt": G_voigt,
+        "B_reuss": B_reuss,
+        "G_reuss": G_reuss,
+        "B_hill": B_hill,
+        "G_hill": G_hill,
+        "Vp_h": np.sqrt((B_hill + 4 / 3 * G_hill) * scale),
+        "Vs_h": np.sqrt(G_hill * scale),
+        "Vp_v": np.sqrt((B_voigt + 4 / 3 * G_voigt) * scale),
+        "Vs_v": np.sqrt(G_voigt * scale),
+        "Vp_r": np.sqrt((B_reuss + 4 / 3 * G_reuss) * scale),
+        "Vs_r": np.sqrt(G_reuss * scale),
+    }
+    return {key: value[()] for key, value in results.items()}
+
+
+def modulus_and_velocity_derivatives(c11, c12, c44, rho, dc11, dc12, dc44, drho):
+    """
+    Calculate the derivatives of the Hill moduli and velocities along a direction of change of the
+    elastic constants and density, e.g. with temperature (chain rule through the closed-form averages).
+    c11, c12, c44: Elastic constants (GPa), scalars or broadcastable arrays
+    rho: Densities (g/cm³)
+    dc11, dc12, dc44: Derivatives of the elastic constants (GPa per unit of the varied quantity)
+    drho: Derivative of the density (g/cm³ per unit of the varied quantity)
+    Returns: Dictionary of derivatives with the keys B_hill, G_hill, Vp_h and Vs_h
+    """
+    values = compute_modulus_and_velocity_batch(c11, c12, c44, rho)
+    a = np.asarray(c11, dtype=float) - c12
+    da = np.asarray(dc11, dtype=float) - dc12
+    b = np.asarray(c44, dtype=float)
+
+    dB = (np.asarray(dc11, dtype=float) + 2 * np.asarray(dc12, dtype=float)) / 3
+    dG_voigt = (da + 3 * np.asarray(dc44, dtype=float)) / 5
+    # G_reuss = 5 a b / (4 b + 3 a) with a = C11 - C12, b = C44
+    dG_reuss = (20 * b**2 * da + 15 * a**2 * np.asarray(dc44, dtype=float)) / (4 * b + 3 * a)**2
+    dG = 0.5 * (dG_voigt + dG_reuss)
+
+    # V^2 = M / rho in (km/s)^2 for M in GPa and rho in g/cm³, so dV = (dM - V^2 drho) / (2 rho V)
+    Vp, Vs = values["Vp_h"], values["Vs_h"]
+    results = {
+        "B_hill": dB,
+        "G_hill": dG,
+        "Vp_h": (dB + 4 / 3 * dG - Vp**2 * drho) / (2 * rho * Vp),
+        "Vs_h": (dG - Vs**2 * drho) / (2 * rho * Vs),
+    }
+    return {key: np.asarray(value)[()] for key, value in results.items()}
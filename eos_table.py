@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
+
+from inverse_eos_calculator import InverseEOSCalculator
+
+DEFAULT_CACHE_DIR = "eos_cache"
+
+# Bump when the table layout or construction changes so that stale cache files are ignored
+TABLE_FORMAT_VERSION = 1
+
+# Ratio between the stated error bound and the largest error found at the cell centres
+ERROR_SAFETY_FACTOR = 2.0
+
+
+class InverseEOSTable:
+    def __init__(self, thermal, P_range=(0.0, 200.0), T_range=(300.0, 4000.0), tolerance=1e-4,
+                 initial_points=33, max_refinements=4, cache_dir=DEFAULT_CACHE_DIR):
+        """
+        Tabulated inverse EOS V(P, T) interpolated with a bicubic spline.
+        The table is loaded from cache_dir when a file for the same parameters exists,
+        and is built (and saved) otherwise; it is reloaded or rebuilt in the same way
+        whenever the EOS parameters of thermal change later (see refresh).
+        thermal: An instance of the Thermal class
+        P_range: Lower and upper pressure limits of the table (GPa)
+        T_range: Lower and upper temperature limits of the table (K)
+        tolerance: Maximum allowed interpolation error of the volume (A^3), see build
+        initial_points: Number of nodes per axis of the first grid
+        max_refinements: Maximum number of times the grid spacing is halved to reach the tolerance
+        cache_dir: Directory of the cache files, or None to disable the disk cache
+        """
+        self.thermal = thermal
+        self.P_range = (float(P_range[0]), float(P_range[1]))
+        self.T_range = (float(T_range[0]), float(T_range[1]))
+        self.tolerance = tolerance
+        self.initial_points = initial_points
+        self.max_refinements = max_refinements
+        self.cache_dir = cache_dir
+
+        self.pressures = None
+        self.temperatures = None
+        self.volumes = None
+        self.max_error = None
+        self._spline = None
+        # Cache key of the parameters the current table was built or loaded for
+        self._key = None
+
+        self.refresh()
+
+    def cache_key(self):
+        """
+        Hash of the EOS parameters and the table specification.
+        Returns: Hexadecimal SHA-256 digest
+        """
+        spec = {
+            "version": TABLE_FORMAT_VERSION,
+            "para_mgd": [float(p) for p in self.thermal.para_mgd],
+            "V0": float(self.thermal.V0),
+            "T0": float(self.thermal.T0),
+            "d0": float(self.thermal.d0),
+            "natoms": float(self.thermal.natoms),
+            "P_range": self.P_range,
+            "T_range": self.T_range,
+            "tolerance": float(self.tolerance),
+            "initial_points": int(self.initial_points),
+            "max_refinements": int(self.max_refinements),
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+    def refresh(self):
+        """
+        Reload or rebuild the table if the EOS parameters changed since it was built or loaded.
+        Returns: True if the table was reloaded or rebuilt
+        """
+        if self._key is not None and self._key == self.cache_key():
+            return False
+        if not self.load():
+            self.build()
+            self.save()
+        return True
+
+    def cache_path(self):
+        """
+        Returns: Path of the cache file for the current parameters, or None without a cache directory
+        """
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"inverse_eos_{self.cache_key()[:16]}.npz")
+
+    def build(self):
+        """
+        Solve the EOS on successively finer (P, T) grids until the error bound is below the tolerance.
+        The bound is twice the largest spline error at the cell centres, where the interpolation
+        error of the bicubic spline peaks; the factor covers the off-centre points of each cell.
+        """
+        key = self.cache_key()
+        solver = InverseEOSCalculator(self.thermal)
+        n = self.initial_points
+        for refinement in range(self.max_refinements + 1):
+            pressures = np.linspace(*self.P_range, n)
+            temperatures = np.linspace(*self.T_range, n)
+            volumes, converged = solver.find_volumes(pressures[:, None], temperatures[None, :])
+            if not converged.all():
+                raise ValueError("Unable to solve the EOS on the whole table range; narrow P_range or T_range.")
+            spline = RectBivariateSpline(pressures, temperatures, volumes, kx=3, ky=3, s=0)
+
+            P_mid = 0.5 * (pressures[1:] + pressures[:-1])
+            T_mid = 0.5 * (temperatures[1:] + temperatures[:-1])
+            exact, _ = solver.find_volumes(P_mid[:, None], T_mid[None, :])
+            max_error = ERROR_SAFETY_FACTOR * np.max(np.abs(spline(P_mid, T_mid) - exact))
+            if max_error <= self.tolerance:
+                break
+            n = 2 * n - 1
+
+        if max_error > self.tolerance:
+            raise ValueError(f"The table error {max_error:.2e} A^3 exceeds the tolerance after "
+                             f"{self.max_refinements} refinements.")
+
+        self.pressures = pressures
+        self.temperatures = temperatures
+        self.volumes = volumes
+        self.max_error = max_error
+        self._spline = spline
+        self._key = key
+
+    def save(self):
+        """
+        Save the table to the cache directory.
+        """
+        path = self.cache_path()
+        if path is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Write to a temporary file first so that concurrent runs never read a partial table
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, pressures=self.pressures, temperatures=self.temperatures,
+                 volumes=self.volumes, max_error=self.max_error)
+        os.replace(tmp_path, path)
+
+    def load(self):
+        """
+        Load the table from the cache directory if a file for the current parameters exists.
+        Returns: True if the table was loaded
+        """
+        key = self.cache_key()
+        path = self.cache_path()
+        if path is None or not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            self.pressures = data["pressures"]
+            self.temperatures = data["temperatures"]
+            self.volumes = data["volumes"]
+            self.max_error = float(data["max_error"])
+        self._spline = RectBivariateSpline(self.pressures, self.temperatures, self.volumes, kx=3, ky=3, s=0)
+        self._key = key
+        return True
+
+    def contains(self, P, T):
+        """
+        Check which points lie inside the tabulated range, after refreshing the table.
+        P: Pressures (GPa)
+        T: Temperatures (K)
+        Returns: Boolean mask
+        """
+        self.refresh()
+        P = np.asarray(P, dtype=float)
+        T = np.asarray(T, dtype=float)
+        return (P >= self.P_range[0]) & (P <= self.P_range[1]) & (T >= self.T_range[0]) & (T <= self.T_range[1])
+
+    def volume(self, P, T):
+        """
+        Interpolate the volume for arrays of pressure and temperature.
+        The table is refreshed first, and points outside the tabulated range are returned as NaN.
+        P: Pressures (GPa)
+        T: Temperatures (K), broadcastable with P
+        Returns: Volumes (A^3)
+        """
+        P, T = np.broadcast_arrays(np.asarray(P, dtype=float), np.asarray(T, dtype=float))
+        inside = self.contains(P, T)
+        V = np.full(P.shape, np.nan)
+        V[inside] = self._spline(P[inside], T[inside], grid=False)
+        return V[()]
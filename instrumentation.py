@@ -0,0 +1,173 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Collect per-stage wall times, event counters, per-point solver iteration counts,
+        failed points by reason and peak memory.
+        The profiler is disabled by default; the instrumented code only checks the enabled
+        flag, so the overhead is negligible while it is off.
+        """
+        self.enabled = False
+        self.track_memory = False
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all recorded data.
+        """
+        self.stages = {}
+        self.counters = {}
+        self.iterations = {}
+        self.failures = {}
+        self.started = time.perf_counter()
+
+    def enable(self, track_memory=False):
+        """
+        Start recording.
+        track_memory: Also trace Python memory allocations with tracemalloc (adds overhead)
+        """
+        self.reset()
+        self.enabled = True
+        self.track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        """
+        Stop recording; the recorded data is kept until the next enable or reset.
+        """
+        self.enabled = False
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def stage(self, name):
+        """
+        Context manager timing a stage.
+        name: Stage name
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        """
+        Context manager adding the wall time and a call to a stage, see stage.
+        name: Stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {"calls": 0, "seconds": 0.0})
+            entry["calls"] += 1
+            entry["seconds"] += time.perf_counter() - start
+
+    def count(self, name, n=1):
+        """
+        Add to an event counter, e.g. the number of Debye-integral evaluations.
+        name: Counter name
+        n: Increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def record_iterations(self, name, iterations):
+        """
+        Record per-point iteration counts of a solver.
+        name: Solver name
+        iterations: Array of iteration counts, one per point
+        """
+        iterations = np.ravel(iterations).astype(np.int64)
+        entry = self.iterations.setdefault(name, {"points": 0, "total": 0, "max": 0, "histogram": np.zeros(0, np.int64)})
+        entry["points"] += iterations.size
+        entry["total"] += int(iterations.sum())
+        entry["max"] = max(entry["max"], int(iterations.max(initial=0)))
+        histogram = np.bincount(iterations)
+        size = max(entry["histogram"].size, histogram.size)
+        entry["histogram"] = np.pad(entry["histogram"], (0, size - entry["histogram"].size)) + \
+                             np.pad(histogram, (0, size - histogram.size))
+
+    def record_failures(self, reasons):
+        """
+        Add failed points by reason.
+        reasons: Dictionary mapping the failure reason to the number of points
+        """
+        for reason, count in reasons.items():
+            self.failures[reason] = self.failures.get(reason, 0) + int(count)
+
+    def peak_memory(self):
+        """
+        Returns: Dictionary with the peak resident set size of the process and, when tracing,
+                 the peak traced Python allocation (MB)
+        """
+        memory = {}
+        if resource is not None:
+            # ru_maxrss is reported in kilobytes on Linux
+            memory["peak_rss_MB"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if tracemalloc.is_tracing():
+            memory["peak_traced_MB"] = tracemalloc.get_traced_memory()[1] / 1024**2
+        return memory
+
+    def report(self):
+        """
+        Returns: Dictionary with all recorded data
+        """
+        iterations = {}
+        for name, entry in self.iterations.items():
+            iterations[name] = {
+                "points": entry["points"],
+                "total": entry["total"],
+                "mean": entry["total"] / entry["points"] if entry["points"] else 0.0,
+                "max": entry["max"],
+                "histogram": entry["histogram"].tolist(),
+            }
+        return {
+            "wall_seconds": time.perf_counter() - self.started,
+            "stages": self.stages,
+            "counters": self.counters,
+            "solver_iterations": iterations,
+            "failures": self.failures,
+            "memory": self.peak_memory(),
+        }
+
+    def save(self, filename):
+        """
+        Write the report as JSON.
+        filename: Output file name
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# Process-wide profiler used by the instrumented modules
+PROFILER = Profiler()
+
+
+def enable_profiling(track_memory=False):
+    """
+    Enable the process-wide profiler, see Profiler.enable.
+    Returns: The profiler
+    """
+    PROFILER.enable(track_memory)
+    return PROFILER
+
+
+def disable_profiling():
+    """
+    Disable the process-wide profiler.
+    Returns: The profiler, holding the data recorded so far
+    """
+    PROFILER.disable()
+    return PROFILER
@@ -1,14 +1,24 @@
+import warnings
+
+import numpy as np
+
+from instrumentation import PROFILER
+
+
 class InverseEOSCalculator:
-    def __init__(self, thermal):
+    def __init__(self, thermal, table=None):
         """
         Initialize the class with an instance of the Thermal class for calculations.
         thermal: An instance of the Thermal class
+        table: Optional InverseEOSTable used instead of root finding inside its range
         """
         self.thermal = thermal
+        self.table = table
 
     def find_volume(self, P, T, tolerance=0.1, max_iterations=10000):
         """
         Calculate the volume V from the given pressure P and temperature T using the equation of state (EOS).
+        This is the scalar bisection reference; use find_volumes for arrays.
         P: Pressure (GPa)
         T: Temperature (K)
         tolerance: Calculation tolerance to determine if the condition is met
@@ -17,39 +27,210 @@ class InverseEOSCalculator:
         # Define the initial volume range
         v_upper = 50
         v_lower = 30
-        
+
         for iteration in range(max_iterations):
             v_guess = (v_lower + v_upper) / 2
             P_guess = self.thermal.P_MGD(v_guess, T)  # Use the P_MGD function from the Thermal class
-            
+
             # Check if the current guess is close enough to the target pressure P
             if abs(P_guess - P) < tolerance:
+                if PROFILER.enabled:
+                    PROFILER.record_iterations("find_volume", [iteration + 1])
                 return v_guess  # Return the volume
-            
+
             # Adjust the volume range based on the calculated pressure
             if P_guess < P:
                 v_upper = v_guess
             else:
                 v_lower = v_guess
-                
+
         raise ValueError("Unable to find a volume that meets the condition.")
 
+    def bracket_volumes(self, P, T, v_lower=30.0, v_upper=50.0, expansion=1.1, max_expansions=20):
+        """
+        Widen per-point volume brackets until P_MGD(v_lower, T) >= P >= P_MGD(v_upper, T).
+        P: Pressures (GPa), scalar or array
+        T: Temperatures (K), broadcastable with P
+        v_lower, v_upper: Initial bracket (A^3), scalar or array
+        expansion: Factor by which an unbracketed side is moved outwards per step
+        max_expansions: Maximum number of widening steps
+        Returns: Lower bounds, upper bounds and a mask of the points that are bracketed
+        """
+        P = np.asarray(P, dtype=float)
+        T = np.asarray(T, dtype=float)
+        p_lower = self.thermal.P_MGD(v_lower, T)
+        p_upper = self.thermal.P_MGD(v_upper, T)
+        shape = np.broadcast(P, p_lower, p_upper).shape
+        P = np.broadcast_to(P, shape)
+        v_lower = np.broadcast_to(np.asarray(v_lower, dtype=float), shape).copy()
+        v_upper = np.broadcast_to(np.asarray(v_upper, dtype=float), shape).copy()
+        p_lower = np.broadcast_to(p_lower, shape)
+        p_upper = np.broadcast_to(p_upper, shape)
+
+        for _ in range(max_expansions):
+            # Pressure decreases with volume: a low bracket that is too soft must shrink, and vice versa
+            low_open = p_lower < P
+            high_open = p_upper > P
+            if not (low_open.any() or high_open.any()):
+                break
+            v_lower = np.where(low_open, v_lower / expansion, v_lower)
+            v_upper = np.where(high_open, v_upper * expansion, v_upper)
+            p_lower = self.thermal.P_MGD(v_lower, T)
+            p_upper = self.thermal.P_MGD(v_upper, T)
+
+        bracketed = (p_lower >= P) & (p_upper <= P)
+        return v_lower, v_upper, bracketed
+
+    def find_volumes(self, P, T, rtol=1e-10, atol=1e-9, max_iterations=100, v_lower=30.0, v_upper=50.0,
+                     V_guess=None):
+        """
+        Calculate volumes for arrays of pressure and temperature with a Newton iteration on the
+        analytic dP/dV of the MGD EOS, safeguarded by per-point bisection brackets.
+        P: Pressures (GPa), scalar or array
+        T: Temperatures (K), broadcastable with P
+        rtol: Relative tolerance on the pressure residual and on the volume step
+        atol: Absolute tolerance on the pressure residual (GPa)
+        max_iterations: Maximum number of Newton/bisection iterations
+        v_lower, v_upper: Initial bracket (A^3), widened automatically where needed
+        V_guess: Optional starting volumes (A^3), e.g. from a neighbouring solution
+        Returns: Volumes (A^3) and a boolean mask of the points that converged
+        """
+        P = np.asarray(P, dtype=float)
+        T = np.asarray(T, dtype=float)
+        v_lower, v_upper, bracketed = self.bracket_volumes(P, T, v_lower, v_upper)
+        shape = bracketed.shape
+        P = np.broadcast_to(P, shape)
+        T = np.broadcast_to(T, shape)
+        tolerance = rtol * np.abs(P) + atol
+
+        if V_guess is None:
+            V = 0.5 * (v_lower + v_upper)
+        else:
+            V = np.broadcast_to(np.asarray(V_guess, dtype=float), shape)
+            V = np.where((V > v_lower) & (V < v_upper), V, 0.5 * (v_lower + v_upper))
+
+        converged = np.zeros(shape, dtype=bool)
+        active = bracketed.copy()
+        iterations = np.zeros(shape, dtype=np.int64) if PROFILER.enabled else None
+        for iteration in range(max_iterations):
+            if iterations is not None:
+                iterations += active
+            pressure, slope = self.thermal.P_MGD_and_dP_dV(V, T)
+            residual = pressure - P
+
+            # Pressure above target means the volume is too small
+            v_lower = np.where(active & (residual > 0), V, v_lower)
+            v_upper = np.where(active & (residual < 0), V, v_upper)
+
+            converged |= active & (np.abs(residual) <= tolerance)
+            active &= ~converged
+            if not active.any():
+                break
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                V_new = V - residual / slope
+            outside = ~((V_new > v_lower) & (V_new < v_upper)) | ~(slope < 0)
+            V_new = np.where(outside, 0.5 * (v_lower + v_upper), V_new)
+
+            step_converged = active & (np.abs(V_new - V) <= rtol * V)
+            V = np.where(active, V_new, V)
+            converged |= step_converged
+            active &= ~step_converged
+            if not active.any():
+                break
+
+        if iterations is not None:
+            PROFILER.record_iterations("find_volumes", iterations)
+            PROFILER.count("find_volumes_not_converged", np.count_nonzero(~converged))
+        return V[()], converged[()]
+
+    def find_volumes_along_path(self, P, T, stride=16, rtol=1e-10, atol=1e-9, max_newton_steps=4):
+        """
+        Calculate volumes along an ordered pressure-temperature path (e.g. a geotherm sampled in depth)
+        by continuation: every stride-th point is solved with find_volumes, and each remaining point
+        starts from a first-order extrapolation of the preceding solved point,
+        V = V_a + (dP - dP/dT * dT) / (dP/dV), followed by a few plain Newton steps. Points that do not
+        converge within max_newton_steps fall back to find_volumes.
+        P: Pressures along the path (GPa), 1-D array
+        T: Temperatures along the path (K), 1-D array
+        stride: Spacing of the independently solved anchor points
+        rtol, atol: Tolerances on the pressure residual, see find_volumes
+        max_newton_steps: Maximum number of Newton steps from the extrapolated guess
+        Returns: Volumes (A^3) and a boolean mask of the points that converged
+        """
+        P, T = np.broadcast_arrays(np.atleast_1d(np.asarray(P, dtype=float)), np.atleast_1d(np.asarray(T, dtype=float)))
+        V = np.empty(P.size)
+        converged = np.zeros(P.size, dtype=bool)
+        anchors = np.arange(0, P.size, stride)
+        V[anchors], converged[anchors] = self.find_volumes(P[anchors], T[anchors], rtol=rtol, atol=atol)
+
+        # Extrapolate from the closest preceding anchor along the path
+        nearest = anchors[np.arange(P.size) // stride]
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            dP_dT = self.thermal.dP_dT(V[anchors], T[anchors])[np.arange(P.size) // stride]
+            dP_dV = self.thermal.dP_dV(V[anchors], T[anchors])[np.arange(P.size) // stride]
+            V[:] = np.where(converged, V, V[nearest] + ((P - P[nearest]) - dP_dT * (T - T[nearest])) / dP_dV)
+
+            active = np.flatnonzero(~converged & converged[nearest])
+            iterations = np.zeros(P.size, dtype=np.int64) if PROFILER.enabled else None
+            for step in range(max_newton_steps + 1):
+                if active.size == 0:
+                    break
+                if iterations is not None:
+                    iterations[active] += 1
+                pressure, slope = self.thermal.P_MGD_and_dP_dV(V[active], T[active])
+                residual = pressure - P[active]
+                done = np.abs(residual) <= rtol * np.abs(P[active]) + atol
+                converged[active[done]] = True
+                active, residual, slope = active[~done], residual[~done], slope[~done]
+                if step < max_newton_steps:
+                    V[active] -= residual / slope
+        if iterations is not None:
+            PROFILER.record_iterations("find_volumes_along_path", iterations[iterations > 0])
+
+        # Points the continuation could not handle are solved from scratch
+        fallback = np.flatnonzero(~converged)
+        if fallback.size:
+            V[fallback], converged[fallback] = self.find_volumes(P[fallback], T[fallback], rtol=rtol, atol=atol)
+        return V, converged
+
+    def solve_volumes(self, pressures, temperatures):
+        """
+        Calculate volumes for arrays of pressure and temperature, interpolating in the lookup
+        table where one is set and its range covers the point, and root finding otherwise.
+        pressures: Pressures (GPa)
+        temperatures: Temperatures (K), broadcastable with pressures
+        Returns: Volumes (A^3, NaN where the EOS could not be solved) and a boolean mask of the solved points
+        """
+        pressures = np.asarray(pressures, dtype=float)
+        temperatures = np.asarray(temperatures, dtype=float)
+        if self.table is None:
+            volumes, converged = self.find_volumes(pressures, temperatures)
+        else:
+            # Interpolate inside the table and solve the EOS only for the points outside it
+            pressures, temperatures = np.broadcast_arrays(pressures, temperatures)
+            volumes = np.array(self.table.volume(pressures, temperatures))
+            converged = np.array(self.table.contains(pressures, temperatures))
+            outside = ~converged
+            if outside.any():
+                volumes[outside], converged[outside] = self.find_volumes(pressures[outside], temperatures[outside])
+        volumes = np.where(converged, volumes, np.nan)
+        return volumes[()], converged
+
     def calculate_density(self, pressures, temperatures):
         """
         Calculate the corresponding density and temperature from the given pressure and temperature lists.
+        Points for which the EOS cannot be solved are reported with a warning and returned as NaN.
         pressures: List of pressures (GPa)
         temperatures: List of temperatures (K)
-        Returns: Lists of densities, temperatures, and volumes
-        """
-        densities = []
-        volumes = []
-        for P, T in zip(pressures, temperatures):
-            # Calculate the volume from the pressure and temperature
-            volume = self.find_volume(P, T)
-            volumes.append(volume)
-            
-            # Calculate the density from the volume
-            rho = self.thermal.V_to_rho(volume)
-            densities.append(rho)
-        
+        Returns: Arrays of densities, temperatures, and volumes
+        """
+        temperatures = np.asarray(temperatures, dtype=float)
+        volumes, converged = self.solve_volumes(pressures, temperatures)
+
+        failed = np.size(converged) - np.count_nonzero(converged)
+        if failed:
+            warnings.warn(f"Unable to find a volume for {failed} of {np.size(converged)} pressure-temperature points.")
+
+        densities = self.thermal.V_to_rho(volumes)
         return densities, temperatures, volumes
@@ -0,0 +1,416 @@
+import numpy as np
+import pandas as pd
+
+from adaptive import softening_temperature_at_pressure
+from instrumentation import PROFILER
+from pipeline import STATUS_OK
+from sensitivity import compute_sensitivities
+
+# Search ranges of the inversion
+DEFAULT_T_RANGE = (300.0, 5000.0)
+DEFAULT_P_RANGE = (0.0, 200.0)
+
+# Smallest and largest offset (K) of the scan temperatures spaced geometrically above the softening temperature,
+# where the velocities vary as 1 / sqrt(T - T_c) and a linear scan steps over their minima
+SOFTENING_OFFSETS = (1e-2, 300.0)
+
+# Maximum number of observation x start elements evaluated at a time
+DEFAULT_MAX_ELEMENTS = 2**20
+
+# Columns of the inversion results
+INVERSION_COLUMNS = ["P", "Vp_obs", "Vs_obs", "T", "rho", "V", "Vp", "Vs", "misfit", "converged",
+                     "n_solutions", "T_alt", "P_alt", "misfit_alt"]
+
+# Model values kept for each solution
+_SOLUTION_KEYS = ("rho", "V", "Vp", "Vs", "misfit")
+
+
+def _evaluate(pipeline, T, P, Vp, Vs, sigma_p, sigma_s):
+    """
+    Run the forward chain with its sensitivities and form the weighted residuals and their derivatives.
+    Returns: Dictionary with the validity mask, the residuals rp, rs, their derivatives with respect to
+             T (rp_T, rs_T) and P (rp_P, rs_P), the misfit and the model rho, V, Vp and Vs
+    """
+    results = compute_sensitivities(pipeline, "pressure", T, P)
+    rp = (results["Vp_h"] - Vp) / sigma_p
+    rs = (results["Vs_h"] - Vs) / sigma_s
+    return {
+        "valid": ((results["status"] == STATUS_OK) & np.isfinite(results["dVp_dT"]) &
+                  np.isfinite(results["dVs_dT"])),
+        "rp": rp, "rs": rs,
+        "rp_T": results["dVp_dT"] / sigma_p, "rs_T": results["dVs_dT"] / sigma_s,
+        "rp_P": results["dVp_dP"] / sigma_p, "rs_P": results["dVs_dP"] / sigma_s,
+        "misfit": np.sqrt(0.5 * (rp**2 + rs**2)),
+        "rho": results["rho"], "V": results["V"], "Vp": results["Vp_h"], "Vs": results["Vs_h"],
+    }
+
+
+def _scan_minima(pipeline, Vp, Vs, P, sigma_p, sigma_s, T_grid):
+    """
+    Evaluate the misfit on a temperature grid and bracket its local minima and the sign changes of the
+    residuals. The first defined point above an undefined region (e.g. the softening temperature) also
+    starts a branch, since the misfit can change too fast there for the grid to resolve a minimum.
+    T_grid: Increasing temperatures (K), shared (1-D) or one row per observation (2-D)
+    Returns: Arrays (observation index, starting T, lower and upper bracket ends), one entry per branch
+    """
+    k = np.shape(T_grid)[-1]
+    results = pipeline.compute("pressure", T_grid, P[:, None])
+    rp = (results["Vp_h"] - Vp[:, None]) / sigma_p
+    rs = (results["Vs_h"] - Vs[:, None]) / sigma_s
+    with np.errstate(invalid='ignore'):
+        misfit = np.sqrt(0.5 * (rp**2 + rs**2))
+    misfit = np.where((results["status"] == STATUS_OK) & np.isfinite(misfit), misfit, np.inf)
+    padded = np.pad(misfit, ((0, 0), (1, 1)), constant_values=np.inf)
+    minimum = np.isfinite(misfit) & (misfit <= padded[:, :-2]) & (misfit < padded[:, 2:])
+    edge = np.isfinite(misfit) & ~minimum
+    edge[:, 1:] &= ~np.isfinite(misfit[:, :-1])
+    edge[:, 0] = False
+    # An exact fit lies where both residuals vanish, so every interval where one changes sign also starts
+    # a branch (from its better end), even when the misfit of the grid has no minimum there
+    crossing = np.zeros(misfit.shape, dtype=bool)
+    defined = np.isfinite(misfit[:, :-1]) & np.isfinite(misfit[:, 1:])
+    for residual in (rp, rs):
+        change = defined & (np.signbit(residual[:, :-1]) != np.signbit(residual[:, 1:]))
+        left = misfit[:, :-1] <= misfit[:, 1:]
+        crossing[:, :-1] |= change & left
+        crossing[:, 1:] |= change & ~left
+    point, column = np.nonzero(minimum | edge | crossing)
+    T_grid = np.broadcast_to(T_grid, misfit.shape)
+    return (point, T_grid[point, column], T_grid[point, np.maximum(column - 1, 0)],
+            T_grid[point, np.minimum(column + 1, k - 1)])
+
+
+def _verify_minima(pipeline, Vp, Vs, T, P, misfit, sigma_p, sigma_s, steps):
+    """
+    Check that solutions are local minima of the misfit, i.e. that the model is defined and fits no
+    better at small offsets in every direction, so that solutions pinned to the edge of the search range
+    or of the region where the model is defined are not reported as converged.
+    steps: Offsets (dT, dP) to check
+    Returns: Boolean array
+    """
+    verified = np.isfinite(misfit)
+    for dT, dP in steps:
+        for sign in (-1, 1):
+            results = pipeline.compute("pressure", T + sign * dT, P + sign * dP)
+            with np.errstate(invalid='ignore'):
+                neighbour = np.sqrt(0.5 * (((results["Vp_h"] - Vp) / sigma_p)**2 + ((results["Vs_h"] - Vs) / sigma_s)**2))
+            verified &= (results["status"] == STATUS_OK) & (neighbour >= misfit - 1e-12)
+    return verified
+
+
+def _refine_temperature(pipeline, Vp, Vs, P, sigma_p, sigma_s, T, lower, upper, T_tol, max_iterations):
+    """
+    Bracketed Gauss-Newton minimization of the misfit over T, vectorized over independent branches.
+    The sign of the misfit gradient moves one bracket end to the current T, points where the model is
+    undefined (e.g. below the softening temperature) raise the lower end, and steps leaving the bracket
+    are replaced by bisection.
+    Returns: Final T, dictionary of model values (_SOLUTION_KEYS), converged flags and iteration counts
+    """
+    T, lower, upper = T.copy(), lower.copy(), upper.copy()
+    solution = {key: np.full(T.size, np.nan) for key in _SOLUTION_KEYS}
+    converged = np.zeros(T.size, dtype=bool)
+    iterations = np.zeros(T.size, dtype=np.int64)
+    active = np.ones(T.size, dtype=bool)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for _ in range(max_iterations):
+            index = np.flatnonzero(active)
+            if index.size == 0:
+                break
+            iterations[index] += 1
+            e = _evaluate(pipeline, T[index], P[index], Vp[index], Vs[index], sigma_p, sigma_s)
+            valid = e["valid"]
+            for key in _SOLUTION_KEYS:
+                solution[key][index[valid]] = e[key][valid]
+
+            gradient = e["rp"] * e["rp_T"] + e["rs"] * e["rs_T"]
+            curvature = e["rp_T"]**2 + e["rs_T"]**2
+            lower[index] = np.where(~valid | (gradient < 0), T[index], lower[index])
+            upper[index] = np.where(valid & (gradient > 0), T[index], upper[index])
+
+            T_new = T[index] - gradient / curvature
+            inside = valid & (T_new > lower[index]) & (T_new < upper[index])
+            T_new = np.where(inside, T_new, 0.5 * (lower[index] + upper[index]))
+
+            done = valid & (np.abs(T_new - T[index]) <= T_tol)
+            converged[index[done]] = True
+            # The bracket closes without a minimum when the best fit lies at the edge of the search range
+            stalled = upper[index] - lower[index] <= T_tol
+            active[index[done | stalled]] = False
+            T[index[~done]] = T_new[~done]
+    return T, solution, converged, iterations
+
+
+def _newton_temperature_pressure(pipeline, Vp, Vs, sigma_p, sigma_s, T, P, T_range, P_range, T_tol, P_tol,
+                                 max_iterations, max_halvings):
+    """
+    Damped Newton iteration on the 2x2 system (Vp, Vs) -> (T, P), vectorized over independent starts.
+    Steps are clipped to the T_range x P_range box and halved until the misfit decreases; points where
+    the model is undefined move halfway to the upper temperature limit.
+    Returns: Final T and P, dictionary of model values (_SOLUTION_KEYS), converged flags and iteration counts
+    """
+    T, P = T.copy(), P.copy()
+    solution = {key: np.full(T.size, np.nan) for key in _SOLUTION_KEYS}
+    converged = np.zeros(T.size, dtype=bool)
+    iterations = np.zeros(T.size, dtype=np.int64)
+    index = np.arange(T.size)
+    current = _evaluate(pipeline, T, P, Vp, Vs, sigma_p, sigma_s)
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for _ in range(max_iterations):
+            if index.size == 0:
+                break
+            iterations[index] += 1
+            valid = current["valid"]
+            T_start, P_start = T[index], P[index]
+
+            # Newton step of J d = -r with J = [[rp_T, rp_P], [rs_T, rs_P]]
+            determinant = current["rp_T"] * current["rs_P"] - current["rp_P"] * current["rs_T"]
+            dT = -(current["rs_P"] * current["rp"] - current["rp_P"] * current["rs"]) / determinant
+            dP = -(current["rp_T"] * current["rs"] - current["rs_T"] * current["rp"]) / determinant
+            singular = valid & ~(np.isfinite(dT) & np.isfinite(dP))
+            dT = np.where(valid, dT, 0.5 * (T_range[1] - T_start))
+            dP = np.where(valid, dP, 0.0)
+
+            accepted = np.zeros(index.size, dtype=bool)
+            trial_T, trial_P = T_start.copy(), P_start.copy()
+            new = {key: value.copy() for key, value in current.items()}
+            pending = np.flatnonzero(~singular)
+            for _ in range(max_halvings + 1):
+                if pending.size == 0:
+                    break
+                trial_T[pending] = np.clip(T_start[pending] + dT[pending], *T_range)
+                trial_P[pending] = np.clip(P_start[pending] + dP[pending], *P_range)
+                e = _evaluate(pipeline, trial_T[pending], trial_P[pending], Vp[index[pending]], Vs[index[pending]],
+                              sigma_p, sigma_s)
+                better = e["valid"] & (~valid[pending] | (e["misfit"] < current["misfit"][pending]))
+                for key in new:
+                    new[key][pending[better]] = e[key][better]
+                accepted[pending[better]] = True
+                pending = pending[~better]
+                dT[pending] *= 0.5
+                dP[pending] *= 0.5
+
+            T[index[accepted]] = trial_T[accepted]
+            P[index[accepted]] = trial_P[accepted]
+            current = new
+            kept = current["valid"]
+            for key in _SOLUTION_KEYS:
+                solution[key][index[kept]] = current[key][kept]
+
+            small = (np.abs(trial_T - T_start) <= T_tol) & (np.abs(trial_P - P_start) <= P_tol)
+            # A valid point whose step cannot decrease the misfit any further sits at a minimum
+            done = kept & (small | ~accepted)
+            converged[index[done]] = True
+            stop = done | ~accepted
+            index = index[~stop]
+            current = {key: value[~stop] for key, value in current.items()}
+    return T, P, solution, converged, iterations
+
+
+def _select(point, n, T, P, solution, converged, separation, fit_tolerance):
+    """
+    Group the converged candidates of each observation into distinct solutions (chains of candidates less
+    than separation apart in temperature), and pick the solution of least misfit and the best alternative.
+    Solutions with a misfit up to fit_tolerance are counted in n_solutions.
+    Observations without a converged candidate report their candidate of least misfit where the model is defined.
+    point: Observation index of each candidate
+    n: Number of observations
+    Returns: Dictionary of per-observation arrays with the keys T, P, _SOLUTION_KEYS, converged, n_solutions,
+             T_alt, P_alt and misfit_alt
+    """
+    misfit = np.where(np.isfinite(solution["misfit"]), solution["misfit"], np.inf)
+    found = converged & np.isfinite(misfit)
+    selected = {key: np.full(n, np.nan) for key in ("T", "P", "T_alt", "P_alt", "misfit_alt") + _SOLUTION_KEYS}
+    selected["converged"] = np.zeros(n, dtype=bool)
+    selected["n_solutions"] = np.zeros(n, dtype=np.int64)
+
+    def first_of(keys):
+        # Position of the first candidate of each group after sorting by keys (last key is primary)
+        order = np.lexsort(keys)
+        group = keys[-1][order]
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = group[1:] != group[:-1]
+        return order[first]
+
+    # Fallback for observations without a converged candidate
+    fallback = first_of((misfit, point))
+    fallback = fallback[np.isfinite(misfit[fallback])]
+    candidates = [fallback]
+
+    found_index = np.flatnonzero(found)
+    if found_index.size:
+        order = found_index[np.lexsort((T[found_index], point[found_index]))]
+        new_cluster = np.ones(order.size, dtype=bool)
+        new_cluster[1:] = (point[order][1:] != point[order][:-1]) | (np.diff(T[order]) > separation)
+        cluster = np.empty(point.size, dtype=np.int64)
+        cluster[order] = np.cumsum(new_cluster) - 1
+        representative = first_of((misfit[found_index], cluster[found_index]))
+        representative = found_index[representative]
+        fits = representative[misfit[representative] <= fit_tolerance]
+        np.add.at(selected["n_solutions"], point[fits], 1)
+        ranked = representative[np.lexsort((misfit[representative], point[representative]))]
+        rank_first = np.ones(ranked.size, dtype=bool)
+        rank_first[1:] = point[ranked][1:] != point[ranked][:-1]
+        candidates.append(ranked[rank_first])
+        second = np.flatnonzero(~rank_first)
+        second = ranked[second[np.unique(point[ranked][second], return_index=True)[1]]]
+        selected["T_alt"][point[second]] = T[second]
+        selected["P_alt"][point[second]] = P[second]
+        selected["misfit_alt"][point[second]] = misfit[second]
+        selected["converged"][point[ranked[rank_first]]] = True
+
+    # Converged solutions are written last and take precedence over the fallback
+    for chosen in candidates:
+        selected["T"][point[chosen]] = T[chosen]
+        selected["P"][point[chosen]] = P[chosen]
+        for key in _SOLUTION_KEYS:
+            selected[key][point[chosen]] = solution[key][chosen]
+    return selected
+
+
+def _finish(results, shape, iterations, name):
+    """
+    Record the solver iterations and reshape the per-observation results.
+    """
+    if PROFILER.enabled:
+        PROFILER.record_iterations(name, iterations)
+    results["iterations"] = iterations
+    return {key: np.asarray(value).reshape(shape) for key, value in results.items()}
+
+
+def invert_temperature(pipeline, Vp, Vs, P, sigma_p=1.0, sigma_s=1.0, T_range=DEFAULT_T_RANGE, n_scan=32,
+                       n_softening=12, n_subscan=16, T_tol=1e-3, separation=1.0, fit_tolerance=1.0,
+                       max_iterations=60, max_elements=DEFAULT_MAX_ELEMENTS):
+    """
+    Find the temperatures at which the model reproduces observed velocities at known pressures, by
+    minimizing the weighted misfit of Vp and Vs.
+    The velocities are not monotonic in T (they increase above the C44 softening temperature before
+    decreasing), so an observation may be matched at two temperatures. The misfit is first scanned on
+    n_scan temperatures spread over T_range and n_softening temperatures spaced geometrically above the
+    softening temperature at the pressure of the observation (see SOFTENING_OFFSETS), the bracket of every
+    local minimum of the scan is scanned again on n_subscan temperatures, and every local minimum of
+    these is refined by a bracketed Gauss-Newton iteration, all observations and minima at once. The
+    best solution is reported, together with the best distinct alternative.
+    pipeline: ElasticPipeline instance
+    Vp, Vs: Observed velocities (km/s)
+    P: Pressures of the observations (GPa), broadcastable with Vp and Vs
+    sigma_p, sigma_s: Uncertainties (weights) of Vp and Vs (km/s)
+    T_range: Search range of the temperature (K)
+    n_scan: Number of temperatures of the initial scan spread over T_range
+    n_softening: Number of temperatures of the initial scan above the softening temperature
+    n_subscan: Number of temperatures of the second scan of each bracket (at least 2)
+    T_tol: Convergence tolerance on the temperature step (K)
+    separation: Minimum temperature difference of distinct solutions (K)
+    fit_tolerance: Largest misfit of a solution counted in n_solutions (in units of the uncertainties)
+    max_iterations: Maximum number of iterations
+    max_elements: Maximum number of observation x scan elements evaluated at a time
+    Returns: Dictionary of arrays with the keys of INVERSION_COLUMNS plus 'iterations' (refinement
+             iterations summed over the minima); 'misfit' is the RMS of the weighted residuals,
+             'converged' is False where no minimum was found within T_range or the best one does not
+             fit the observations within fit_tolerance, 'n_solutions' counts the
+             distinct minima fitting the observations within fit_tolerance and 'T_alt', 'P_alt',
+             'misfit_alt' describe the second best minimum (NaN if there is none)
+    """
+    Vp, Vs, P = np.broadcast_arrays(*(np.atleast_1d(np.asarray(value, dtype=float)) for value in (Vp, Vs, P)))
+    shape = P.shape
+    Vp, Vs, P = Vp.ravel(), Vs.ravel(), P.ravel()
+    T_grid = np.linspace(T_range[0], T_range[1], n_scan)
+    offsets = np.geomspace(*SOFTENING_OFFSETS, n_softening)
+    subscan = np.linspace(0.0, 1.0, n_subscan)
+
+    results = {}
+    iterations = np.zeros(P.size, dtype=np.int64)
+    step = max(1, max_elements // (n_scan + n_softening))
+    for start in range(0, P.size, step):
+        chunk = slice(start, min(start + step, P.size))
+        Vp_chunk, Vs_chunk, P_chunk = Vp[chunk], Vs[chunk], P[chunk]
+        T_c = softening_temperature_at_pressure(pipeline, P_chunk)
+        T_soft = np.clip(np.where(np.isfinite(T_c), T_c, T_range[1])[:, None] + offsets, *T_range)
+        scan = np.sort(np.concatenate([np.broadcast_to(T_grid, (P_chunk.size, n_scan)), T_soft], axis=1), axis=1)
+        point, T, lower, upper = _scan_minima(pipeline, Vp_chunk, Vs_chunk, P_chunk, sigma_p, sigma_s, scan)
+        # The bracket of a scan minimum can hold several minima closer together than the scan step
+        branch, T, lower, upper = _scan_minima(pipeline, Vp_chunk[point], Vs_chunk[point], P_chunk[point],
+                                               sigma_p, sigma_s, lower[:, None] + (upper - lower)[:, None] * subscan)
+        point = point[branch]
+        T, solution, converged, counts = _refine_temperature(
+            pipeline, Vp_chunk[point], Vs_chunk[point], P_chunk[point], sigma_p, sigma_s, T, lower, upper,
+            T_tol, max_iterations)
+        check = np.flatnonzero(converged)
+        converged[check] = _verify_minima(pipeline, Vp_chunk[point[check]], Vs_chunk[point[check]], T[check],
+                                          P_chunk[point[check]], solution["misfit"][check], sigma_p, sigma_s,
+                                          [(10 * T_tol, 0.0)])
+        selected = _select(point, P_chunk.size, T, P_chunk[point], solution, converged, separation, fit_tolerance)
+        selected["converged"] &= selected["misfit"] <= fit_tolerance
+        selected["P"] = P_chunk
+        selected["P_alt"] = np.where(np.isfinite(selected["T_alt"]), P_chunk, np.nan)
+        for key, value in selected.items():
+            results.setdefault(key, np.empty(P.size, dtype=value.dtype))[chunk] = value
+        np.add.at(iterations[chunk], point, counts)
+    results.update({"Vp_obs": Vp, "Vs_obs": Vs})
+    return _finish(results, shape, iterations, "invert_temperature")
+
+
+def invert_temperature_pressure(pipeline, Vp, Vs, sigma_p=1.0, sigma_s=1.0, T_range=DEFAULT_T_RANGE,
+                                P_range=DEFAULT_P_RANGE, n_starts=8, T_tol=1e-3, P_tol=1e-5, separation=1.0,
+                                fit_tolerance=1.0, max_iterations=60, max_halvings=10,
+                                max_elements=DEFAULT_MAX_ELEMENTS):
+    """
+    Find the temperatures and pressures at which the model reproduces observed Vp and Vs.
+    A damped Newton iteration on the 2x2 system is started from n_starts temperatures spread over T_range
+    (at the middle of P_range), all observations and starts at once; the best converged solution is
+    reported together with the best distinct alternative, as in invert_temperature.
+    pipeline: ElasticPipeline instance
+    Vp, Vs: Observed velocities (km/s)
+    sigma_p, sigma_s: Uncertainties (weights) of Vp and Vs (km/s)
+    T_range, P_range: Search box (K, GPa)
+    n_starts: Number of starting temperatures
+    T_tol, P_tol: Convergence tolerances on the step (K, GPa)
+    separation: Minimum temperature difference of distinct solutions (K)
+    fit_tolerance: Largest misfit of a solution counted in n_solutions (in units of the uncertainties)
+    max_iterations: Maximum number of Newton iterations
+    max_halvings: Maximum number of step halvings per iteration
+    max_elements: Maximum number of observation x start elements evaluated at a time
+    Returns: Dictionary of arrays like invert_temperature, with the solved pressures in 'P' and 'P_alt'
+    """
+    Vp, Vs = np.broadcast_arrays(np.atleast_1d(np.asarray(Vp, dtype=float)), np.atleast_1d(np.asarray(Vs, dtype=float)))
+    shape = Vp.shape
+    Vp, Vs = Vp.ravel(), Vs.ravel()
+    # Starts at the centres of n_starts equal temperature intervals
+    T_starts = T_range[0] + (np.arange(n_starts) + 0.5) * (T_range[1] - T_range[0]) / n_starts
+
+    results = {}
+    iterations = np.zeros(Vp.size, dtype=np.int64)
+    step = max(1, max_elements // n_starts)
+    for start in range(0, Vp.size, step):
+        chunk = slice(start, min(start + step, Vp.size))
+        n = chunk.stop - chunk.start
+        point = np.repeat(np.arange(n), n_starts)
+        T = np.tile(T_starts, n)
+        P = np.full(T.size, 0.5 * (P_range[0] + P_range[1]))
+        T, P, solution, converged, counts = _newton_temperature_pressure(
+            pipeline, Vp[chunk][point], Vs[chunk][point], sigma_p, sigma_s, T, P, T_range, P_range, T_tol, P_tol,
+            max_iterations, max_halvings)
+        check = np.flatnonzero(converged)
+        converged[check] = _verify_minima(pipeline, Vp[chunk][point[check]], Vs[chunk][point[check]], T[check],
+                                          P[check], solution["misfit"][check], sigma_p, sigma_s,
+                                          [(100 * T_tol, 0.0), (0.0, 100 * P_tol)])
+        selected = _select(point, n, T, P, solution, converged, separation, fit_tolerance)
+        for key, value in selected.items():
+            results.setdefault(key, np.empty(Vp.size, dtype=value.dtype))[chunk] = value
+        np.add.at(iterations[chunk], point, counts)
+    results.update({"Vp_obs": Vp, "Vs_obs": Vs})
+    return _finish(results, shape, iterations, "invert_temperature_pressure")
+
+
+def invert_velocities(pipeline, Vp, Vs, P=None, **options):
+    """
+    Invert observed velocities for temperature at known pressures, or for temperature and pressure if P is None.
+    See invert_temperature and invert_temperature_pressure for the options.
+    Returns: DataFrame with the columns of INVERSION_COLUMNS and 'iterations', one row per (flattened) observation
+    """
+    if P is None:
+        results = invert_temperature_pressure(pipeline, Vp, Vs, **options)
+    else:
+        results = invert_temperature(pipeline, Vp, Vs, P, **options)
+    return pd.DataFrame({key: np.ravel(results[key]) for key in INVERSION_COLUMNS + ["iterations"]})
@@ -0,0 +1,87 @@
+import numpy as np
+
+from instrumentation import PROFILER
+from inverse_eos_calculator import InverseEOSCalculator
+
+# Maximum pressure step of the Runge-Kutta integration (GPa)
+DEFAULT_MAX_STEP = 2.0
+
+
+def isentrope_derivatives(thermal, V, T):
+    """
+    Calculate the derivatives of volume and temperature with pressure along an isentrope of the MGD EOS,
+    dV/dP = -V / K_S and dT/dP = gamma T / K_S with K_S = K_T + gamma^2 Cv T / V.
+    thermal: An instance of the Thermal class
+    V: Volumes (A^3)
+    T: Temperatures (K)
+    Returns: dV/dP (A^3/GPa) and dT/dP (K/GPa)
+    """
+    b1, b2, g0, q = thermal.para_mgd
+    gamma = g0 * (V / thermal.V0)**q
+    K_T = -V * thermal.dP_dV(V, T)
+    K_S = K_T + gamma**2 * thermal.heat_capacity(V, T) * T / V
+    return -V / K_S, gamma * T / K_S
+
+
+def integrate_isentropes(thermal, potential_temperatures, pressures, P_start=0.0, max_step=DEFAULT_MAX_STEP,
+                         inverse=None):
+    """
+    Integrate isentropes from many potential temperatures together with a vectorized fourth-order
+    Runge-Kutta stepper in pressure; every isentrope shares the pressure steps, so each step is one
+    array evaluation over all of them.
+    In the MGD model the entropy depends only on theta(V) / T, which is constant along each isentrope
+    up to the integration error (see isentrope_drift).
+    thermal: An instance of the Thermal class
+    potential_temperatures: Temperatures at P_start (K), 1-D array
+    pressures: Increasing pressures at which the isentropes are reported (GPa), all >= P_start
+    P_start: Pressure of the potential temperatures (GPa)
+    max_step: Maximum Runge-Kutta pressure step (GPa)
+    inverse: InverseEOSCalculator for the starting volumes (created if None)
+    Returns: Arrays of temperatures (K) and volumes (A^3) of shape (isentropes, pressures), and a boolean
+             mask of the isentropes whose starting volume was found
+    """
+    potential_temperatures = np.atleast_1d(np.asarray(potential_temperatures, dtype=float))
+    pressures = np.atleast_1d(np.asarray(pressures, dtype=float))
+    if np.any(np.diff(pressures) <= 0) or pressures[0] < P_start:
+        raise ValueError("Pressures must be increasing and not below P_start")
+    inverse = inverse if inverse is not None else InverseEOSCalculator(thermal)
+
+    V, started = inverse.find_volumes(P_start, potential_temperatures)
+    V = np.where(started, V, np.nan)
+    T = potential_temperatures.copy()
+    temperatures = np.empty((T.size, pressures.size))
+    volumes = np.empty((T.size, pressures.size))
+
+    P = P_start
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        for j, P_next in enumerate(pressures):
+            n_steps = int(np.ceil((P_next - P) / max_step))
+            h = (P_next - P) / max(n_steps, 1)
+            for _ in range(n_steps):
+                k1V, k1T = isentrope_derivatives(thermal, V, T)
+                k2V, k2T = isentrope_derivatives(thermal, V + 0.5 * h * k1V, T + 0.5 * h * k1T)
+                k3V, k3T = isentrope_derivatives(thermal, V + 0.5 * h * k2V, T + 0.5 * h * k2T)
+                k4V, k4T = isentrope_derivatives(thermal, V + h * k3V, T + h * k3T)
+                V = V + h / 6 * (k1V + 2 * k2V + 2 * k3V + k4V)
+                T = T + h / 6 * (k1T + 2 * k2T + 2 * k3T + k4T)
+            if PROFILER.enabled:
+                PROFILER.count("isentrope_steps", n_steps)
+            P = P_next
+            temperatures[:, j] = T
+            volumes[:, j] = V
+    return temperatures, volumes, started
+
+
+def isentrope_drift(thermal, temperatures, volumes, pressures):
+    """
+    Measure the integration error of isentropes.
+    thermal: An instance of the Thermal class
+    temperatures, volumes: Arrays returned by integrate_isentropes
+    pressures: Pressures of the columns (GPa)
+    Returns: Largest relative change of theta(V) / T along each isentrope, and largest pressure
+             residual |P_MGD(V, T) - P| (GPa) along each isentrope
+    """
+    ratio = thermal.debye_temperature(volumes) / temperatures
+    entropy_drift = np.max(np.abs(ratio / ratio[:, :1] - 1), axis=1)
+    pressure_residual = np.max(np.abs(thermal.P_MGD(volumes, temperatures) - pressures), axis=1)
+    return entropy_drift, pressure_residual
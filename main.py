@@ -1,10 +1,38 @@
+import argparse
+import os
+import sys
+
 import numpy as np
-import pandas as pd
-from thermal_P import Thermal
-from elastic_constants_calculator import ElasticConstantsCalculator
-from elastic_constants_convertion import ElasticConstantsConvertion
-from elastic_modulus_velocity_calculator import ElasticModulusAndVelocityCalculator
-from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import ElasticPipeline, status_summary
+from data_io import (DAT_COLUMNS, DAT_HEADER, RESULT_COLUMNS, WRITERS, read_depth_table, read_observations,
+                     read_points, save_results, stream_file)
+from stage_cache import StageCache
+from instrumentation import PROFILER, enable_profiling
+
+# Point sources of the command-line mode, one of which is required
+SOURCES = ("input", "temperature", "point", "depth_table", "isentrope", "invert")
+POINT_SOURCES = ("input", "temperature", "point")
+
+# Sources that are only defined in pressure mode
+PRESSURE_SOURCES = ("depth_table", "isentrope", "invert")
+
+# Calculations replacing the plain run of the points (at most one is given) and the sources they work with
+CALCULATION_SOURCES = {
+    "chunk_size": ("input",),
+    "workers": POINT_SOURCES,
+    "christoffel": POINT_SOURCES,
+    "parameter_sets": POINT_SOURCES,
+    "uncertainty": POINT_SOURCES,
+    "adaptive": ("temperature",),
+    "sensitivities": POINT_SOURCES,
+    "surrogate": POINT_SOURCES,
+}
+
+def _option(name):
+    """
+    Returns: The command-line option of an argparse destination, e.g. '--chunk-size' for 'chunk_size'
+    """
+    return "--" + name.replace("_", "-")
 
 # Get user input for temperature and density range
 def get_temperature_and_density_input():
@@ -36,23 +64,15 @@ def get_temperature_and_pressure_input():
         raise ValueError("Invalid input, please make sure to enter numeric values.")
     return T_min, T_max, P_min, P_max
 
-def read_data_from_file(filename, filetype):
+def read_data_from_file(filename, filetype=None):
     """
-    Read temperature and density or pressure data from a file
+    Read temperature and density or pressure data from a file with the readers of the command line
+    and batch modes (see data_io.read_points)
     filename: file path
-    filetype: file type ('dat' or 'xlsx')
-    Returns: lists of temperatures and density or pressure
+    filetype: file type ('dat', 'csv' or 'xlsx'); inferred from the extension if None
+    Returns: arrays of temperatures and density or pressure
     """
-    if filetype == 'dat':
-        data = np.loadtxt(filename)
-    elif filetype == 'xlsx':
-        data = pd.read_excel(filename).to_numpy()
-    else:
-        raise ValueError("Unsupported file type")
-
-    temperatures = data[:, 0]
-    values = data[:, 1]
-    return temperatures, values
+    return read_points(filename, filetype)
 
 def save_to_dat_file(filename, data):
     """
@@ -62,18 +82,351 @@ def save_to_dat_file(filename, data):
     """
     with open(filename, 'w') as f:
         # Write column headers, starting with `#`, columns separated by Tab (\t)
-        f.write("# Temperature(K)\tDensity(g/cm^3)\tPressure(GPa)\tVolume(A^3)\tC11(GPa)\tC12(GPa)\tC44(GPa)\tB(GPa)\tG(GPa)\tVp_h(km/s)\tVs_h(km/s)\n")
+        f.write(DAT_HEADER)
         # Write data, with columns also separated by Tab (\t), keeping two decimal places
         for row in data:
             f.write("\t".join(f"{value:.2f}" for value in row) + "\n")
 
-# Main program
-if __name__ == "__main__":
-    # Initialize Thermal class
-    th = Thermal()
+def run_and_save(pipeline, mode, temperatures, values, filename, workers=None, fmt=None, precision=6):
+    """
+    Run the pipeline for all points, report the points that could not be calculated and save the results
+    pipeline: ElasticPipeline instance
+    mode: 'density' or 'pressure'
+    temperatures: temperatures (K)
+    values: densities (g/cm³) or pressures (GPa)
+    filename: output file name
+    workers: number of worker processes; the points are computed in the current process if None or 1
+    fmt: output format (see data_io.WRITERS) with every result column; None writes the two-decimal
+         .dat file of save_to_dat_file
+    precision: number of decimal places of the 'dat' output format
+    """
+    if workers is not None and workers > 1:
+        from parallel import run_parallel
+        results = run_parallel(pipeline, mode, temperatures, values, workers=workers)
+    else:
+        results = pipeline.run(mode, temperatures, values)
+    report_and_save(results, filename, fmt, precision)
 
-    # Instantiate InverseEOSCalculator class
-    inverse_calculator = InverseEOSCalculator(th)
+def report_and_save(results, filename, fmt=None, precision=6):
+    """
+    Report the points that could not be calculated and save the results
+    results: DataFrame returned by the pipeline
+    filename: output file name
+    fmt: output format, see run_and_save
+    precision: number of decimal places of the 'dat' output format
+    """
+    for reason, count in status_summary(results["status"]).items():
+        print(f"{count} of {len(results)} points could not be calculated ({reason}); their values are NaN")
+
+    with PROFILER.stage("write"):
+        if fmt is None:
+            save_to_dat_file(filename, results[DAT_COLUMNS].to_numpy())
+        else:
+            from sensitivity import SENSITIVITY_COLUMNS
+            columns = [column for column in ("model", "depth", "Tp", "level") if column in results] + RESULT_COLUMNS + \
+                [column for column in SENSITIVITY_COLUMNS if column in results]
+            save_results(filename, results, fmt, columns=columns, precision=precision)
+    print(f"\nThe results have been saved to '{filename}'")
+
+def build_points(temperature_range, value_range, paired=False):
+    """
+    Generate the state points of a sweep
+    temperature_range: (lower limit, upper limit, number of points) of the temperature (K)
+    value_range: (lower limit, upper limit, number of points) of the density (g/cm³) or pressure (GPa)
+    paired: if True, step temperature and value together along a line (both need the same number of points),
+            otherwise build the full Cartesian grid
+    Returns: arrays of temperatures and values
+    """
+    T_min, T_max, n_T = temperature_range
+    x_min, x_max, n_x = value_range
+    temperatures = np.linspace(T_min, T_max, int(n_T))
+    values = np.linspace(x_min, x_max, int(n_x))
+    if paired:
+        if temperatures.size != values.size:
+            raise ValueError("Paired sweeps need the same number of temperature and density/pressure points.")
+        return temperatures, values
+    T_grid, x_grid = np.meshgrid(temperatures, values, indexing="ij")
+    return T_grid.ravel(), x_grid.ravel()
+
+def parse_arguments(argv=None):
+    """
+    Parse the command-line arguments of the non-interactive mode
+    argv: list of arguments (defaults to sys.argv[1:])
+    Returns: argparse namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Calculate elastic constants, moduli and velocities of cubic CaSiO3 perovskite.")
+    parser.add_argument("--mode", choices=["density", "pressure"], required=True,
+                        help="whether the second input column is density (g/cm^3) or pressure (GPa)")
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", metavar="FILE",
+                        help="two-column input file (temperature, density/pressure); .dat, .csv or .xlsx")
+    source.add_argument("--temperature", nargs=3, type=float, metavar=("MIN", "MAX", "N"),
+                        help="temperature sweep (K), combined with --density or --pressure")
+    source.add_argument("--depth-table", metavar="FILE",
+                        help="ordered depth profile with the columns depth (km), temperature (K) and pressure (GPa), "
+                             "solved by continuation along the path (--mode pressure)")
+    source.add_argument("--isentrope", nargs=3, type=float, metavar=("TP_MIN", "TP_MAX", "N"),
+                        help="isentropes from N potential temperatures (K) at 0 GPa, evaluated at the pressures of "
+                             "--pressure (--mode pressure)")
+    source.add_argument("--point", nargs=2, type=float, action="append", metavar=("T", "VALUE"),
+                        help="explicit state point; may be given several times")
+    source.add_argument("--invert", metavar="FILE",
+                        help="observed velocities with the columns pressure (GPa), Vp and Vs (km/s), inverted for "
+                             "temperature, or Vp and Vs only, inverted for temperature and pressure (--mode pressure)")
+
+    parser.add_argument("--density", nargs=3, type=float, metavar=("MIN", "MAX", "N"),
+                        help="density sweep (g/cm^3) for --mode density")
+    parser.add_argument("--pressure", nargs=3, type=float, metavar=("MIN", "MAX", "N"),
+                        help="pressure sweep (GPa) for --mode pressure")
+    parser.add_argument("--paired", action="store_true",
+                        help="step temperature and density/pressure together instead of building the T x value grid")
+    parser.add_argument("--output", metavar="FILE", help="output file (default depends on the mode)")
+    parser.add_argument("--format", choices=list(WRITERS), default="dat",
+                        help="output format: tab-separated text, .npy structured array, .npz archive "
+                             "or memory-mappable raw binary (default: dat)")
+    parser.add_argument("--precision", type=int, default=6,
+                        help="number of decimal places of the dat format (default: 6)")
+    # At most one calculation replaces the plain run of the points, see CALCULATION_SOURCES
+    calculation = parser.add_mutually_exclusive_group()
+    calculation.add_argument("--chunk-size", type=int, metavar="ROWS",
+                             help="stream --input in chunks of ROWS rows, appending results as they are computed")
+    parser.add_argument("--stage-cache", metavar="DIR",
+                        help="reuse EOS, Cij and adiabatic stage results stored in DIR by earlier runs "
+                             "with the same inputs and parameters")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write a JSON report of stage times, solver iterations, Debye-integral evaluations, "
+                             "failed points and peak memory")
+    parser.add_argument("--profile-memory", action="store_true",
+                        help="also trace Python allocations for the --profile report (slower)")
+    calculation.add_argument("--christoffel", type=int, metavar="N",
+                             help="solve the Christoffel equation for N directions on a Fibonacci sphere and add "
+                                  "anisotropy metrics; the directional velocities are written to "
+                                  "<output>_directions.npz")
+    parser.add_argument("--directions", metavar="FILE",
+                        help="like --christoffel, for the propagation directions in FILE (three columns x y z)")
+    calculation.add_argument("--parameter-sets", metavar="PATH",
+                             help="compute every parameter set of a JSON file (or of the .json files of a directory) "
+                                  "in one pass; the output gains a 'model' index column, see <output>_models.json")
+    parser.add_argument("--models", nargs="+", metavar="NAME",
+                        help="only compute these sets of --parameter-sets, in this order")
+    calculation.add_argument("--uncertainty", metavar="FILE",
+                             help="propagate parameter uncertainties (JSON covariances/ensembles or .npz ensembles) "
+                                  "and write the mean, standard deviation and percentiles of the moduli and "
+                                  "velocities")
+    parser.add_argument("--samples", type=int, default=1000,
+                        help="number of parameter samples drawn for --uncertainty (default: 1000)")
+    parser.add_argument("--seed", type=int, help="random seed of the --uncertainty samples")
+    calculation.add_argument("--adaptive", type=int, metavar="LEVELS",
+                             help="refine the --temperature x --density/--pressure grid as a quadtree of up to LEVELS "
+                                  "levels around the C44 softening and where the properties change fast; the cells and "
+                                  "the softening temperature are written to <output>_quadtree.npz")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="relative interpolation error above which --adaptive refines a cell (default: 0.01)")
+    calculation.add_argument("--sensitivities", action="store_true",
+                             help="add the derivatives of density, Vp and Vs with respect to temperature and pressure")
+    parser.add_argument("--sigma", nargs=2, type=float, default=(0.05, 0.05), metavar=("SIGMA_P", "SIGMA_S"),
+                        help="uncertainties of the observed Vp and Vs (km/s) weighting the --invert misfit; states "
+                             "fitting within them count as solutions (default: 0.05 0.05)")
+    calculation.add_argument("--surrogate", metavar="FILE",
+                             help="evaluate the points with a surrogate built by surrogate.py instead of the pipeline")
+    parser.add_argument("--surrogate-check", type=int, default=1000, metavar="N",
+                        help="number of points covered by --surrogate recomputed with the exact pipeline to check "
+                             "the stated maximum error (default: 1000, 0 to skip)")
+    calculation.add_argument("--workers", type=int, metavar="N",
+                             help="compute the points on N worker processes")
+
+    args = parser.parse_args(argv)
+    source = next(name for name in SOURCES if getattr(args, name) is not None)
+    calculation = next((name for name in CALCULATION_SOURCES if getattr(args, name) not in (None, False)), None)
+    if args.directions is not None:
+        if calculation not in (None, "christoffel"):
+            parser.error(f"argument --directions: not allowed with argument {_option(calculation)}")
+        calculation = "christoffel"
+    if calculation is not None and source not in CALCULATION_SOURCES[calculation]:
+        *others, last = map(_option, CALCULATION_SOURCES[calculation])
+        parser.error(f"{_option(calculation)} needs {', '.join(others) + ' or ' if others else ''}{last}, "
+                     f"not {_option(source)}")
+    if source in PRESSURE_SOURCES and args.mode != "pressure":
+        parser.error(f"{_option(source)} needs --mode pressure")
+    if args.isentrope is not None and args.pressure is None:
+        parser.error("--isentrope needs --pressure")
+    if args.adaptive is not None and args.paired:
+        parser.error("--adaptive cannot be combined with --paired")
+    if args.models is not None and args.parameter_sets is None:
+        parser.error("--models needs --parameter-sets")
+    if args.temperature is not None:
+        value_range = args.density if args.mode == "density" else args.pressure
+        if value_range is None:
+            parser.error(f"--temperature needs --{args.mode} in {args.mode} mode")
+        args.value_range = value_range
+    return args
+
+def run_cli(argv=None):
+    """
+    Run the calculation from command-line arguments, see parse_arguments
+    argv: list of arguments (defaults to sys.argv[1:])
+    """
+    args = parse_arguments(argv)
+    if args.profile:
+        enable_profiling(track_memory=args.profile_memory)
+    try:
+        run_cli_arguments(args)
+    finally:
+        if args.profile:
+            PROFILER.save(args.profile)
+            print(f"The profiling report has been saved to '{args.profile}'")
+
+def run_cli_arguments(args):
+    """
+    Run the calculation for parsed command-line arguments
+    args: argparse namespace returned by parse_arguments
+    """
+    pipeline = ElasticPipeline(cache=StageCache(cache_dir=args.stage_cache) if args.stage_cache else None)
+
+    if args.chunk_size is not None:
+        output = args.output or f"file_temp_{args.mode}_results.{args.format}"
+        total, failures = stream_file(pipeline, args.mode, args.input, output, chunksize=args.chunk_size,
+                                      fmt=args.format, precision=args.precision)
+        for reason, count in failures.items():
+            print(f"{count} of {total} points could not be calculated ({reason}); their values are NaN")
+        print(f"\nThe results have been saved to '{output}'")
+        return
+
+    if args.depth_table is not None:
+        with PROFILER.stage("read"):
+            depths, temperatures, pressures = read_depth_table(args.depth_table)
+        report_and_save(pipeline.run_profile(temperatures, pressures, depths),
+                        args.output or f"profile_results.{args.format}", args.format, args.precision)
+        return
+
+    if args.isentrope is not None:
+        T_min, T_max, n = args.isentrope
+        report_and_save(pipeline.run_isentropes(np.linspace(T_min, T_max, int(n)), np.linspace(*args.pressure[:2],
+                                                                                              int(args.pressure[2]))),
+                        args.output or f"isentrope_results.{args.format}", args.format, args.precision)
+        return
+
+    # The modules of the calculations are imported in their branches, so that a plain run does not load them
+    if args.invert is not None:
+        from inversion import INVERSION_COLUMNS, invert_velocities
+        with PROFILER.stage("read"):
+            Vp, Vs, pressures = read_observations(args.invert)
+        results = invert_velocities(pipeline, Vp, Vs, pressures, sigma_p=args.sigma[0], sigma_s=args.sigma[1])
+        output = args.output or f"inversion_results.{args.format}"
+        unconverged = np.count_nonzero(~results["converged"])
+        if unconverged:
+            print(f"{unconverged} of {len(results)} observations could not be matched within the search range")
+        ambiguous = np.count_nonzero(results["n_solutions"] > 1)
+        if ambiguous:
+            print(f"{ambiguous} of {len(results)} observations are matched by more than one state within the "
+                  f"uncertainties; see the columns T_alt, P_alt and misfit_alt")
+        with PROFILER.stage("write"):
+            save_results(output, results, args.format, columns=INVERSION_COLUMNS + ["iterations"],
+                         precision=args.precision)
+        print(f"\nThe results have been saved to '{output}'")
+        return
+
+    if args.input is not None:
+        with PROFILER.stage("read"):
+            temperatures, values = read_data_from_file(args.input)
+        default_output = f"file_temp_{args.mode}_results.{args.format}"
+    elif args.point is not None:
+        temperatures, values = np.array(args.point, dtype=float).T
+        default_output = f"temp_{args.mode}_results.{args.format}"
+    else:
+        temperatures, values = build_points(args.temperature, args.value_range, args.paired)
+        default_output = f"temp_{args.mode}_results.{args.format}"
+
+    if args.adaptive is not None:
+        from adaptive import adaptive_sample
+        (T_min, T_max, n_T), (x_min, x_max, n_x) = args.temperature, args.value_range
+        sample = adaptive_sample(pipeline, args.mode, (T_min, T_max), (x_min, x_max), (n_T, n_x), args.adaptive,
+                                 args.tolerance)
+        output = args.output or f"adaptive_{args.mode}_results.{args.format}"
+        print(f"{len(sample.points)} points in {len(sample.cells)} cells; {sample.n_masked} points below the "
+              f"softening temperature were not computed")
+        report_and_save(sample.points, output, args.format, args.precision)
+        quadtree = f"{os.path.splitext(output)[0]}_quadtree.npz"
+        sample.save(quadtree)
+        print(f"The quadtree cells and the softening temperature have been saved to '{quadtree}'")
+        return
+
+    if args.surrogate is not None:
+        from surrogate import ChebyshevSurrogate, check_surrogate
+        surrogate = ChebyshevSurrogate.load(args.surrogate)
+        if surrogate.mode != args.mode:
+            raise ValueError(f"{args.surrogate} is a {surrogate.mode}-mode surrogate")
+        if not surrogate.matches(pipeline):
+            print(f"Warning: {args.surrogate} was built with other parameters than the pipeline")
+        results = surrogate.run(temperatures, values)
+        if args.surrogate_check > 0:
+            errors, mismatches = check_surrogate(surrogate, pipeline, temperatures, values, args.surrogate_check)
+            for column, error in errors.items():
+                flag = "  EXCEEDED" if error > surrogate.max_error[column] else ""
+                print(f"{column}: error {error:.3g} (stated maximum {surrogate.max_error[column]:.3g}){flag}")
+            if mismatches:
+                print(f"{mismatches} checked points could not be calculated by the pipeline")
+        report_and_save(results, args.output or default_output, args.format, args.precision)
+        return
+
+    if args.parameter_sets is not None:
+        from parameter_sets import ParameterRegistry, load_registry, run_models
+        parameter_sets = load_registry(args.parameter_sets).select(args.models)
+        output = args.output or default_output
+        report_and_save(run_models(parameter_sets, args.mode, temperatures, values, pipeline), output, args.format,
+                        args.precision)
+        models = f"{os.path.splitext(output)[0]}_models.json"
+        ParameterRegistry(parameter_sets).save(models)
+        for index, parameter_set in enumerate(parameter_sets):
+            print(f"model {index}: {parameter_set.name}")
+        print(f"The parameter sets have been saved to '{models}'")
+        return
+
+    if args.christoffel is not None or args.directions is not None:
+        from christoffel import ANISOTROPY_COLUMNS
+        directions = np.loadtxt(args.directions, ndmin=2) if args.directions is not None else None
+        results, directions, velocities = pipeline.run_anisotropy(args.mode, temperatures, values, directions,
+                                                                  args.christoffel or 500)
+        output = args.output or default_output
+        for reason, count in status_summary(results["status"]).items():
+            print(f"{count} of {len(results)} points could not be calculated ({reason}); their values are NaN")
+        with PROFILER.stage("write"):
+            save_results(output, results, args.format, columns=RESULT_COLUMNS + ANISOTROPY_COLUMNS,
+                         precision=args.precision)
+            maps = f"{os.path.splitext(output)[0]}_directions.npz"
+            np.savez(maps, directions=directions, T=results["T"].to_numpy(), rho=results["rho"].to_numpy(),
+                     P=results["P"].to_numpy(), **velocities)
+        print(f"\nThe results have been saved to '{output}' and the directional velocities to '{maps}'")
+        return
+
+    if args.uncertainty is not None:
+        from uncertainty import load_parameter_uncertainties, propagate_uncertainty, sample_parameters
+        covariances, ensembles = load_parameter_uncertainties(args.uncertainty)
+        samples = sample_parameters(pipeline, covariances, ensembles, args.samples, args.seed)
+        summary = propagate_uncertainty(pipeline, args.mode, temperatures, values, samples)
+        output = args.output or f"uncertainty_{args.mode}_results.{args.format}"
+        with PROFILER.stage("write"):
+            save_results(output, summary, args.format, columns=list(summary.columns), precision=args.precision)
+        print(f"\nThe results have been saved to '{output}'")
+        return
+
+    if args.sensitivities:
+        from sensitivity import run_sensitivities
+        report_and_save(run_sensitivities(pipeline, args.mode, temperatures, values), args.output or default_output,
+                        args.format, args.precision)
+        return
+
+    run_and_save(pipeline, args.mode, temperatures, values, args.output or default_output, args.workers,
+                 args.format, args.precision)
+
+def run_interactive():
+    """
+    Ask for the inputs with keyboard prompts and run the calculation
+    """
+    # Initialize the calculation pipeline (Thermal, InverseEOSCalculator, ElasticConstantsCalculator, ...)
+    pipeline = ElasticPipeline()
 
     # Let the user choose the data input method
     print("Please select the data input method:")
@@ -95,95 +448,20 @@ if __name__ == "__main__":
             T_min, T_max, rho_min, rho_max = get_temperature_and_density_input()
 
             # Generate 100 evenly spaced temperature and density points
-            if T_min == T_max:
-                temperatures = np.full(100, T_min)
-            else:
-                temperatures = np.linspace(T_min, T_max, 100)
-
-            if rho_min == rho_max:
-                densities = np.full(100, rho_min)
-            else:
-                densities = np.linspace(rho_min, rho_max, 100)
+            temperatures = np.linspace(T_min, T_max, 100)
+            densities = np.linspace(rho_min, rho_max, 100)
 
-            # Initialize ElasticConstantsCalculator class
-            calculator = ElasticConstantsCalculator()
-
-            # Initialize ElasticConstantsConvertion class
-            convertion = ElasticConstantsConvertion()
-
-            results = []
-            for T, rho in zip(temperatures, densities):
-                try:
-                    volume = th.rho_to_V(rho)
-                    pressure = th.P_MGD(volume, T)
-
-                    c11_value, c12_value, c44_value = calculator.calculate_elastic_constants(rho, T)
-                    converted_c11, converted_c12 = convertion.adiabatic_elastic_constants(th, volume, T, c11_value, c12_value)
-
-                    # Calculate elastic moduli and velocities
-                    modulus_velocity_calculator = ElasticModulusAndVelocityCalculator(converted_c11, converted_c12, c44_value, rho)
-                    B_hill, G_hill, Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r = modulus_velocity_calculator.compute_modulus_and_velocity()
-
-                    row = [T, rho, pressure, volume, c11_value, c12_value, c44_value, B_hill, G_hill, Vp_h, Vs_h]
-                    results.append(row)
-
-                except Exception as e:
-                    print(f"Error encountered while calculating for temperature {T} K and density {rho} g/cm³: {e}")
-
-            # Save the results
-            save_to_dat_file("temp_density_results.dat", results)
-            print(f"\nThe results have been saved to 'temp_density_results.dat'")
+            run_and_save(pipeline, "density", temperatures, densities, "temp_density_results.dat")
 
         elif mode == "2":
             # Enter temperature and pressure range, calculate volume and density, then calculate elastic constants and velocities
             T_min, T_max, P_min, P_max = get_temperature_and_pressure_input()
 
             # Generate 100 evenly spaced pressure and temperature points
-            if P_min == P_max:
-                pressures = np.full(100,P_min)
-            else:
-                pressures = np.linspace(P_min, P_max, 100)
-                
-            if T_min == T_max:
-                temperatures = np.full(100, T_min)
-            else:
-                temperatures = np.linspace(T_min, T_max, 100)
-
-            # Use InverseEOSCalculator to calculate volume and density
-            densities, temperatures, volumes = inverse_calculator.calculate_density(pressures, temperatures)
-
-            # Initialize ElasticConstantsCalculator and ElasticConstantsConvertion classes
-            calculator = ElasticConstantsCalculator()
-            convertion = ElasticConstantsConvertion()
-
-            results = []
-            for i in range(len(pressures)):
-                try:
-                    T = temperatures[i]
-                    rho = densities[i]
-                    volume = volumes[i]
-                    pressure = pressures[i]
-
-                    # Calculate isothermal elastic constants
-                    c11_value, c12_value, c44_value = calculator.calculate_elastic_constants(rho, T)
-
-                    # Correct C11 and C12 to get adiabatic elastic constants
-                    converted_c11, converted_c12 = convertion.adiabatic_elastic_constants(th, volume, T, c11_value, c12_value)
-
-                    # Calculate elastic moduli and velocities
-                    modulus_velocity_calculator = ElasticModulusAndVelocityCalculator(converted_c11, converted_c12, c44_value, rho)
-                    B_hill, G_hill, Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r = modulus_velocity_calculator.compute_modulus_and_velocity()
-
-                    # Organize the results into rows
-                    row = [T, rho, pressure, volume, c11_value, c12_value, c44_value, B_hill, G_hill, Vp_h, Vs_h]
-                    results.append(row)
-
-                except Exception as e:
-                    print(f"Error encountered while calculating for temperature {T} K and pressure {pressure} GPa: {e}")
-
-            # Save the results
-            save_to_dat_file("temp_pressure_results.dat", results)
-            print(f"\nThe results have been saved to 'temp_pressure_results.dat'")
+            pressures = np.linspace(P_min, P_max, 100)
+            temperatures = np.linspace(T_min, T_max, 100)
+
+            run_and_save(pipeline, "pressure", temperatures, pressures, "temp_pressure_results.dat")
 
     elif input_mode == "2":
         # Select the file type and read the file
@@ -199,7 +477,7 @@ if __name__ == "__main__":
             filetype = "xlsx"
         else:
             print("Invalid choice.")
-            exit()
+            sys.exit(1)
 
         filename = input("Please enter the file name (including the path): ")
 
@@ -214,85 +492,22 @@ if __name__ == "__main__":
             temperatures, values = read_data_from_file(filename, filetype)
         except Exception as e:
             print(f"Error reading the file: {e}")
-            exit()
+            sys.exit(1)
 
         if data_mode == "1":
             # Case for temperature and density
-            densities = values
-            pressures = [th.P_MGD(th.rho_to_V(rho), T) for rho, T in zip(densities, temperatures)]
-
-            # Initialize ElasticConstantsCalculator and ElasticConstantsConvertion classes
-            calculator = ElasticConstantsCalculator()
-            convertion = ElasticConstantsConvertion()
-
-            results = []
-            for i in range(len(temperatures)):
-                try:
-                    T = temperatures[i]
-                    rho = densities[i]
-                    volume = th.rho_to_V(rho)
-                    pressure = pressures[i]
-
-                    # Calculate isothermal elastic constants
-                    c11_value, c12_value, c44_value = calculator.calculate_elastic_constants(rho, T)
-
-                    # Correct C11 and C12 to get adiabatic elastic constants
-                    converted_c11, converted_c12 = convertion.adiabatic_elastic_constants(th, volume, T, c11_value, c12_value)
-
-                    # Calculate elastic moduli and velocities
-                    modulus_velocity_calculator = ElasticModulusAndVelocityCalculator(converted_c11, converted_c12, c44_value, rho)
-                    B_hill, G_hill, Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r = modulus_velocity_calculator.compute_modulus_and_velocity()
-
-                    # Organize the results into rows
-                    row = [T, rho, pressure, volume, c11_value, c12_value, c44_value, B_hill, G_hill, Vp_h, Vs_h]
-                    results.append(row)
-
-                except Exception as e:
-                    print(f"Error encountered while calculating for temperature {T} K and density {rho} g/cm³: {e}")
-
-            # Save the results
-            save_to_dat_file("file_temp_density_results.dat", results)
-            print(f"\nThe results have been saved to 'file_temp_density_results.dat'")
+            run_and_save(pipeline, "density", temperatures, values, "file_temp_density_results.dat")
 
         elif data_mode == "2":
             # Case for temperature and pressure
-            pressures = values
-
-            # Use InverseEOSCalculator to calculate volume and density
-            densities, temperatures, volumes = inverse_calculator.calculate_density(pressures, temperatures)
-
-            # Initialize ElasticConstantsCalculator and ElasticConstantsConvertion classes
-            calculator = ElasticConstantsCalculator()
-            convertion = ElasticConstantsConvertion()
-
-            results = []
-            for i in range(len(pressures)):
-                try:
-                    T = temperatures[i]
-                    rho = densities[i]
-                    volume = volumes[i]
-                    pressure = pressures[i]
-
-                    # Calculate isothermal elastic constants
-                    c11_value, c12_value, c44_value = calculator.calculate_elastic_constants(rho, T)
-
-                    # Correct C11 and C12 to get adiabatic elastic constants
-                    converted_c11, converted_c12 = convertion.adiabatic_elastic_constants(th, volume, T, c11_value, c12_value)
-
-                    # Calculate elastic moduli and velocities
-                    modulus_velocity_calculator = ElasticModulusAndVelocityCalculator(converted_c11, converted_c12, c44_value, rho)
-                    B_hill, G_hill, Vp_h, Vs_h, Vp_v, Vs_v, Vp_r, Vs_r = modulus_velocity_calculator.compute_modulus_and_velocity()
-
-                    # Organize the results into rows
-                    row = [T, rho, pressure, volume, c11_value, c12_value, c44_value, B_hill, G_hill, Vp_h, Vs_h]
-                    results.append(row)
-
-                except Exception as e:
-                    print(f"Error encountered while calculating for temperature {T} K and pressure {pressure} GPa: {e}")
-
-            # Save the results
-            save_to_dat_file("file_temp_pressure_results.dat", results)
-            print(f"\nThe results have been saved to 'file_temp_pressure_results.dat'")
+            run_and_save(pipeline, "pressure", temperatures, values, "file_temp_pressure_results.dat")
 
     else:
         print("Invalid choice, please enter 1 or 2.")
+
+# Main program
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        run_cli()
+    else:
+        run_interactive()
@@ -0,0 +1,131 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from pipeline import COLUMNS
+
+# Output layout: one float64 column per pipeline column, followed by the status code
+OUTPUT_COLUMNS = COLUMNS + ["status"]
+
+# Tasks per worker when the chunk size is derived from the work, so that uneven chunks balance out
+TASKS_PER_WORKER = 4
+
+# Limits of the derived number of state points per task
+MIN_CHUNK_SIZE = 1000
+MAX_CHUNK_SIZE = 50000
+
+# Per-worker state set by _init_worker
+_worker = {}
+
+
+def _attach(name, shape):
+    """
+    Attach to an existing shared-memory block as a float64 array.
+    name: name of the shared-memory block
+    shape: shape of the array
+    Returns: shared-memory handle and array view
+    """
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+
+def _init_worker(pipeline, input_name, output_name, output_path, n_points):
+    """
+    Store the pipeline and attach the shared input and output arrays once per worker process.
+    """
+    _worker["pipeline"] = pipeline
+    _worker["input_block"], _worker["inputs"] = _attach(input_name, (2, n_points))
+    if output_path is None:
+        _worker["output_block"], _worker["outputs"] = _attach(output_name, (n_points, len(OUTPUT_COLUMNS)))
+    else:
+        _worker["outputs"] = np.load(output_path, mmap_mode="r+")
+
+
+def _run_chunk(mode, start, stop):
+    """
+    Compute the state points start:stop and write them into the shared output array.
+    Returns: start index of the chunk
+    """
+    inputs = _worker["inputs"]
+    results = _worker["pipeline"].compute(mode, inputs[0, start:stop], inputs[1, start:stop])
+    outputs = _worker["outputs"]
+    for j, column in enumerate(OUTPUT_COLUMNS):
+        outputs[start:stop, j] = results[column]
+    if isinstance(outputs, np.memmap):
+        outputs.flush()
+    return start
+
+
+def default_chunk_size(n_points, workers):
+    """
+    Split the state points into about TASKS_PER_WORKER tasks per worker.
+    n_points: number of state points
+    workers: number of worker processes
+    Returns: number of state points per task, between MIN_CHUNK_SIZE and MAX_CHUNK_SIZE
+    """
+    return min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, math.ceil(n_points / (workers * TASKS_PER_WORKER))))
+
+
+def run_parallel(pipeline, mode, temperatures, values, workers=None, chunksize=None, output_path=None):
+    """
+    Run the pipeline for many state points on a pool of worker processes.
+    The inputs are shared with the workers through shared memory, and each worker writes its
+    chunk directly into a shared (or memory-mapped) output array, so results are never pickled
+    and the row order is the input order.
+    pipeline: ElasticPipeline instance (sent once to every worker)
+    mode: 'density' or 'pressure'
+    temperatures: temperatures (K)
+    values: densities (g/cm³) or pressures (GPa), broadcastable with temperatures
+    workers: number of worker processes (defaults to the number of CPUs)
+    chunksize: number of state points per task; derived from the number of points and workers if None
+               (see default_chunk_size)
+    output_path: optional .npy file holding the (n_points, len(OUTPUT_COLUMNS)) result array;
+                 if None, the results are collected in shared memory
+    Returns: DataFrame with the columns of OUTPUT_COLUMNS (backed by the memory map if output_path is given)
+    """
+    temperatures, values = np.broadcast_arrays(np.asarray(temperatures, dtype=float), np.asarray(values, dtype=float))
+    n_points = temperatures.size
+    workers = workers or os.cpu_count()
+    chunksize = chunksize or default_chunk_size(n_points, workers)
+
+    input_block = shared_memory.SharedMemory(create=True, size=max(2 * n_points * 8, 1))
+    output_block = None
+    try:
+        inputs = np.ndarray((2, n_points), dtype=np.float64, buffer=input_block.buf)
+        inputs[0] = temperatures.ravel()
+        inputs[1] = values.ravel()
+
+        if output_path is None:
+            output_block = shared_memory.SharedMemory(create=True, size=max(n_points * len(OUTPUT_COLUMNS) * 8, 1))
+            outputs = np.ndarray((n_points, len(OUTPUT_COLUMNS)), dtype=np.float64, buffer=output_block.buf)
+            output_name = output_block.name
+        else:
+            outputs = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float64,
+                                                shape=(n_points, len(OUTPUT_COLUMNS)))
+            outputs.flush()
+            output_name = None
+
+        starts = range(0, n_points, chunksize)
+        # No more processes than tasks: starting idle workers only costs time
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(starts))), initializer=_init_worker,
+                                 initargs=(pipeline, input_block.name, output_name, output_path, n_points)) as executor:
+            # Consume the iterator so that worker exceptions are raised here
+            list(executor.map(_run_chunk, [mode] * len(starts), starts, [min(start + chunksize, n_points) for start in starts]))
+
+        if output_path is None:
+            # Copy out of the shared block before it is released
+            outputs = outputs.copy()
+    finally:
+        input_block.close()
+        input_block.unlink()
+        if output_block is not None:
+            output_block.close()
+            output_block.unlink()
+
+    results = pd.DataFrame(outputs, columns=OUTPUT_COLUMNS, copy=False)
+    results["status"] = results["status"].astype(np.int8)
+    return results
@@ -0,0 +1,220 @@
+import copy
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import COLUMNS, ElasticPipeline
+
+# Material parameters of each pipeline component that a parameter set may override
+COMPONENT_PARAMETERS = {
+    "thermal": ("V0", "T0", "g0", "d0", "natoms", "mol_mass", "para_th", "para_mgd"),
+    "calculator": ("popt1", "popt2", "popt3", "e0", "e1", "e2"),
+    "convertion": ("g0", "q", "V0", "Bt0"),
+}
+
+
+class ParameterSet:
+    def __init__(self, name, parameters=None, description=""):
+        """
+        Named set of material parameters overriding the defaults of the pipeline components.
+        name: Name of the set, e.g. the publication it is taken from
+        parameters: Dictionary mapping a component ('thermal', 'calculator' or 'convertion') to a dictionary
+                    of parameter values, see COMPONENT_PARAMETERS; parameters that are not given keep the
+                    values of the base pipeline
+        description: Optional free text
+        """
+        parameters = parameters or {}
+        for component, values in parameters.items():
+            if component not in COMPONENT_PARAMETERS:
+                raise ValueError(f"Unknown component '{component}', expected one of {list(COMPONENT_PARAMETERS)}")
+            unknown = [name for name in values if name not in COMPONENT_PARAMETERS[component]]
+            if unknown:
+                raise ValueError(f"Unknown {component} parameters {unknown} in parameter set '{name}'")
+        self.name = name
+        self.parameters = {component: dict(values) for component, values in parameters.items()}
+        self.description = description
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a parameter set from a dictionary with the keys 'name', optionally 'description', and the
+        component names (see COMPONENT_PARAMETERS).
+        """
+        return cls(data["name"], {component: data[component] for component in COMPONENT_PARAMETERS if component in data},
+                   data.get("description", ""))
+
+    def to_dict(self):
+        """
+        Returns: Dictionary representation, as read by from_dict
+        """
+        data = {"name": self.name, "description": self.description}
+        for component, values in self.parameters.items():
+            data[component] = {name: np.asarray(value).tolist() for name, value in values.items()}
+        return data
+
+    def value(self, pipeline, component, name):
+        """
+        Returns: The value of a parameter in this set, or the value of the pipeline component if not overridden
+        """
+        return self.parameters.get(component, {}).get(name, getattr(getattr(pipeline, component), name))
+
+    def apply(self, pipeline):
+        """
+        Set the parameters on the components of a pipeline.
+        pipeline: ElasticPipeline instance
+        """
+        for component, values in self.parameters.items():
+            for name, value in values.items():
+                setattr(getattr(pipeline, component), name, value)
+
+    def pipeline(self, base=None):
+        """
+        Build a pipeline using this parameter set.
+        base: Pipeline whose components provide the parameters not in the set (default components if None)
+        Returns: ElasticPipeline with copies of the base components; a tabulated inverse EOS is not carried over
+        """
+        base = base if base is not None else ElasticPipeline()
+        thermal = copy.deepcopy(base.thermal)
+        pipeline = ElasticPipeline(thermal, copy.deepcopy(base.calculator), copy.deepcopy(base.convertion),
+                                   InverseEOSCalculator(thermal))
+        self.apply(pipeline)
+        return pipeline
+
+
+class ParameterRegistry:
+    def __init__(self, parameter_sets=()):
+        """
+        Ordered collection of parameter sets, addressed by name.
+        parameter_sets: Initial ParameterSet instances
+        """
+        self.sets = {}
+        for parameter_set in parameter_sets:
+            self.register(parameter_set)
+
+    def register(self, parameter_set):
+        """
+        Add a parameter set, replacing a set of the same name.
+        parameter_set: ParameterSet instance
+        """
+        self.sets[parameter_set.name] = parameter_set
+
+    def get(self, name):
+        """
+        Returns: The parameter set of the given name
+        """
+        if name not in self.sets:
+            raise KeyError(f"Unknown parameter set '{name}', available: {self.names()}")
+        return self.sets[name]
+
+    def names(self):
+        """
+        Returns: List of the names, in registration order
+        """
+        return list(self.sets)
+
+    def select(self, names=None):
+        """
+        Returns: List of the parameter sets with the given names, or all of them if names is None
+        """
+        return list(self.sets.values()) if names is None else [self.get(name) for name in names]
+
+    def __len__(self):
+        return len(self.sets)
+
+    def __iter__(self):
+        return iter(self.sets.values())
+
+    def load(self, path):
+        """
+        Register the parameter sets of a JSON file, or of every .json file of a directory in name order.
+        A file holds one set (see ParameterSet.from_dict), a list of sets, or {"parameter_sets": [...]}.
+        path: File or directory path
+        Returns: The registry
+        """
+        filenames = sorted(glob.glob(os.path.join(path, "*.json"))) if os.path.isdir(path) else [path]
+        for filename in filenames:
+            with open(filename) as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get("parameter_sets", [data])
+            for entry in data:
+                self.register(ParameterSet.from_dict(entry))
+        return self
+
+    def save(self, filename):
+        """
+        Write all parameter sets to a JSON file.
+        filename: Output file name
+        """
+        with open(filename, 'w') as f:
+            json.dump({"parameter_sets": [parameter_set.to_dict() for parameter_set in self]}, f, indent=2)
+
+
+def load_registry(*paths):
+    """
+    Create a registry from parameter-set files or directories, see ParameterRegistry.load.
+    Returns: ParameterRegistry
+    """
+    registry = ParameterRegistry()
+    for path in paths:
+        registry.load(path)
+    return registry
+
+
+def stacked_pipeline(parameter_sets, base=None):
+    """
+    Build one pipeline evaluating several parameter sets at once along a leading model axis.
+    Parameters that differ between the sets become (n_models, 1) arrays (lists of such columns for
+    parameter vectors); parameters shared by all sets stay as they are, so the stages depending only on
+    them are evaluated once and broadcast over the models (see ElasticPipeline.compute).
+    parameter_sets: List of ParameterSet instances
+    base: Pipeline providing the parameters the sets do not override (default components if None)
+    Returns: ElasticPipeline
+    """
+    base = base if base is not None else ElasticPipeline()
+    components = {component: copy.copy(getattr(base, component)) for component in COMPONENT_PARAMETERS}
+    for component, names in COMPONENT_PARAMETERS.items():
+        for name in names:
+            values = [np.asarray(parameter_set.value(base, component, name), dtype=float)
+                      for parameter_set in parameter_sets]
+            if all(np.array_equal(value, values[0]) for value in values[1:]):
+                continue
+            if len({value.shape for value in values}) != 1:
+                raise ValueError(f"Parameter {component}.{name} has different lengths in the parameter sets")
+            stacked = np.array(values)
+            setattr(components[component], name,
+                    stacked[:, None] if stacked.ndim == 1 else [column[:, None] for column in stacked.T])
+    return ElasticPipeline(components["thermal"], components["calculator"], components["convertion"],
+                           InverseEOSCalculator(components["thermal"]))
+
+
+def compute_models(parameter_sets, mode, temperatures, values, base=None):
+    """
+    Compute every parameter set on the same state points in one pass.
+    parameter_sets: List of ParameterSet instances
+    mode: 'density' or 'pressure', see ElasticPipeline.compute
+    temperatures: Temperatures (K)
+    values: Densities (g/cm³) or pressures (GPa), broadcastable with temperatures
+    base: Pipeline providing the parameters the sets do not override
+    Returns: Dictionary of (n_models, n_points) arrays with the keys of COLUMNS plus 'status'
+    """
+    T, values = np.broadcast_arrays(np.ravel(np.asarray(temperatures, dtype=float)),
+                                    np.ravel(np.asarray(values, dtype=float)))
+    pipeline = stacked_pipeline(parameter_sets, base)
+    return pipeline.compute(mode, T, values, shape=(len(parameter_sets), T.size))
+
+
+def run_models(parameter_sets, mode, temperatures, values, base=None):
+    """
+    Compute every parameter set on the same state points and collect the results in a table.
+    Returns: DataFrame with the model index ('model', the position in parameter_sets) as the first column,
+             one row per model and point (model-major order), and the columns of COLUMNS and 'status'
+    """
+    results = compute_models(parameter_sets, mode, temperatures, values, base)
+    table = pd.DataFrame({key: np.ravel(results[key]) for key in COLUMNS + ["status"]})
+    table.insert(0, "model", np.repeat(np.arange(len(parameter_sets)), results["status"].shape[1]))
+    return table
@@ -0,0 +1,263 @@
+import numpy as np
+import pandas as pd
+
+from christoffel import ANISOTROPY_COLUMNS, directional_velocities
+from instrumentation import PROFILER
+from stage_cache import hash_values
+from thermal_P import Thermal
+from elastic_constants_calculator import ElasticConstantsCalculator
+from elastic_constants_convertion import ElasticConstantsConvertion
+from elastic_modulus_velocity_calculator import compute_modulus_and_velocity_batch
+from inverse_eos_calculator import InverseEOSCalculator
+from isentrope import DEFAULT_MAX_STEP, integrate_isentropes
+
+# Per-point status codes, in the order the stages are run
+STATUS_OK = 0
+STATUS_INVALID_INPUT = 1     # Temperature, density or pressure is not a finite number
+STATUS_EOS_FAILED = 2        # No volume found for the given pressure and temperature
+STATUS_CIJ_INVALID = 3       # Cij_fit is undefined, i.e. the temperature is below the softening temperature
+STATUS_MODULUS_INVALID = 4   # Moduli or velocities are not finite (mechanically unstable point)
+
+STATUS_REASONS = {
+    STATUS_OK: "ok",
+    STATUS_INVALID_INPUT: "invalid input",
+    STATUS_EOS_FAILED: "EOS not solved",
+    STATUS_CIJ_INVALID: "below softening temperature",
+    STATUS_MODULUS_INVALID: "invalid moduli",
+}
+
+# Profiles with fewer points are solved point by point; the EOS continuation only pays off on longer ones
+MIN_CONTINUATION_POINTS = 5000
+
+# Output columns of the pipeline; C11/C12 are isothermal, C11_S/C12_S adiabatic
+COLUMNS = ["T", "rho", "P", "V", "C11", "C12", "C44", "C11_S", "C12_S",
+           "B_voigt", "G_voigt", "B_reuss", "G_reuss", "B_hill", "G_hill",
+           "Vp_h", "Vs_h", "Vp_v", "Vs_v", "Vp_r", "Vs_r"]
+
+MODES = ("density", "pressure")
+
+# Attributes each cached stage depends on; see ElasticPipeline.stage_keys
+EOS_PARAMETERS = ("para_mgd", "V0", "T0", "d0", "natoms", "mol_mass")
+CIJ_PARAMETERS = ("popt1", "popt2", "popt3", "e0", "e1", "e2")
+CONVERTION_PARAMETERS = ("g0", "q", "V0", "Bt0")
+ALPHA_PARAMETERS = ("para_th", "T0", "V0")
+
+
+class ElasticPipeline:
+    def __init__(self, thermal=None, calculator=None, convertion=None, inverse=None, cache=None):
+        """
+        Chain the EOS, elastic constant, adiabatic correction and modulus/velocity stages
+        as batched array operations.
+        thermal: An instance of the Thermal class (a default one is created if None)
+        calculator: An instance of the ElasticConstantsCalculator class
+        convertion: An instance of the ElasticConstantsConvertion class
+        inverse: An instance of the InverseEOSCalculator class used in pressure mode
+        cache: Optional StageCache; stages whose inputs and parameters are unchanged are then reused
+        """
+        self.thermal = thermal if thermal is not None else Thermal()
+        self.calculator = calculator if calculator is not None else ElasticConstantsCalculator()
+        self.convertion = convertion if convertion is not None else ElasticConstantsConvertion()
+        self.inverse = inverse if inverse is not None else InverseEOSCalculator(self.thermal)
+        self.cache = cache
+
+    def stage_keys(self, mode, temperatures, values):
+        """
+        Build the cache keys of the EOS, Cij and adiabatic stages.
+        Each key chains the key of the stage it depends on with the stage's own parameters, so a
+        parameter change invalidates that stage and everything downstream, but nothing upstream.
+        mode: 'density' or 'pressure'
+        temperatures, values: Input arrays
+        Returns: Dictionary of keys for 'eos', 'cij' and 'adiabatic'
+        """
+        table = getattr(self.inverse, "table", None)
+        eos_key = hash_values(mode, temperatures, values,
+                              [getattr(self.thermal, name) for name in EOS_PARAMETERS],
+                              None if mode == "density" or table is None else table.cache_key())
+        cij_key = hash_values(eos_key, [getattr(self.calculator, name) for name in CIJ_PARAMETERS])
+        adiabatic_key = hash_values(cij_key, [getattr(self.convertion, name) for name in CONVERTION_PARAMETERS],
+                                    [getattr(self.thermal, name) for name in ALPHA_PARAMETERS])
+        return {"eos": eos_key, "cij": cij_key, "adiabatic": adiabatic_key}
+
+    def _cached(self, key, stage):
+        """
+        Return the cached result of a stage, or run it and cache the result.
+        key: Cache key of the stage
+        stage: Function computing the stage, returning a dictionary of arrays
+        """
+        if self.cache is None:
+            return stage()
+        result = self.cache.get(key)
+        if result is None:
+            result = stage()
+            self.cache.put(key, result)
+        return result
+
+    def compute(self, mode, temperatures, values, shape=()):
+        """
+        Run every stage for arrays of state points.
+        mode: 'density' if values are densities (g/cm³), 'pressure' if values are pressures (GPa)
+        temperatures: Temperatures (K)
+        values: Densities or pressures, broadcastable with temperatures
+        shape: Shape of the results when the component parameters are arrays that broadcast beyond the inputs,
+               e.g. (n_models, n_points) for (n_models, 1) parameters and (n_points,) inputs; stages whose
+               parameters are scalars are then evaluated once on the input shape
+        Returns: Dictionary of arrays with the keys of COLUMNS plus 'status' (see STATUS_REASONS)
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+        T, values = np.broadcast_arrays(np.asarray(temperatures, dtype=float), np.asarray(values, dtype=float))
+        status = np.full(np.broadcast_shapes(T.shape, shape), STATUS_OK, dtype=np.int8)
+        status[np.broadcast_to(~(np.isfinite(T) & np.isfinite(values)), status.shape)] = STATUS_INVALID_INPUT
+
+        keys = self.stage_keys(mode, T, values) if self.cache is not None else {}
+
+        with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+            def eos_stage():
+                if mode == "density":
+                    V = self.thermal.rho_to_V(values)
+                    return {"rho": values, "V": V, "P": self.thermal.P_MGD(V, T),
+                            "solved": np.ones(T.shape, dtype=bool)}
+                V, solved = self.inverse.solve_volumes(values, T)
+                return {"rho": self.thermal.V_to_rho(V), "V": V, "P": values, "solved": solved}
+
+            with PROFILER.stage("eos"):
+                eos = self._cached(keys.get("eos"), eos_stage)
+            rho, V, P = eos["rho"], eos["V"], eos["P"]
+            status[(status == STATUS_OK) & ~eos["solved"]] = STATUS_EOS_FAILED
+
+            def cij_stage():
+                c11, c12, c44 = self.calculator.calculate_elastic_constants(rho, T)
+                return {"C11": c11, "C12": c12, "C44": c44}
+
+            with PROFILER.stage("cij"):
+                cij = self._cached(keys.get("cij"), cij_stage)
+            c11, c12, c44 = cij["C11"], cij["C12"], cij["C44"]
+            cij_valid = np.isfinite(c11) & np.isfinite(c12) & np.isfinite(c44)
+            status[(status == STATUS_OK) & ~cij_valid] = STATUS_CIJ_INVALID
+
+            def adiabatic_stage():
+                c11_s, c12_s = self.convertion.adiabatic_elastic_constants(self.thermal, V, T, c11, c12)
+                return {"C11_S": c11_s, "C12_S": c12_s}
+
+            with PROFILER.stage("adiabatic"):
+                adiabatic = self._cached(keys.get("adiabatic"), adiabatic_stage)
+            c11_s, c12_s = adiabatic["C11_S"], adiabatic["C12_S"]
+            with PROFILER.stage("moduli"):
+                moduli = compute_modulus_and_velocity_batch(c11_s, c12_s, c44, rho)
+
+        moduli_valid = np.isfinite(moduli["Vp_h"]) & np.isfinite(moduli["Vs_h"])
+        status[(status == STATUS_OK) & ~moduli_valid] = STATUS_MODULUS_INVALID
+        if PROFILER.enabled:
+            PROFILER.record_failures(status_summary(status))
+
+        results = {"T": T, "rho": rho, "P": P, "V": V, "C11": c11, "C12": c12, "C44": c44,
+                   "C11_S": c11_s, "C12_S": c12_s}
+        results.update(moduli)
+        results = {key: np.broadcast_to(results[key], status.shape) for key in COLUMNS}
+        results["status"] = status
+        return results
+
+    def run(self, mode, temperatures, values):
+        """
+        Run every stage for arrays of state points and collect the results in a table.
+        mode: 'density' or 'pressure', see compute
+        temperatures: Temperatures (K)
+        values: Densities (g/cm³) or pressures (GPa)
+        Returns: DataFrame with one row per (flattened) state point, the columns of COLUMNS and 'status'
+        """
+        results = self.compute(mode, temperatures, values)
+        return pd.DataFrame({key: np.ravel(value) for key, value in results.items()})
+
+    def run_profile(self, temperatures, pressures, depths=None):
+        """
+        Run the pipeline along an ordered pressure-temperature path such as a geotherm, solving the
+        EOS by continuation from point to point (see InverseEOSCalculator.find_volumes_along_path)
+        on paths of at least MIN_CONTINUATION_POINTS points, and point by point on shorter ones.
+        temperatures: Temperatures along the path (K)
+        pressures: Pressures along the path (GPa)
+        depths: Optional depths of the points (km), added as the first column
+        Returns: DataFrame like run, in path order
+        """
+        temperatures, pressures = np.broadcast_arrays(np.atleast_1d(np.asarray(temperatures, dtype=float)),
+                                                      np.atleast_1d(np.asarray(pressures, dtype=float)))
+        with PROFILER.stage("eos"):
+            if pressures.size < MIN_CONTINUATION_POINTS:
+                volumes, solved = self.inverse.solve_volumes(pressures, temperatures)
+            else:
+                volumes, solved = self.inverse.find_volumes_along_path(pressures, temperatures)
+        results = self.run("density", temperatures, self.thermal.V_to_rho(np.where(solved, volumes, np.nan)))
+
+        # Report the input pressures and mark the points without a volume as EOS failures
+        results["P"] = pressures
+        results.loc[~solved & np.isfinite(temperatures) & np.isfinite(pressures), "status"] = STATUS_EOS_FAILED
+        if depths is not None:
+            results.insert(0, "depth", np.asarray(depths, dtype=float))
+        return results
+
+    def run_isentropes(self, potential_temperatures, pressures, P_start=0.0, max_step=DEFAULT_MAX_STEP):
+        """
+        Run the pipeline along isentropes (adiabats) integrated from potential temperatures,
+        see isentrope.integrate_isentropes.
+        potential_temperatures: Temperatures at P_start (K)
+        pressures: Increasing pressures along the isentropes (GPa)
+        P_start: Pressure of the potential temperatures (GPa)
+        max_step: Maximum integration step (GPa)
+        Returns: DataFrame like run with the potential temperature 'Tp' as the first column, one row per
+                 isentrope and pressure (isentrope-major order)
+        """
+        potential_temperatures = np.atleast_1d(np.asarray(potential_temperatures, dtype=float))
+        pressures = np.atleast_1d(np.asarray(pressures, dtype=float))
+        with PROFILER.stage("isentrope"):
+            temperatures, volumes, started = integrate_isentropes(self.thermal, potential_temperatures, pressures,
+                                                                  P_start, max_step, self.inverse)
+        results = self.run("density", temperatures, self.thermal.V_to_rho(volumes))
+
+        # Report the nominal pressures and mark the isentropes without a starting volume as EOS failures
+        results["P"] = np.tile(pressures, potential_temperatures.size)
+        results.loc[np.repeat(~started & np.isfinite(potential_temperatures), pressures.size), "status"] = \
+            STATUS_EOS_FAILED
+        results.insert(0, "Tp", np.repeat(potential_temperatures, pressures.size))
+        return results
+
+    def run_anisotropy(self, mode, temperatures, values, directions=None, n_directions=500):
+        """
+        Run the pipeline and solve the Christoffel equation with the adiabatic elastic constants at every
+        point for a set of propagation directions.
+        mode: 'density' or 'pressure', see compute
+        temperatures: Temperatures (K)
+        values: Densities (g/cm³) or pressures (GPa)
+        directions: (d, 3) array of propagation directions; a Fibonacci sphere of n_directions points if None
+        n_directions: Number of directions of the Fibonacci sphere
+        Returns: DataFrame like run with the columns of christoffel.ANISOTROPY_COLUMNS added, the unit
+                 directions, and a dictionary of (points, d) phase velocity arrays 'Vp', 'Vs1' and 'Vs2' (km/s)
+        """
+        results = self.compute(mode, temperatures, values)
+        with PROFILER.stage("christoffel"):
+            directions, velocities, metrics = directional_velocities(results["C11_S"], results["C12_S"], results["C44"],
+                                                                     results["rho"], directions, n_directions)
+        table = pd.DataFrame({key: np.ravel(value) for key, value in results.items()})
+        for key in ANISOTROPY_COLUMNS:
+            table[key] = np.ravel(metrics[key])
+        return table, directions, {key: value.reshape(-1, len(directions)) for key, value in velocities.items()}
+
+    def run_density(self, temperatures, densities):
+        """
+        Run the pipeline for temperature and density inputs, see run.
+        """
+        return self.run("density", temperatures, densities)
+
+    def run_pressure(self, temperatures, pressures):
+        """
+        Run the pipeline for temperature and pressure inputs, see run.
+        """
+        return self.run("pressure", temperatures, pressures)
+
+
+def status_summary(status):
+    """
+    Count the points of each non-ok status.
+    status: Array of status codes
+    Returns: Dictionary mapping the failure reason to the number of points
+    """
+    codes, counts = np.unique(np.asarray(status), return_counts=True)
+    return {STATUS_REASONS[int(code)]: int(count) for code, count in zip(codes, counts) if code != STATUS_OK}
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from elastic_modulus_velocity_calculator import modulus_and_velocity_derivatives
+from instrumentation import PROFILER
+from pipeline import STATUS_OK
+
+# Sensitivity fields: derivatives with respect to temperature at constant pressure and to pressure at
+# constant temperature, in K, GPa, g/cm³ and km/s units
+SENSITIVITY_COLUMNS = ["drho_dT", "drho_dP", "dVp_dT", "dVs_dT", "dVp_dP", "dVs_dP"]
+
+
+def chain_derivatives(pipeline, results):
+    """
+    Calculate the sensitivity fields of computed state points with analytic chain-rule derivatives through
+    the MGD EOS, Cij_fit, the adiabatic correction and the Hill averages; the pipeline is not run again.
+    pipeline: ElasticPipeline instance that computed the results
+    results: Dictionary returned by ElasticPipeline.compute
+    Returns: Dictionary of arrays with the keys of SENSITIVITY_COLUMNS; NaN where the status is not ok
+    """
+    thermal, calculator, convertion = pipeline.thermal, pipeline.calculator, pipeline.convertion
+    T, V, rho = results["T"], results["V"], results["rho"]
+    c11_s, c12_s, c44 = results["C11_S"], results["C12_S"], results["C44"]
+    valid = results["status"] == STATUS_OK
+
+    with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+        # Volume along an isobar and an isotherm: dV/dT|P = -(dP/dT)_V / (dP/dV)_T, dV/dP|T = 1 / (dP/dV)_T
+        dP_dV = thermal.dP_dV(V, T)
+        dV = {"T": -thermal.dP_dT(V, T) / dP_dV, "P": 1 / dP_dV}
+        dT = {"T": 1.0, "P": 0.0}
+
+        dC_drho, dC_dT = calculator.elastic_constant_derivatives(rho, T)
+        ddc_dV, ddc_dT = convertion.adiabatic_correction_derivatives(thermal, V, T)
+
+        sensitivities = {}
+        for x in ("T", "P"):
+            drho = -rho / V * dV[x]
+            dc = [dC_drho[i] * drho + dC_dT[i] * dT[x] for i in range(3)]
+            dcorrection = ddc_dV * dV[x] + ddc_dT * dT[x]
+            derivatives = modulus_and_velocity_derivatives(c11_s, c12_s, c44, rho, dc[0] + dcorrection,
+                                                           dc[1] + dcorrection, dc[2], drho)
+            sensitivities[f"drho_d{x}"] = drho
+            sensitivities[f"dVp_d{x}"] = derivatives["Vp_h"]
+            sensitivities[f"dVs_d{x}"] = derivatives["Vs_h"]
+    return {key: np.where(valid, np.broadcast_to(sensitivities[key], valid.shape), np.nan)
+            for key in SENSITIVITY_COLUMNS}
+
+
+def compute_sensitivities(pipeline, mode, temperatures, values):
+    """
+    Run the pipeline once and return the results together with the sensitivity fields.
+    pipeline: ElasticPipeline instance
+    mode: 'density' or 'pressure', see ElasticPipeline.compute
+    temperatures: Temperatures (K)
+    values: Densities (g/cm³) or pressures (GPa)
+    Returns: Dictionary of the pipeline results with the keys of SENSITIVITY_COLUMNS added
+    """
+    results = pipeline.compute(mode, temperatures, values)
+    with PROFILER.stage("sensitivity"):
+        results.update(chain_derivatives(pipeline, results))
+    return results
+
+
+def run_sensitivities(pipeline, mode, temperatures, values):
+    """
+    Like compute_sensitivities, collecting the results in a table with one row per (flattened) state point.
+    Returns: DataFrame with the columns of ElasticPipeline.run followed by SENSITIVITY_COLUMNS
+    """
+    results = compute_sensitivities(pipeline, mode, temperatures, values)
+    return pd.DataFrame({key: np.ravel(value) for key, value in results.items()})
@@ -0,0 +1,305 @@
+import argparse
+import json
+import math
+import queue
+import threading
+import time
+import urllib.request
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from eos_table import DEFAULT_CACHE_DIR, InverseEOSTable
+from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import COLUMNS, MODES, ElasticPipeline
+from thermal_P import Thermal
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# A batch is computed once it holds this many points or its first request has waited this long (s)
+DEFAULT_MAX_BATCH = 100000
+DEFAULT_MAX_DELAY = 0.002
+
+
+class QueryBatcher:
+    def __init__(self, pipeline, max_batch=DEFAULT_MAX_BATCH, max_delay=DEFAULT_MAX_DELAY):
+        """
+        Coalesce concurrent queries into batched pipeline evaluations on a single worker thread.
+        Queries of the same mode that arrive within max_delay of each other are concatenated, computed
+        with one ElasticPipeline.compute call and split again.
+        pipeline: ElasticPipeline instance kept warm for the lifetime of the batcher
+        max_batch: Maximum number of points per batch (a larger single query is computed on its own)
+        max_delay: Maximum time the first query of a batch waits for others (s)
+        """
+        self.pipeline = pipeline
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.points = 0
+        self.thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, mode, temperatures, values):
+        """
+        Queue a query.
+        mode: 'density' or 'pressure'
+        temperatures: Temperatures (K)
+        values: Densities (g/cm³) or pressures (GPa), broadcastable with temperatures
+        Returns: Future resolving to the dictionary returned by ElasticPipeline.compute, with 1-D arrays
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+        T, values = np.broadcast_arrays(np.atleast_1d(np.asarray(temperatures, dtype=float)),
+                                        np.atleast_1d(np.asarray(values, dtype=float)))
+        if T.ndim != 1:
+            raise ValueError("Queries must be scalars or 1-D arrays")
+        future = Future()
+        self.queue.put((mode, T, values, future))
+        return future
+
+    def compute(self, mode, temperatures, values):
+        """
+        Queue a query and wait for its result, see submit.
+        """
+        return self.submit(mode, temperatures, values).result()
+
+    def close(self):
+        """
+        Stop the worker thread after the queued queries are computed.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _collect(self, first):
+        """
+        Gather the queries that arrive within max_delay after the first one.
+        Returns: List of queries and whether the stop marker was received
+        """
+        batch = [first]
+        size = first[1].size
+        deadline = time.monotonic() + self.max_delay
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += item[1].size
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self.queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            for mode in MODES:
+                queries = [query for query in batch if query[0] == mode]
+                if queries:
+                    self._compute(mode, queries)
+
+    def _compute(self, mode, queries):
+        """
+        Compute the queries of one mode together and hand each its slice of the results.
+        """
+        sizes = [query[1].size for query in queries]
+        try:
+            results = self.pipeline.compute(mode, np.concatenate([query[1] for query in queries]),
+                                            np.concatenate([query[2] for query in queries]))
+        except Exception as error:
+            for query in queries:
+                query[3].set_exception(error)
+            return
+        self.requests += len(queries)
+        self.batches += 1
+        self.points += sum(sizes)
+        offsets = np.cumsum([0] + sizes)
+        for query, start, stop in zip(queries, offsets[:-1], offsets[1:]):
+            query[3].set_result({key: value[start:stop] for key, value in results.items()})
+
+
+def _json_list(values):
+    """
+    Convert an array to a list for strict JSON, with NaN and infinities as null.
+    """
+    return [value if math.isfinite(value) else None for value in values.tolist()]
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the query server.
+    POST /compute with a JSON body {"mode": "density" | "pressure", "T": [...], "values": [...],
+    "columns": [...] (optional, default all of COLUMNS)} returns {"<column>": [...], ..., "status": [...]},
+    with null for values that could not be calculated.
+    GET /health returns the number of queries, batches and points computed so far.
+    """
+    protocol_version = "HTTP/1.1"   # Keep connections alive between queries
+    server_version = "CaSiO3Server/1.0"
+
+    def _reply(self, code, data):
+        """
+        Send a JSON response.
+        code: HTTP status code
+        data: JSON-serializable reply
+        """
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """
+        Answer GET /health with the counters of the batcher; other paths are not found (404).
+        """
+        if self.path != "/health":
+            self._reply(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        batcher = self.server.batcher
+        self._reply(200, {"ok": True, "requests": batcher.requests, "batches": batcher.batches,
+                          "points": batcher.points})
+
+    def do_POST(self):
+        """
+        Answer POST /compute: queue the query on the batcher and reply with the requested columns once its
+        batch is computed; malformed queries are rejected (400) and failed computations reported (500).
+        """
+        if self.path != "/compute":
+            self._reply(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        try:
+            query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if not isinstance(query, dict):
+                raise ValueError("request body must be a JSON object")
+            columns = query.get("columns", COLUMNS)
+            unknown = [column for column in columns if column not in COLUMNS]
+            if unknown:
+                raise ValueError(f"Unknown columns {unknown}")
+            future = self.server.batcher.submit(query["mode"], query["T"], query["values"])
+        except (KeyError, TypeError, ValueError) as error:
+            self._reply(400, {"error": f"Invalid query: {error}"})
+            return
+        try:
+            results = future.result()
+        except Exception as error:
+            self._reply(500, {"error": f"Computation failed: {error}"})
+            return
+        reply = {column: _json_list(results[column]) for column in columns}
+        reply["status"] = results["status"].tolist()
+        self._reply(200, reply)
+
+    def log_message(self, format, *args):
+        """
+        Log the requests only if the server is verbose.
+        """
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256   # Listen backlog; the default of 5 refuses bursts of concurrent clients
+
+    def __init__(self, pipeline, host=DEFAULT_HOST, port=DEFAULT_PORT, max_batch=DEFAULT_MAX_BATCH,
+                 max_delay=DEFAULT_MAX_DELAY, verbose=False):
+        """
+        Local HTTP server answering pipeline queries from a warm, in-memory pipeline, see QueryHandler.
+        pipeline: ElasticPipeline instance
+        host, port: Address to listen on; keep the default loopback address unless the service must be remote
+        max_batch, max_delay: Batching limits, see QueryBatcher
+        verbose: Log every request
+        """
+        super().__init__((host, port), QueryHandler)
+        self.batcher = QueryBatcher(pipeline, max_batch, max_delay)
+        self.verbose = verbose
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+def query_server(mode, temperatures, values, columns=None, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=60):
+    """
+    Send a query to a running server.
+    mode: 'density' or 'pressure'
+    temperatures: Temperatures (K)
+    values: Densities (g/cm³) or pressures (GPa)
+    columns: Result columns to return (default all of COLUMNS)
+    url: Base URL of the server
+    timeout: Timeout of the request (s)
+    Returns: Dictionary of arrays with the requested columns and 'status'
+    """
+    query = {"mode": mode, "T": np.atleast_1d(temperatures).astype(float).tolist(),
+             "values": np.atleast_1d(values).astype(float).tolist()}
+    if columns is not None:
+        query["columns"] = list(columns)
+    request = urllib.request.Request(f"{url}/compute", data=json.dumps(query).encode(),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        reply = json.load(response)
+    return {key: np.array(value, dtype=np.int8 if key == "status" else float) for key, value in reply.items()}
+
+
+def build_pipeline(table=False, P_range=(0.0, 200.0), T_range=(300.0, 4000.0), cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Initialize the pipeline the server keeps in memory.
+    table: Use a tabulated inverse EOS (loaded from cache_dir or built once) inside P_range and T_range
+    P_range, T_range: Range of the table (GPa, K)
+    cache_dir: Cache directory of the table
+    Returns: ElasticPipeline instance
+    """
+    thermal = Thermal()
+    inverse = InverseEOSCalculator(thermal, InverseEOSTable(thermal, P_range, T_range, cache_dir=cache_dir)
+                                   if table else None)
+    pipeline = ElasticPipeline(thermal, inverse=inverse)
+    # Run every code path once so that the first real query does not pay for lazy initialization
+    pipeline.compute("density", 2000.0, 5.0)
+    pipeline.compute("pressure", 2000.0, 50.0)
+    return pipeline
+
+
+def main(argv=None):
+    """
+    Start the query server from the command line.
+    argv: list of arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="Serve pipeline queries from a warm process over local HTTP.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port (default: {DEFAULT_PORT})")
+    parser.add_argument("--table", action="store_true",
+                        help="answer pressure queries from a tabulated inverse EOS where it covers them")
+    parser.add_argument("--table-pressure", nargs=2, type=float, default=(0.0, 200.0), metavar=("MIN", "MAX"),
+                        help="pressure range of the table (GPa, default: 0 200)")
+    parser.add_argument("--table-temperature", nargs=2, type=float, default=(300.0, 4000.0), metavar=("MIN", "MAX"),
+                        help="temperature range of the table (K, default: 300 4000)")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH,
+                        help=f"maximum number of points per batch (default: {DEFAULT_MAX_BATCH})")
+    parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY * 1000, metavar="MS",
+                        help=f"time a query waits for others to batch with (default: {DEFAULT_MAX_DELAY * 1000:g} ms)")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args(argv)
+
+    pipeline = build_pipeline(args.table, args.table_pressure, args.table_temperature)
+    server = QueryServer(pipeline, args.host, args.port, args.max_batch, args.max_delay / 1000, args.verbose)
+    print(f"Serving on http://{args.host}:{server.server_port} (POST /compute, GET /health); press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
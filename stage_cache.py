@@ -0,0 +1,107 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def hash_values(*values):
+    """
+    Hash numbers, strings, arrays and (nested) lists or tuples of them.
+    values: values to hash
+    Returns: Hexadecimal SHA-256 digest
+    """
+    digest = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, (list, tuple)):
+            digest.update(b"[")
+            for item in value:
+                update(item)
+            digest.update(b"]")
+        elif value is None or isinstance(value, str):
+            digest.update(repr(value).encode())
+        else:
+            array = np.ascontiguousarray(value)
+            digest.update(f"{array.dtype.str}{array.shape}".encode())
+            digest.update(array.tobytes())
+
+    for value in values:
+        update(value)
+    return digest.hexdigest()
+
+
+class StageCache:
+    def __init__(self, max_entries=16, cache_dir=None):
+        """
+        Cache of pipeline stage results in memory with LRU eviction and, optionally, on disk.
+        Each entry is a dictionary of arrays stored under a key built by the caller from the
+        stage inputs and parameters (see hash_values).
+        max_entries: Maximum number of entries kept in memory
+        cache_dir: Directory of the on-disk cache, or None to keep entries in memory only
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        """
+        key: Cache key
+        Returns: Path of the cache file of the key in cache_dir
+        """
+        return os.path.join(self.cache_dir, f"stage_{key[:32]}.npz")
+
+    def get(self, key):
+        """
+        Look up a stage result.
+        key: Cache key
+        Returns: Dictionary of arrays, or None if the key is not cached
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with np.load(self._path(key)) as data:
+                result = {name: data[name] for name in data.files}
+            self._remember(key, result)
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """
+        Store a stage result.
+        key: Cache key
+        result: Dictionary of arrays
+        """
+        result = {name: np.array(value) for name, value in result.items()}
+        self._remember(key, result)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write to a temporary file first so that concurrent runs never read a partial entry
+            tmp_path = f"{self._path(key)}.{os.getpid()}.tmp.npz"
+            np.savez(tmp_path, **result)
+            os.replace(tmp_path, self._path(key))
+
+    def _remember(self, key, result):
+        """
+        Keep an entry in memory as the most recently used one, evicting the least recently used beyond max_entries.
+        key: Cache key
+        result: Dictionary of arrays
+        """
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop all in-memory entries (files in cache_dir are kept).
+        """
+        self.entries.clear()
@@ -0,0 +1,471 @@
+import argparse
+import json
+import warnings
+
+import numpy as np
+import pandas as pd
+from numpy.polynomial import chebyshev
+
+from adaptive import softening_temperatures
+from eos_table import ERROR_SAFETY_FACTOR
+from instrumentation import PROFILER
+from pipeline import (ALPHA_PARAMETERS, CIJ_PARAMETERS, COLUMNS, CONVERTION_PARAMETERS, EOS_PARAMETERS, MODES,
+                      STATUS_CIJ_INVALID, STATUS_INVALID_INPUT, STATUS_OK, ElasticPipeline)
+from stage_cache import hash_values
+
+# Bump when the file layout or the coordinate mapping changes
+SURROGATE_FORMAT_VERSION = 1
+
+# Maximum number of points evaluated at a time
+DEFAULT_MAX_ELEMENTS = 2**20
+
+# Points summed at a time within a patch, small enough for the intermediate products to stay in cache
+PATCH_BLOCK = 1024
+
+# Distances above the softening temperature (K) scanned for the lower edge of the covered region
+MARGIN_SCAN = (1e-3, 200.0)
+
+
+def parameter_key(pipeline):
+    """
+    Fingerprint of every material parameter of a pipeline.
+    Returns: Hexadecimal SHA-256 digest
+    """
+    return hash_values([getattr(pipeline.thermal, name) for name in EOS_PARAMETERS + ALPHA_PARAMETERS],
+                       [getattr(pipeline.calculator, name) for name in CIJ_PARAMETERS],
+                       [getattr(pipeline.convertion, name) for name in CONVERTION_PARAMETERS])
+
+
+def surrogate_columns(mode):
+    """
+    Returns: The result columns approximated by a surrogate of the given mode (all but the inputs)
+    """
+    inputs = ("T", "rho" if mode == "density" else "P")
+    return [column for column in COLUMNS if column not in inputs]
+
+
+def chebyshev_nodes(degree):
+    """
+    Returns: The degree + 1 Chebyshev points of the first kind on [-1, 1], in increasing order
+    """
+    return np.cos(np.pi * (np.arange(degree, -1, -1) + 0.5) / (degree + 1))
+
+
+class ChebyshevSurrogate:
+    def __init__(self, mode, value_range, T_range, margin, columns, Tc_coefficients, patches, coefficients,
+                 index_map, max_error, parameters=""):
+        """
+        Piecewise Chebyshev approximation of the pipeline over a temperature x density (or pressure) box.
+        The region covered is T_c(x) + margin <= T <= T_range[1] for x in value_range, where T_c is the
+        softening temperature: in the coordinates x and s = log((T - T_c) / margin) / log((T_max - T_c) / margin)
+        the 1/sqrt(T - T_c) term of Cij_fit is smooth, so each patch of the (x, s) unit square holds a
+        tensor-product Chebyshev series. Points below T_range[0] but above T_c + margin are covered as well.
+        mode: 'density' or 'pressure'
+        value_range: (lower, upper) density (g/cm³) or pressure (GPa) limits
+        T_range: (lower, upper) temperature limits (K)
+        margin: Distance above the softening temperature where the covered region starts (K)
+        columns: Approximated result columns
+        Tc_coefficients: Chebyshev coefficients of T_c over value_range
+        patches: (n_patches, 4) array of patch bounds (x_lower, x_upper, s_lower, s_upper) in unit coordinates
+        coefficients: (n_patches, n_columns, degree + 1, degree + 1) Chebyshev coefficients
+        index_map: 2-D array mapping the cells of the finest level to patch indices
+        max_error: Dictionary of the stated maximum absolute error of each column
+        parameters: Fingerprint of the pipeline parameters, see parameter_key
+        """
+        self.mode = mode
+        self.value_range = (float(value_range[0]), float(value_range[1]))
+        self.T_range = (float(T_range[0]), float(T_range[1]))
+        self.margin = float(margin)
+        self.columns = list(columns)
+        self.Tc_coefficients = np.asarray(Tc_coefficients, dtype=float)
+        self.patches = np.asarray(patches, dtype=float)
+        self.coefficients = np.asarray(coefficients, dtype=float)
+        self.index_map = np.asarray(index_map, dtype=np.int32)
+        self.max_error = dict(max_error)
+        self.parameters = parameters
+
+    @property
+    def degree(self):
+        return self.coefficients.shape[-1] - 1
+
+    def x_unit(self, values):
+        """
+        Returns: Densities or pressures mapped to [0, 1]
+        """
+        return (np.asarray(values, dtype=float) - self.value_range[0]) / (self.value_range[1] - self.value_range[0])
+
+    def softening_temperature(self, values):
+        """
+        Returns: The softening temperature (K) interpolated at densities or pressures inside value_range
+        """
+        return chebyshev.chebval(2 * self.x_unit(values) - 1, self.Tc_coefficients)
+
+    def to_temperature(self, values, s):
+        """
+        Map unit coordinates s back to temperatures.
+        Returns: Temperatures (K)
+        """
+        Tc = self.softening_temperature(values)
+        return Tc + self.margin * np.exp(s * np.log((self.T_range[1] - Tc) / self.margin))
+
+    def to_unit(self, temperatures, values):
+        """
+        Map temperatures to unit coordinates s; s < 0 below T_c + margin and s > 1 above T_range[1].
+        Returns: Array of s
+        """
+        Tc = self.softening_temperature(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.log((np.asarray(temperatures, dtype=float) - Tc) / self.margin) / \
+                np.log((self.T_range[1] - Tc) / self.margin)
+
+    def _evaluate_patches(self, patch, x, s, columns):
+        """
+        Sum the Chebyshev series of the given columns at unit coordinates, grouped by patch.
+        Returns: (n, len(columns)) array
+        """
+        selection = [self.columns.index(column) for column in columns]
+        degree = self.degree
+        out = np.empty((patch.size, len(selection)))
+        order = np.argsort(patch, kind="stable")
+        starts = np.flatnonzero(np.r_[True, patch[order][1:] != patch[order][:-1]])
+        for start, stop in zip(starts, np.r_[starts[1:], order.size]):
+            bounds = self.patches[patch[order[start]]]
+            # c[i, k * (degree + 1) + j] for column k
+            c = self.coefficients[patch[order[start]]][selection].transpose(1, 0, 2).reshape(degree + 1, -1)
+            for block in range(start, stop, PATCH_BLOCK):
+                index = order[block:min(block + PATCH_BLOCK, stop)]
+                basis_x = chebyshev.chebvander(2 * (x[index] - bounds[0]) / (bounds[1] - bounds[0]) - 1, degree)
+                basis_s = chebyshev.chebvander(2 * (s[index] - bounds[2]) / (bounds[3] - bounds[2]) - 1, degree)
+                # sum_ij c[k, i, j] T_i(xi) T_j(eta): one matrix product over i, then a batched one over j
+                partial = (basis_x @ c).reshape(index.size, len(selection), degree + 1)
+                out[index] = (partial @ basis_s[:, :, None])[:, :, 0]
+        return out
+
+    def evaluate(self, temperatures, values, columns=None, max_elements=DEFAULT_MAX_ELEMENTS):
+        """
+        Evaluate the surrogate with polynomial arithmetic only.
+        temperatures: Temperatures (K)
+        values: Densities (g/cm³) or pressures (GPa), broadcastable with temperatures
+        columns: Result columns to evaluate (all approximated columns if None)
+        max_elements: Maximum number of points evaluated at a time
+        Returns: Dictionary of arrays with T, the input column, the requested columns and 'status', which is
+                 STATUS_CIJ_INVALID below T_c + margin and STATUS_INVALID_INPUT outside the box (NaN values)
+        """
+        columns = self.columns if columns is None else list(columns)
+        unknown = [column for column in columns if column not in self.columns]
+        if unknown:
+            raise ValueError(f"Columns {unknown} are not approximated by this surrogate")
+        T, values = np.broadcast_arrays(np.asarray(temperatures, dtype=float), np.asarray(values, dtype=float))
+        shape = T.shape
+        T, values = T.ravel(), values.ravel()
+        results = {column: np.full(T.size, np.nan) for column in columns}
+        status = np.full(T.size, STATUS_INVALID_INPUT, dtype=np.int8)
+        n_x, n_s = self.index_map.shape
+
+        with PROFILER.stage("surrogate"):
+            for start in range(0, T.size, max_elements):
+                chunk = slice(start, min(start + max_elements, T.size))
+                x = self.x_unit(values[chunk])
+                inside_x = (x >= 0) & (x <= 1) & np.isfinite(T[chunk])
+                s = np.full(x.size, np.nan)
+                s[inside_x] = self.to_unit(T[chunk][inside_x], values[chunk][inside_x])
+                below = inside_x & ~(s >= 0) & (T[chunk] <= self.T_range[1])
+                inside = inside_x & (s >= 0) & (s <= 1)
+                chunk_status = np.full(x.size, STATUS_INVALID_INPUT, dtype=np.int8)
+                chunk_status[below] = STATUS_CIJ_INVALID
+                chunk_status[inside] = STATUS_OK
+                status[chunk] = chunk_status
+
+                index = np.flatnonzero(inside)
+                if index.size:
+                    cell_x = np.minimum((x[index] * n_x).astype(np.int64), n_x - 1)
+                    cell_s = np.minimum((s[index] * n_s).astype(np.int64), n_s - 1)
+                    patch = self.index_map[cell_x, cell_s]
+                    computed = self._evaluate_patches(patch, x[index], s[index], columns)
+                    for k, column in enumerate(columns):
+                        results[column][chunk][index] = computed[:, k]
+
+        results["T"] = T
+        results["rho" if self.mode == "density" else "P"] = values
+        results["status"] = status
+        return {key: value.reshape(shape) for key, value in results.items()}
+
+    def run(self, temperatures, values):
+        """
+        Evaluate every column and collect the results in a table like ElasticPipeline.run.
+        Returns: DataFrame with one row per (flattened) point; columns that are not approximated are NaN
+        """
+        results = self.evaluate(temperatures, values)
+        n = results["status"].size
+        return pd.DataFrame({key: np.ravel(results[key]) if key in results else np.full(n, np.nan)
+                             for key in COLUMNS + ["status"]})
+
+    def save(self, filename):
+        """
+        Write the surrogate to a compressed .npz file.
+        filename: Output file name
+        """
+        metadata = {"version": SURROGATE_FORMAT_VERSION, "mode": self.mode, "value_range": self.value_range,
+                    "T_range": self.T_range, "margin": self.margin, "columns": self.columns,
+                    "max_error": self.max_error, "parameters": self.parameters}
+        np.savez_compressed(filename, metadata=json.dumps(metadata), Tc_coefficients=self.Tc_coefficients,
+                            patches=self.patches, coefficients=self.coefficients, index_map=self.index_map)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a surrogate written by save.
+        filename: File name
+        Returns: ChebyshevSurrogate
+        """
+        with np.load(filename) as data:
+            metadata = json.loads(str(data["metadata"]))
+            if metadata["version"] != SURROGATE_FORMAT_VERSION:
+                raise ValueError(f"{filename} has surrogate format {metadata['version']}, "
+                                 f"expected {SURROGATE_FORMAT_VERSION}")
+            return cls(metadata["mode"], metadata["value_range"], metadata["T_range"], metadata["margin"],
+                       metadata["columns"], data["Tc_coefficients"], data["patches"], data["coefficients"],
+                       data["index_map"], metadata["max_error"], metadata["parameters"])
+
+    def matches(self, pipeline):
+        """
+        Returns: True if the surrogate was built with the material parameters of the pipeline
+        """
+        return self.parameters == parameter_key(pipeline)
+
+
+def fit_softening_temperature(pipeline, mode, value_range, tolerance=1e-6, max_degree=256):
+    """
+    Fit a Chebyshev series to the softening temperature over value_range, doubling the degree until
+    the error at the midpoints between the nodes is below tolerance.
+    Returns: Chebyshev coefficients on [-1, 1]
+    """
+    degree = 16
+    while True:
+        nodes = chebyshev_nodes(degree)
+        x = value_range[0] + (nodes + 1) / 2 * (value_range[1] - value_range[0])
+        Tc = softening_temperatures(pipeline, mode, x)
+        if not np.isfinite(Tc).all():
+            raise ValueError("The softening temperature could not be solved over the whole value range")
+        coefficients = chebyshev.chebfit(nodes, Tc, degree)
+        midpoints = 0.5 * (nodes[1:] + nodes[:-1])
+        exact = softening_temperatures(pipeline, mode, value_range[0] + (midpoints + 1) / 2 *
+                                       (value_range[1] - value_range[0]))
+        if np.max(np.abs(chebyshev.chebval(midpoints, coefficients) - exact)) <= tolerance or degree >= max_degree:
+            return coefficients
+        degree *= 2
+
+
+def find_margin(pipeline, mode, value_range, T_max, Tc_coefficients, columns, n_values=33, n_steps=400):
+    """
+    Find how far above the softening temperature the pipeline is defined everywhere in value_range, by
+    scanning logarithmically spaced distances (see MARGIN_SCAN) at n_values densities or pressures.
+    A point counts as defined if its status is ok and all the columns are finite (Vs_r is NaN where
+    G_reuss is still negative just above the status-ok region).
+    Returns: Margin (K), 10% above the largest distance at which a point is undefined
+    """
+    nodes = chebyshev_nodes(n_values - 1)
+    x = value_range[0] + (nodes + 1) / 2 * (value_range[1] - value_range[0])
+    Tc = chebyshev.chebval(nodes, Tc_coefficients)
+    distances = np.geomspace(MARGIN_SCAN[0], min(MARGIN_SCAN[1], T_max - Tc.max()), n_steps)
+    results = pipeline.compute(mode, Tc[:, None] + distances, x[:, None])
+    invalid = (results["status"] != STATUS_OK).any(axis=0)
+    for column in columns:
+        invalid |= ~np.isfinite(results[column]).all(axis=0)
+    return 1.1 * distances[np.flatnonzero(invalid)[-1]] if invalid.any() else MARGIN_SCAN[0]
+
+
+def build_surrogate(pipeline, mode, T_range, value_range, columns=None, degree=12, base=(2, 4), max_depth=6,
+                    rtol=1e-6, margin=None, n_verify=100000, seed=0):
+    """
+    Fit a ChebyshevSurrogate of the pipeline.
+    The (x, s) unit square (see ChebyshevSurrogate) is covered by base patches, which are split into four
+    until the interpolation error at the midpoints between the Chebyshev nodes is at most rtol times the
+    largest magnitude of each column, or max_depth splits are reached. All nodes and checks of a level are
+    computed as one batch. The surrogate is then checked against the pipeline at n_verify random points of
+    the covered region; the stated maximum error of each column is ERROR_SAFETY_FACTOR times the largest
+    error found at the check and verification points.
+    pipeline: ElasticPipeline instance with the final parameters
+    mode: 'density' or 'pressure'
+    T_range: (lower, upper) temperature limits (K)
+    value_range: (lower, upper) density (g/cm³) or pressure (GPa) limits
+    columns: Result columns to approximate (see surrogate_columns if None)
+    degree: Degree of the Chebyshev series of each patch in both coordinates
+    base: Number of base patches along x and s
+    max_depth: Maximum number of splits of a base patch
+    rtol: Relative error tolerance
+    margin: Distance above the softening temperature where the covered region starts (K); if None, the
+            smallest distance above which the pipeline is defined everywhere (see find_margin)
+    n_verify: Number of random verification points
+    seed: Seed of the verification points
+    Returns: ChebyshevSurrogate
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+    columns = surrogate_columns(mode) if columns is None else list(columns)
+    value_range = (float(value_range[0]), float(value_range[1]))
+    T_range = (float(T_range[0]), float(T_range[1]))
+
+    Tc_coefficients = fit_softening_temperature(pipeline, mode, value_range)
+    if margin is None:
+        margin = find_margin(pipeline, mode, value_range, T_range[1], Tc_coefficients, columns)
+    surrogate = ChebyshevSurrogate(mode, value_range, T_range, margin, columns, Tc_coefficients,
+                                   np.zeros((0, 4)), np.zeros((0, len(columns), degree + 1, degree + 1)),
+                                   np.zeros((1, 1)), {}, parameter_key(pipeline))
+    if np.any(T_range[1] <= surrogate.softening_temperature(np.linspace(*value_range, 257)) + margin):
+        raise ValueError("The upper temperature limit is below the softening temperature plus the margin "
+                         "for part of the value range")
+
+    nodes = chebyshev_nodes(degree)
+    checks = 0.5 * (nodes[1:] + nodes[:-1])
+    inverse = np.linalg.inv(chebyshev.chebvander(nodes, degree))
+    check_basis = chebyshev.chebvander(checks, degree)
+
+    def compute(patches, xi, eta):
+        # Pipeline values of all patches at the tensor grid xi x eta of local coordinates
+        x = patches[:, 0, None, None] + (xi[:, None] + 1) / 2 * (patches[:, 1] - patches[:, 0])[:, None, None]
+        s = patches[:, 2, None, None] + (eta[None, :] + 1) / 2 * (patches[:, 3] - patches[:, 2])[:, None, None]
+        x, s = np.broadcast_arrays(x, s)
+        values = value_range[0] + x * (value_range[1] - value_range[0])
+        results = pipeline.compute(mode, surrogate.to_temperature(values, s), values)
+        computed = np.stack([results[column] for column in columns], axis=1)
+        return computed, (results["status"] == STATUS_OK) & np.isfinite(computed).all(axis=1)
+
+    edges_x = np.linspace(0, 1, base[0] + 1)
+    edges_s = np.linspace(0, 1, base[1] + 1)
+    bx, bs = np.meshgrid(np.arange(base[0]), np.arange(base[1]), indexing="ij")
+    patches = np.stack([edges_x[bx.ravel()], edges_x[bx.ravel() + 1], edges_s[bs.ravel()], edges_s[bs.ravel() + 1]],
+                       axis=1)
+    cells = np.stack([bx.ravel(), bs.ravel()], axis=1) * 2**max_depth
+    accepted_patches, accepted_coefficients, accepted_cells, accepted_depths = [], [], [], []
+    check_error = np.zeros(len(columns))
+    scale = None
+    unresolved = 0
+
+    with PROFILER.stage("surrogate_fit"):
+        for depth in range(max_depth + 1):
+            values, valid = compute(patches, nodes, nodes)
+            exact, check_valid = compute(patches, checks, checks)
+            defined = valid.all(axis=(1, 2)) & check_valid.all(axis=(1, 2))
+            if scale is None:
+                scale = np.nanmax(np.abs(values), axis=(0, 2, 3))
+            # C[k] = V^-1 F[k] V^-T for the node values F of each column
+            coefficients = np.einsum("ai,pkij,bj->pkab", inverse, values, inverse)
+            estimate = np.einsum("ia,pkab,jb->pkij", check_basis, coefficients, check_basis)
+            error = np.max(np.abs(estimate - exact), axis=(2, 3))
+            accept = defined & np.all(error <= rtol * scale, axis=1)
+            if depth == max_depth:
+                if not defined.all():
+                    raise ValueError("The pipeline is undefined inside the covered region; increase the margin")
+                unresolved = np.count_nonzero(~accept)
+                accept[:] = True
+            check_error = np.maximum(check_error, np.max(error[accept], axis=0, initial=0.0))
+            accepted_patches.append(patches[accept])
+            accepted_coefficients.append(coefficients[accept])
+            accepted_cells.append(cells[accept])
+            accepted_depths.append(np.full(np.count_nonzero(accept), depth))
+
+            split, cells = patches[~accept], cells[~accept]
+            if split.size == 0:
+                break
+            x_mid = 0.5 * (split[:, 0] + split[:, 1])
+            s_mid = 0.5 * (split[:, 2] + split[:, 3])
+            half = 2**(max_depth - depth - 1)
+            patches = np.concatenate([np.stack([split[:, 0], x_mid, split[:, 2], s_mid], axis=1),
+                                      np.stack([x_mid, split[:, 1], split[:, 2], s_mid], axis=1),
+                                      np.stack([split[:, 0], x_mid, s_mid, split[:, 3]], axis=1),
+                                      np.stack([x_mid, split[:, 1], s_mid, split[:, 3]], axis=1)])
+            cells = np.concatenate([cells, cells + [half, 0], cells + [0, half], cells + [half, half]])
+
+    if unresolved:
+        warnings.warn(f"{unresolved} patches did not reach the tolerance after {max_depth} splits; "
+                      f"their error is included in the stated maximum error")
+    surrogate.patches = np.concatenate(accepted_patches)
+    surrogate.coefficients = np.concatenate(accepted_coefficients)
+    index_map = np.full((base[0] * 2**max_depth, base[1] * 2**max_depth), -1, dtype=np.int32)
+    for index, ((i, j), depth) in enumerate(zip(np.concatenate(accepted_cells), np.concatenate(accepted_depths))):
+        size = 2**(max_depth - depth)
+        index_map[i:i + size, j:j + size] = index
+    surrogate.index_map = index_map
+
+    # Verification at random points of the covered region
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(*value_range, n_verify)
+    T = surrogate.to_temperature(values, rng.uniform(0, 1, n_verify))
+    exact = pipeline.compute(mode, T, values)
+    approximate = surrogate.evaluate(T, values)
+    ok = exact["status"] == STATUS_OK
+    for column in columns:
+        ok &= np.isfinite(exact[column])
+    if not ok.all():
+        warnings.warn(f"The pipeline is undefined at {np.count_nonzero(~ok)} verification points inside the "
+                      f"covered region; increase the margin")
+    surrogate.max_error = {
+        column: float(ERROR_SAFETY_FACTOR * max(check_error[k], np.max(np.abs(approximate[column] - exact[column])[ok],
+                                                                      initial=0.0)))
+        for k, column in enumerate(columns)}
+    return surrogate
+
+
+def check_surrogate(surrogate, pipeline, temperatures, values, n_points=1000, seed=0):
+    """
+    Compare the surrogate with the exact pipeline at a random subset of the given points inside the covered
+    region.
+    surrogate: ChebyshevSurrogate
+    pipeline: ElasticPipeline instance with the parameters the surrogate was built with
+    temperatures: Temperatures (K)
+    values: Densities (g/cm³) or pressures (GPa)
+    n_points: Maximum number of points checked
+    seed: Seed of the selection
+    Returns: Dictionary of the largest absolute error of each column (empty if no point is covered) and the
+             number of checked points at which the pipeline disagrees with the surrogate status
+    """
+    T, values = (np.ravel(array) for array in np.broadcast_arrays(np.asarray(temperatures, dtype=float),
+                                                                  np.asarray(values, dtype=float)))
+    covered = np.flatnonzero(surrogate.evaluate(T, values, columns=[])["status"] == STATUS_OK)
+    if covered.size == 0:
+        return {}, 0
+    index = np.random.default_rng(seed).choice(covered, min(n_points, covered.size), replace=False)
+    exact = pipeline.compute(surrogate.mode, T[index], values[index])
+    approximate = surrogate.evaluate(T[index], values[index])
+    ok = exact["status"] == STATUS_OK
+    errors = {column: float(np.max(np.abs(approximate[column] - exact[column])[ok], initial=0.0))
+              for column in surrogate.columns}
+    return errors, int(np.count_nonzero(~ok))
+
+
+def main(argv=None):
+    """
+    Build a surrogate from the command line and write it to an .npz file.
+    argv: list of arguments (defaults to sys.argv[1:])
+    """
+    parser = argparse.ArgumentParser(description="Fit a piecewise Chebyshev surrogate of the elastic properties "
+                                                 "over a temperature x density or pressure box.")
+    parser.add_argument("--mode", choices=list(MODES), required=True,
+                        help="whether the box spans density (g/cm^3) or pressure (GPa)")
+    parser.add_argument("--temperature", nargs=2, type=float, required=True, metavar=("MIN", "MAX"),
+                        help="temperature limits (K)")
+    parser.add_argument("--range", nargs=2, type=float, required=True, metavar=("MIN", "MAX"),
+                        help="density (g/cm^3) or pressure (GPa) limits")
+    parser.add_argument("--output", default="surrogate.npz", help="output file (default: surrogate.npz)")
+    parser.add_argument("--degree", type=int, default=12, help="Chebyshev degree of each patch (default: 12)")
+    parser.add_argument("--rtol", type=float, default=1e-6,
+                        help="error tolerance relative to the magnitude of each column (default: 1e-6)")
+    parser.add_argument("--margin", type=float,
+                        help="distance above the softening temperature where the surrogate starts (K); "
+                             "detected from the pipeline if not given")
+    parser.add_argument("--max-depth", type=int, default=6, help="maximum number of patch splits (default: 6)")
+    args = parser.parse_args(argv)
+
+    surrogate = build_surrogate(ElasticPipeline(), args.mode, args.temperature, args.range, degree=args.degree,
+                                max_depth=args.max_depth, rtol=args.rtol, margin=args.margin)
+    surrogate.save(args.output)
+    print(f"{len(surrogate.patches)} patches of degree {surrogate.degree}, covering T >= T_c + "
+          f"{surrogate.margin:.3g} K")
+    for column, error in surrogate.max_error.items():
+        print(f"{column}: maximum error {error:.3g}")
+    print(f"\nThe surrogate has been saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
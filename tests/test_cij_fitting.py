@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cij_fitting import fit_elastic_constants
+from elastic_constants_calculator import ElasticConstantsCalculator
+
+TRUE_E = (650.0, 2400.0, 60000.0)
+
+
+def synthetic_data(noise=0.0, seed=0):
+    truth = ElasticConstantsCalculator()
+    truth.set_fitting_parameters(truth.popt1, truth.popt2, truth.popt3, *TRUE_E)
+    rng = np.random.default_rng(seed)
+    density = rng.uniform(4.4, 5.8, 200)
+    # Keep every point at least 50 K above the softening temperature
+    temperature = truth.softening_temperature(density) + rng.uniform(50.0, 3000.0, density.size)
+    constants = np.array(truth.calculate_elastic_constants(density, temperature))
+    return truth, density, temperature, constants + noise * rng.standard_normal(constants.shape)
+
+
+def test_recovers_softening_terms():
+    truth, density, temperature, constants = synthetic_data()
+    result = fit_elastic_constants(density, temperature, constants, seed=0)
+    np.testing.assert_allclose([result.e0, result.e1, result.e2], TRUE_E, rtol=1e-6)
+    for fitted, expected in zip((result.popt1, result.popt2, result.popt3), (truth.popt1, truth.popt2, truth.popt3)):
+        np.testing.assert_allclose(fitted, expected, rtol=1e-5, atol=1e-6)
+    assert max(result.rms().values()) < 1e-6
+
+
+def test_noisy_fit_within_standard_errors():
+    _, density, temperature, constants = synthetic_data(noise=0.5, seed=1)
+    result = fit_elastic_constants(density, temperature, constants, sigma=0.5, absolute_sigma=True, seed=0)
+    errors = result.standard_errors()
+    for name, value, expected in zip(("e0", "e1", "e2"), (result.e0, result.e1, result.e2), TRUE_E):
+        assert abs(value - expected) < 4 * errors[name]
+    assert result.rms()["C11"] == pytest.approx(0.5, rel=0.2)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import parse_arguments
+
+
+@pytest.mark.parametrize("argv", [
+    "--input f --chunk-size 5 --workers 2",
+    "--temperature 1500 2000 3 --pressure 20 30 3 --chunk-size 5",
+    "--isentrope 1500 2000 2 --pressure 20 30 3 --surrogate s.npz",
+    "--depth-table d --workers 2",
+    "--invert f --christoffel 10",
+    "--input f --directions d --uncertainty u",
+    "--input f --adaptive 2",
+    "--temperature 1500 2000 3 --pressure 20 30 3 --adaptive 2 --paired",
+])
+def test_calculation_and_source_conflicts_are_rejected(argv):
+    with pytest.raises(SystemExit):
+        parse_arguments(["--mode", "pressure"] + argv.split())
+
+
+@pytest.mark.parametrize("argv", [
+    "--input f --chunk-size 5",
+    "--point 2000 50 --workers 2",
+    "--temperature 1500 2000 3 --pressure 20 30 3 --adaptive 2",
+    "--input f --directions d",
+    "--isentrope 1500 2000 2 --pressure 20 30 3",
+])
+def test_valid_combinations_are_accepted(argv):
+    parse_arguments(["--mode", "pressure"] + argv.split())
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_io import RESULT_COLUMNS, BinaryWriter, open_writer, read_binary
+from pipeline import ElasticPipeline
+
+
+@pytest.fixture(scope="module")
+def results():
+    # The last points are below the softening temperature, so the results hold NaN
+    temperatures = np.array([1500.0, 2000.0, 2500.0, 3000.0, 300.0, 400.0])
+    return ElasticPipeline().run("density", temperatures, np.linspace(4.6, 5.4, temperatures.size))
+
+
+def test_binary_round_trip(results, tmp_path):
+    filename = str(tmp_path / "results.bin")
+    with BinaryWriter(filename) as writer:
+        writer.write(results.iloc[:4])
+        writer.write(results.iloc[4:])
+    data, columns = read_binary(filename)
+    assert columns == RESULT_COLUMNS
+    assert data.shape == (len(results), len(RESULT_COLUMNS))
+    np.testing.assert_array_equal(data, results[RESULT_COLUMNS].to_numpy(dtype=float))
+    assert np.isnan(data).any()
+
+
+def test_binary_rejects_other_files(tmp_path):
+    filename = tmp_path / "other.bin"
+    filename.write_bytes(b"not a result file")
+    with pytest.raises(ValueError):
+        read_binary(str(filename))
+
+
+@pytest.mark.parametrize("fmt", ["npy", "npz"])
+def test_numpy_round_trip(results, tmp_path, fmt):
+    filename = str(tmp_path / f"results.{fmt}")
+    with open_writer(filename, fmt) as writer:
+        writer.write(results.iloc[:3])
+        writer.write(results.iloc[3:])
+    data = np.load(filename)
+    for column in RESULT_COLUMNS:
+        np.testing.assert_array_equal(data[column], results[column].to_numpy())
+
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elastic_modulus_velocity_calculator import ElasticModulusAndVelocityCalculator, compute_modulus_and_velocity_batch
+
+KEYS = ("B_hill", "G_hill", "Vp_h", "Vs_h", "Vp_v", "Vs_v", "Vp_r", "Vs_r")
+
+
+def test_batch_matches_matrix_calculator():
+    rng = np.random.default_rng(0)
+    c11 = rng.uniform(300.0, 700.0, 20)
+    c12 = rng.uniform(100.0, 300.0, 20)
+    c44 = rng.uniform(50.0, 300.0, 20)
+    rho = rng.uniform(4.0, 6.0, 20)
+    batch = compute_modulus_and_velocity_batch(c11, c12, c44, rho)
+    for i in range(c11.size):
+        reference = ElasticModulusAndVelocityCalculator(c11[i], c12[i], c44[i], rho[i]).compute_modulus_and_velocity()
+        for key, value in zip(KEYS, reference):
+            np.testing.assert_allclose(batch[key][i], value, rtol=1e-12)
+
+
+def test_batch_scalar_and_separate_bulk_moduli():
+    results = compute_modulus_and_velocity_batch(500.0, 200.0, 150.0, 5.0)
+    assert np.ndim(results["Vp_h"]) == 0
+    arrays = compute_modulus_and_velocity_batch([500.0, 450.0], 200.0, 150.0, 5.0)
+    assert arrays["B_reuss"] is not arrays["B_voigt"]
+    np.testing.assert_array_equal(arrays["B_reuss"], arrays["B_voigt"])
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eos_table import InverseEOSTable
+from inverse_eos_calculator import InverseEOSCalculator
+from thermal_P import Thermal
+
+P_RANGE = (20.0, 80.0)
+T_RANGE = (1000.0, 3000.0)
+
+
+@pytest.fixture
+def thermal():
+    return Thermal()
+
+
+def random_points(size=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(*P_RANGE, size), rng.uniform(*T_RANGE, size)
+
+
+def test_error_bound(thermal):
+    table = InverseEOSTable(thermal, P_RANGE, T_RANGE, tolerance=1e-3, cache_dir=None)
+    P, T = random_points()
+    exact, converged = InverseEOSCalculator(thermal).find_volumes(P, T)
+    assert converged.all()
+    assert table.max_error <= 1e-3
+    assert np.max(np.abs(table.volume(P, T) - exact)) <= table.max_error
+
+
+def test_outside_points_are_nan(thermal):
+    table = InverseEOSTable(thermal, P_RANGE, T_RANGE, tolerance=1e-3, cache_dir=None)
+    V = table.volume([10.0, 50.0], [2000.0, 4000.0])
+    assert np.isnan(V).all()
+    assert not table.contains([10.0, 50.0], [2000.0, 4000.0]).any()
+
+
+@pytest.mark.parametrize("cache", [False, True])
+def test_rebuild_on_parameter_change(thermal, tmp_path, cache):
+    table = InverseEOSTable(thermal, P_RANGE, T_RANGE, tolerance=1e-3, cache_dir=str(tmp_path) if cache else None)
+    old_key = table.cache_key()
+    thermal.para_mgd[0] *= 1.05
+    assert table.cache_key() != old_key
+
+    P, T = random_points()
+    exact, converged = InverseEOSCalculator(thermal).find_volumes(P, T)
+    assert converged.all()
+    assert np.max(np.abs(table.volume(P, T) - exact)) <= table.max_error
+
+    solved, solved_converged = InverseEOSCalculator(thermal, table).solve_volumes(50.0, 2000.0)
+    expected, _ = InverseEOSCalculator(thermal).find_volumes(50.0, 2000.0)
+    assert solved_converged
+    assert solved == pytest.approx(expected, abs=table.max_error)
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inverse_eos_calculator import InverseEOSCalculator
+from thermal_P import Thermal
+
+
+def test_find_volumes_matches_find_volume():
+    thermal = Thermal()
+    solver = InverseEOSCalculator(thermal)
+    rng = np.random.default_rng(0)
+    P = rng.uniform(10.0, 150.0, 40)
+    T = rng.uniform(500.0, 4000.0, 40)
+    V, converged = solver.find_volumes(P, T)
+    assert converged.all()
+    np.testing.assert_allclose(thermal.P_MGD(V, T), P, rtol=1e-9)
+
+    # The bisection reference stops within 0.1 GPa of the target pressure
+    reference = np.array([solver.find_volume(p, t) for p, t in zip(P, T)])
+    bound = 0.1 / np.abs(thermal.dP_dV(V, T))
+    assert np.all(np.abs(V - reference) <= bound)
+
+
+def test_find_volumes_broadcasts():
+    solver = InverseEOSCalculator(Thermal())
+    P = np.array([20.0, 60.0, 120.0])
+    T = np.array([1000.0, 2000.0])
+    grid, converged = solver.find_volumes(P[:, None], T[None, :])
+    assert grid.shape == (3, 2) and converged.all()
+    for i, p in enumerate(P):
+        for j, t in enumerate(T):
+            V, _ = solver.find_volumes(p, t)
+            assert abs(V - grid[i, j]) < 1e-9
+
+
+def test_unsolvable_point_is_not_converged():
+    V, converged = InverseEOSCalculator(Thermal()).find_volumes([50.0, np.nan], [2000.0, 2000.0])
+    assert converged.tolist() == [True, False]
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from adaptive import softening_temperature_at_pressure
+from inversion import invert_temperature
+from pipeline import STATUS_OK, ElasticPipeline
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return ElasticPipeline()
+
+
+def forward(pipeline, T, P):
+    results = pipeline.compute("pressure", T, P)
+    ok = results["status"] == STATUS_OK
+    return T[ok], P[ok], results["Vp_h"][ok], results["Vs_h"][ok]
+
+
+def assert_recovered(results, T):
+    assert results["converged"].all()
+    # The true temperature is the best solution or, where two temperatures fit, the alternative
+    recovered = (np.abs(results["T"] - T) < 0.5) | (np.abs(results["T_alt"] - T) < 0.5)
+    assert recovered.all(), list(zip(T[~recovered], results["T"][~recovered]))
+
+
+def test_round_trip(pipeline):
+    rng = np.random.default_rng(0)
+    T, P, Vp, Vs = forward(pipeline, rng.uniform(300.0, 5000.0, 500), rng.uniform(0.0, 200.0, 500))
+    assert_recovered(invert_temperature(pipeline, Vp, Vs, P), T)
+
+
+@pytest.mark.parametrize("sigma", [1.0, 0.01])
+def test_round_trip_near_softening(pipeline, sigma):
+    # High pressures just above the softening temperature, where the misfit has narrow minima
+    P = np.repeat(np.linspace(100.0, 160.0, 13), 20)
+    T_c = softening_temperature_at_pressure(pipeline, P)
+    T, P, Vp, Vs = forward(pipeline, T_c + np.tile(np.geomspace(1.0, 1000.0, 20), 13), P)
+    # Leave out the spikes of the velocities at the poles of the Reuss shear modulus
+    keep = Vp < 15.0
+    T, P, Vp, Vs = T[keep], P[keep], Vp[keep], Vs[keep]
+    assert T.size > 100
+    assert_recovered(invert_temperature(pipeline, Vp, Vs, P, sigma_p=sigma, sigma_s=sigma), T)
+
+
+def test_misfit_beyond_uncertainties_is_not_converged(pipeline):
+    T, P, Vp, Vs = forward(pipeline, np.array([2000.0]), np.array([50.0]))
+    results = invert_temperature(pipeline, Vp + 1.0, Vs - 1.0, P, sigma_p=0.01, sigma_s=0.01)
+    assert not results["converged"].any()
+    assert results["n_solutions"][0] == 0
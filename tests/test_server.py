@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import ElasticPipeline
+from server import QueryServer
+
+
+@pytest.fixture(scope="module")
+def url():
+    server = QueryServer(ElasticPipeline(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def post(url, body):
+    request = urllib.request.Request(f"{url}/compute", data=body.encode(),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as error:
+        return error.code, json.load(error)
+
+
+@pytest.mark.parametrize("body", ["[1, 2]", '"x"', "3", "null"])
+def test_non_object_body_is_rejected(url, body):
+    code, reply = post(url, body)
+    assert code == 400
+    assert "request body must be a JSON object" in reply["error"]
+
+
+def test_valid_query(url):
+    code, reply = post(url, json.dumps({"mode": "density", "T": [2000.0], "values": [5.0], "columns": ["Vp_h"]}))
+    assert code == 200
+    assert reply["status"] == [0]
+    assert reply["Vp_h"][0] > 0
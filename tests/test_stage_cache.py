@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from eos_table import InverseEOSTable
+from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import COLUMNS, ElasticPipeline
+from stage_cache import StageCache
+from thermal_P import Thermal
+
+T = np.linspace(1500.0, 3000.0, 7)
+RHO = np.linspace(4.6, 5.4, 7)
+P = np.linspace(30.0, 90.0, 7)
+
+
+def assert_same(results, expected):
+    for column in COLUMNS + ["status"]:
+        np.testing.assert_array_equal(results[column], expected[column])
+
+
+def test_repeated_compute_hits():
+    cache = StageCache()
+    pipeline = ElasticPipeline(cache=cache)
+    first = pipeline.compute("density", T, RHO)
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert_same(pipeline.compute("density", T, RHO), first)
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_downstream_parameter_change_keeps_upstream_stages():
+    cache = StageCache()
+    pipeline = ElasticPipeline(cache=cache)
+    pipeline.compute("density", T, RHO)
+    pipeline.calculator.e0 += 50.0
+    results = pipeline.compute("density", T, RHO)
+    # The EOS stage is reused, the Cij and adiabatic stages are recomputed
+    assert (cache.hits, cache.misses) == (1, 5)
+    reference = ElasticPipeline()
+    reference.calculator.e0 += 50.0
+    assert_same(results, reference.compute("density", T, RHO))
+
+
+@pytest.mark.parametrize("table", [False, True])
+def test_upstream_parameter_change_invalidates_everything(table):
+    thermal = Thermal()
+    inverse = InverseEOSCalculator(thermal, InverseEOSTable(thermal, (20.0, 100.0), (1000.0, 3500.0),
+                                                            tolerance=1e-3, cache_dir=None) if table else None)
+    cache = StageCache()
+    pipeline = ElasticPipeline(thermal, inverse=inverse, cache=cache)
+    before = pipeline.compute("pressure", T, P)
+    thermal.para_mgd[0] *= 1.05
+    results = pipeline.compute("pressure", T, P)
+    assert (cache.hits, cache.misses) == (0, 6)
+    assert not np.allclose(results["V"], before["V"])
+
+    reference = Thermal()
+    reference.para_mgd[0] *= 1.05
+    expected = ElasticPipeline(reference).compute("pressure", T, P)
+    np.testing.assert_allclose(results["V"], expected["V"], rtol=0, atol=1e-3 if table else 1e-9)
+
+
+def test_disk_cache_is_shared(tmp_path):
+    first = ElasticPipeline(cache=StageCache(cache_dir=str(tmp_path))).compute("density", T, RHO)
+    cache = StageCache(cache_dir=str(tmp_path))
+    assert_same(ElasticPipeline(cache=cache).compute("density", T, RHO), first)
+    assert (cache.hits, cache.misses) == (3, 0)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = StageCache(max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.put(key, {"x": np.arange(3)})
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
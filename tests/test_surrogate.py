@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import STATUS_OK, ElasticPipeline
+from surrogate import ChebyshevSurrogate, build_surrogate, check_surrogate
+
+RANGES = {"density": ((1000.0, 3500.0), (4.6, 5.4)), "pressure": ((1000.0, 3500.0), (30.0, 90.0))}
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return ElasticPipeline()
+
+
+@pytest.fixture(scope="module", params=sorted(RANGES))
+def surrogate(request, pipeline):
+    T_range, value_range = RANGES[request.param]
+    return build_surrogate(pipeline, request.param, T_range, value_range, n_verify=20000)
+
+
+def random_points(surrogate, size=5000, seed=1):
+    rng = np.random.default_rng(seed)
+    T_range, value_range = RANGES[surrogate.mode]
+    return rng.uniform(*T_range, size), rng.uniform(*value_range, size)
+
+
+def test_errors_within_stated_maximum(surrogate, pipeline):
+    temperatures, values = random_points(surrogate)
+    errors, mismatches = check_surrogate(surrogate, pipeline, temperatures, values, n_points=5000)
+    assert mismatches == 0
+    assert set(errors) == set(surrogate.columns)
+    for column, error in errors.items():
+        assert error <= surrogate.max_error[column], column
+
+
+def test_points_outside_are_not_covered(surrogate):
+    T_range, value_range = RANGES[surrogate.mode]
+    results = surrogate.evaluate([T_range[1] + 100.0, 0.5 * sum(T_range)],
+                                 [0.5 * sum(value_range), value_range[1] * 2])
+    assert (results["status"] != STATUS_OK).all()
+
+
+def test_save_and_load(surrogate, pipeline, tmp_path):
+    filename = str(tmp_path / "surrogate.npz")
+    surrogate.save(filename)
+    loaded = ChebyshevSurrogate.load(filename)
+    assert loaded.matches(pipeline)
+    temperatures, values = random_points(surrogate, size=100)
+    expected = surrogate.evaluate(temperatures, values)
+    for column, value in loaded.evaluate(temperatures, values).items():
+        np.testing.assert_array_equal(value, expected[column])
+
+
+def test_parameter_change_is_detected(surrogate):
+    changed = ElasticPipeline()
+    changed.calculator.e0 += 10.0
+    assert not surrogate.matches(changed)
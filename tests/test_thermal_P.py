@@ -0,0 +1,30 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from thermal_P import DEBYE_SERIES_SWITCH, Thermal, debye_integral, debye_integral_quad
+
+
+def test_debye_integral_matches_quad():
+    x = np.concatenate([np.geomspace(1e-3, 100.0, 60), DEBYE_SERIES_SWITCH * np.array([1 - 1e-9, 1, 1 + 1e-9])])
+    np.testing.assert_allclose(debye_integral(x), debye_integral_quad(x), rtol=1e-12)
+
+
+def test_debye_integral_scalar_matches_array():
+    x = np.geomspace(1e-3, 100.0, 25)
+    scalars = np.array([debye_integral(value) for value in x])
+    assert np.ndim(debye_integral(x[0])) == 0
+    np.testing.assert_allclose(scalars, debye_integral(x), rtol=1e-14)
+
+
+def test_P_MGD_matches_quad():
+    thermal = Thermal()
+    V = np.linspace(32.0, 48.0, 5)
+    T = np.array([300.0, 1000.0, 2500.0, 4000.0])
+    reference = np.array([[thermal.P_MGD_quad(v, t) for t in T] for v in V])
+    np.testing.assert_allclose(thermal.P_MGD(V[:, None], T[None, :]), reference, rtol=0, atol=1e-8)
+    assert thermal.P_MGD(V[2], T[1]) == pytest.approx(reference[2, 1], abs=1e-8)
@@ -4,10 +4,87 @@
 # In[11]:
 
 
+import math
 from scipy import constants
 from scipy.integrate import quad
+from scipy.special import bernoulli
 import numpy as np
 import casio3
+from instrumentation import PROFILER
+
+# Below this argument the Debye integral is evaluated from its Bernoulli power series,
+# above it from the exponentially convergent asymptotic (tail) series.
+DEBYE_SERIES_SWITCH = 3.0
+
+# Power series coefficients of x**3 * sum_k c_k x**(2k) for even Bernoulli numbers B_2k, k >= 1
+_DEBYE_SERIES_ORDER = 30
+_DEBYE_SERIES_COEFFS = np.array([bernoulli(2 * _DEBYE_SERIES_ORDER)[2 * k] / (math.factorial(2 * k) * (2 * k + 3))
+                                 for k in range(_DEBYE_SERIES_ORDER, 0, -1)])
+_DEBYE_SERIES_COEFFS_LIST = _DEBYE_SERIES_COEFFS.tolist()
+_DEBYE_TAIL_TERMS = 14
+
+
+def _debye_integral_scalar(x):
+    """
+    Scalar version of debye_integral with plain floats, avoiding the masking overhead on 0-d arrays.
+    x: Upper limit theta / T (float)
+    Returns: Value of the integral (float)
+    """
+    if x < DEBYE_SERIES_SWITCH:
+        x2 = x * x
+        series = 0.0
+        for coefficient in _DEBYE_SERIES_COEFFS_LIST:
+            series = series * x2 + coefficient
+        return x**3 * (1 / 3 - x / 8 + x2 * series)
+    tail = 0.0
+    for k in range(1, _DEBYE_TAIL_TERMS + 1):
+        tail += math.exp(-k * x) * (x**3 / k + 3 * x**2 / k**2 + 6 * x / k**3 + 6 / k**4)
+    return math.pi**4 / 15 - tail
+
+
+def debye_integral(x):
+    """
+    Evaluate the Debye integral int_0^x t^3 / (exp(t) - 1) dt for scalars or arrays.
+    x: Upper limit theta / T (dimensionless, >= 0)
+    Returns: Value of the integral, with the shape of x
+
+    For x < DEBYE_SERIES_SWITCH the Bernoulli power series is summed (radius of
+    convergence 2*pi), otherwise pi^4/15 minus the tail series in exp(-k*x) is used.
+    It agrees with scipy.integrate.quad to a relative error below 1e-12 for
+    0 < x < 1e3 (see debye_integral_quad for the reference implementation).
+    """
+    x = np.asarray(x, dtype=float)
+    if PROFILER.enabled:
+        PROFILER.count("debye_evaluations", x.size)
+    if x.ndim == 0:
+        return np.float64(_debye_integral_scalar(float(x)))
+    result = np.empty_like(x)
+
+    small = x < DEBYE_SERIES_SWITCH
+    xs = x[small]
+    x2 = xs * xs
+    result[small] = xs**3 * (1 / 3 - xs / 8 + x2 * np.polyval(_DEBYE_SERIES_COEFFS, x2))
+
+    xl = x[~small]
+    tail = np.zeros_like(xl)
+    for k in range(1, _DEBYE_TAIL_TERMS + 1):
+        tail += np.exp(-k * xl) * (xl**3 / k + 3 * xl**2 / k**2 + 6 * xl / k**3 + 6 / k**4)
+    result[~small] = np.pi**4 / 15 - tail
+
+    return result[()]
+
+
+def debye_integral_quad(x):
+    """
+    Reference evaluation of the Debye integral with scipy.integrate.quad, one point at a time.
+    x: Upper limit theta / T (dimensionless, >= 0)
+    Returns: Value of the integral, with the shape of x
+    """
+    x = np.asarray(x, dtype=float)
+    if PROFILER.enabled:
+        PROFILER.count("debye_quad_evaluations", x.size)
+    values = [quad(lambda t: t**3 / (np.exp(t) - 1), 0, xi)[0] for xi in x.ravel()]
+    return np.array(values).reshape(x.shape)[()]
 
 class Thermal:
     def __init__(self):
@@ -16,6 +93,7 @@ class Thermal:
         self.g0 = 1.605   # Initial gamma value
         self.d0 = 1000    # Initial Debye temperature
         self.natoms = 5   # Number of atoms per formula unit
+        self.mol_mass = casio3.mol_mass  # Molar mass (g/mol)
 
         # para_th parameters
         self.para_th = [3.141999407109362323e+02,
@@ -49,7 +127,7 @@ class Thermal:
         V: Volume (A^3)
         Returns: Density (g/cm³)
         """
-        return (1 / constants.Avogadro) * casio3.mol_mass / V * 10**24
+        return (1 / constants.Avogadro) * self.mol_mass / V * 10**24
 
     def rho_to_V(self, rho):
         """
@@ -57,7 +135,7 @@ class Thermal:
         rho: Density (g/cm³)
         Returns: Volume (A^3)
         """
-        return (1 / constants.Avogadro) * casio3.mol_mass / rho * 10**24
+        return (1 / constants.Avogadro) * self.mol_mass / rho * 10**24
 
     def alpha(self, V, T):
         """
@@ -70,9 +148,133 @@ class Thermal:
         dT = T - self.T0
         return (b3 + b4 * np.log(V / self.V0) + 2 * b5 * dT) / (2 * b1 / 3 - b4 * dT)
 
+    def alpha_derivatives(self, V, T):
+        """
+        Calculate the partial derivatives of the thermal expansion coefficient alpha.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: d(alpha)/dV at constant T (1/A^3) and d(alpha)/dT at constant V
+        """
+        b1, b2, b3, b4, b5 = self.para_th
+        dT = T - self.T0
+        numerator = b3 + b4 * np.log(V / self.V0) + 2 * b5 * dT
+        denominator = 2 * b1 / 3 - b4 * dT
+        return b4 / (V * denominator), (2 * b5 * denominator + b4 * numerator) / denominator**2
+
+    def debye_temperature(self, V):
+        """
+        Calculate the Debye temperature of the MGD model based on volume.
+        V: Volume (A^3)
+        Returns: Debye temperature (K)
+        """
+        g0, q = self.para_mgd[2:]
+        return self.d0 * np.exp((g0 - g0 * (np.asarray(V, dtype=float) / self.V0)**q) / q)
+
+    def thermal_energy(self, V, T):
+        """
+        Calculate the Debye thermal energy of the MGD model based on volume and temperature.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: Thermal energy (GPa*A^3)
+        """
+        r = 9 * self.natoms * casio3.kb2ev * casio3.evA3_GPa  # Scaling factor
+        T = np.asarray(T, dtype=float)
+        theta = self.debye_temperature(V)
+        return r * T * (theta / T)**(-3) * debye_integral(theta / T)
+
     def P_MGD(self, V, T):
         """
         Calculate the pressure under the MGD model based on volume and temperature.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: Pressure under the MGD model (GPa)
+        """
+        b1, b2, g0, q = self.para_mgd
+        V = np.asarray(V, dtype=float)
+        f = self.V0 / V
+
+        # The T0 reference energy depends on V only, so it is evaluated on the shape of V
+        # (once per volume) rather than on the broadcast (V, T) grid
+        E_ref = self.thermal_energy(V, self.T0)
+        E = self.thermal_energy(V, T)
+
+        return b1 * (f**(7/3) - f**(5/3)) + b2 * ((f**(7/3) - f**(5/3)) * (f**(2/3) - 1)) + \
+               g0 * (1 / V) * (1 / f)**q * (E - E_ref)
+
+    def dP_dV(self, V, T):
+        """
+        Calculate the analytic volume derivative of the MGD pressure at constant temperature.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: dP/dV (GPa/A^3)
+        """
+        return self.P_MGD_and_dP_dV(V, T)[1]
+
+    def P_MGD_and_dP_dV(self, V, T):
+        """
+        Calculate the MGD pressure and its volume derivative together, sharing the Debye integrals.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: Pressure (GPa) and dP/dV (GPa/A^3)
+        """
+        b1, b2, g0, q = self.para_mgd
+        V = np.asarray(V, dtype=float)
+        T = np.asarray(T, dtype=float)
+        f = self.V0 / V
+        r = 9 * self.natoms * casio3.kb2ev * casio3.evA3_GPa  # Scaling factor
+        gamma = g0 * (V / self.V0)**q
+        theta = self.debye_temperature(V)
+
+        # Cold part and its derivative with respect to f = V0 / V
+        cold = b1 * (f**(7/3) - f**(5/3)) + b2 * ((f**(7/3) - f**(5/3)) * (f**(2/3) - 1))
+        dcold_df = b1 * (7/3 * f**(4/3) - 5/3 * f**(2/3)) + \
+                   b2 * ((7/3 * f**(4/3) - 5/3 * f**(2/3)) * (f**(2/3) - 1) + (f**(7/3) - f**(5/3)) * 2/3 * f**(-1/3))
+
+        # Thermal part: dtheta/dV = -gamma * theta / V gives dE/dV = gamma / V * (3E - r T x / (exp(x) - 1))
+        E = self.thermal_energy(V, T)
+        E_ref = self.thermal_energy(V, self.T0)
+        x = theta / T
+        x_ref = theta / self.T0
+        dE = gamma / V * (3 * E - r * T * x / np.expm1(x))
+        dE_ref = gamma / V * (3 * E_ref - r * self.T0 * x_ref / np.expm1(x_ref))
+
+        pressure = cold + gamma / V * (E - E_ref)
+        derivative = -f / V * dcold_df + gamma * (q - 1) / V**2 * (E - E_ref) + gamma / V * (dE - dE_ref)
+        return pressure, derivative
+
+    def heat_capacity(self, V, T):
+        """
+        Calculate the Debye isochoric heat capacity of the MGD model based on volume and temperature.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: Heat capacity (GPa*A^3/K)
+        """
+        r = 9 * self.natoms * casio3.kb2ev * casio3.evA3_GPa  # Scaling factor
+        T = np.asarray(T, dtype=float)
+        x = self.debye_temperature(V) / T
+        return r * (4 * x**(-3) * debye_integral(x) - x / np.expm1(x))
+
+    def dP_dT(self, V, T):
+        """
+        Calculate the temperature derivative of the MGD pressure at constant volume.
+        V and T may be scalars or broadcastable NumPy arrays.
+        V: Volume (A^3)
+        T: Temperature (K)
+        Returns: dP/dT (GPa/K)
+        """
+        b1, b2, g0, q = self.para_mgd
+        V = np.asarray(V, dtype=float)
+        return g0 * (V / self.V0)**q / V * self.heat_capacity(V, T)
+
+    def P_MGD_quad(self, V, T):
+        """
+        Reference implementation of P_MGD for a single (V, T) point, integrating the
+        Debye function with scipy.integrate.quad.
         V: Volume (A^3)
         T: Temperature (K)
         Returns: Pressure under the MGD model (GPa)
@@ -85,6 +287,8 @@ class Thermal:
         theta = self.d0 * np.exp((g0 - g0 * (V / self.V0)**q) / q)  # Debye temperature
 
         # Calculate the integral part
+        if PROFILER.enabled:
+            PROFILER.count("debye_quad_evaluations", 2)
         integral1, _ = quad(lambda x: x**3 / (np.exp(x) - 1), 0, theta / T)
         integral2, _ = quad(lambda x: x**3 / (np.exp(x) - 1), 0, theta / self.T0)
 
@@ -0,0 +1,196 @@
+import copy
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from inverse_eos_calculator import InverseEOSCalculator
+from pipeline import MODES, STATUS_OK, ElasticPipeline
+
+# Fitted parameters that can carry uncertainties, and the pipeline component holding each of them
+UNCERTAIN_PARAMETERS = {
+    "popt1": "calculator",
+    "popt2": "calculator",
+    "popt3": "calculator",
+    "e0": "calculator",
+    "e1": "calculator",
+    "e2": "calculator",
+    "para_mgd": "thermal",
+    "para_th": "thermal",
+}
+
+# Result columns summarized by default
+UNCERTAINTY_QUANTITIES = ["C11_S", "C12_S", "C44", "B_hill", "G_hill", "Vp_h", "Vs_h"]
+DEFAULT_PERCENTILES = (2.5, 50, 97.5)
+
+# Maximum number of sample x point elements evaluated at a time
+DEFAULT_MAX_ELEMENTS = 2**20
+
+
+def _parameter_names(key):
+    """
+    Split a covariance key into parameter names.
+    key: Parameter name, comma-separated names or a tuple of names
+    Returns: Tuple of parameter names
+    """
+    names = tuple(name.strip() for name in key.split(",")) if isinstance(key, str) else tuple(key)
+    for name in names:
+        if name not in UNCERTAIN_PARAMETERS:
+            raise ValueError(f"Unknown parameter '{name}', expected one of {list(UNCERTAIN_PARAMETERS)}")
+    return names
+
+
+def nominal_parameters(pipeline, names=UNCERTAIN_PARAMETERS):
+    """
+    Read the current values of fitted parameters from a pipeline.
+    pipeline: ElasticPipeline instance
+    names: Parameter names, see UNCERTAIN_PARAMETERS
+    Returns: Dictionary mapping each name to a float array (0-d for scalars)
+    """
+    return {name: np.asarray(getattr(getattr(pipeline, UNCERTAIN_PARAMETERS[name]), name), dtype=float)
+            for name in names}
+
+
+def sample_parameters(pipeline, covariances=None, ensembles=None, n_samples=1000, seed=None):
+    """
+    Draw parameter samples from multivariate normal distributions centred on the current parameters
+    of a pipeline and/or from given sample ensembles.
+    pipeline: ElasticPipeline instance holding the nominal parameters
+    covariances: Dictionary mapping a parameter name to its covariance matrix (a variance for scalars).
+                 Correlated parameters share one matrix under a tuple or comma-separated key, e.g.
+                 {"popt1,e0,e1,e2": C} with C ordered like the concatenated parameters
+    ensembles: Dictionary mapping a parameter name to an array of samples, shape (n,) or (n, k).
+               Ensembles of n_samples rows are used as they are; otherwise rows are drawn with
+               replacement, with the same rows for all ensembles of equal length to keep their correlation
+    n_samples: Number of samples
+    seed: Seed of the random number generator
+    Returns: Dictionary mapping each sampled parameter to an array of shape (n_samples,) or (n_samples, k)
+    """
+    rng = np.random.default_rng(seed)
+    nominal = nominal_parameters(pipeline)
+    samples = {}
+
+    for key, covariance in (covariances or {}).items():
+        names = _parameter_names(key)
+        mean = np.concatenate([np.ravel(nominal[name]) for name in names])
+        covariance = np.atleast_2d(np.asarray(covariance, dtype=float))
+        if covariance.shape != (mean.size, mean.size):
+            raise ValueError(f"Covariance of {key} has shape {covariance.shape}, expected {(mean.size, mean.size)}")
+        drawn = rng.multivariate_normal(mean, covariance, size=n_samples, method="eigh")
+        offsets = np.cumsum([0] + [nominal[name].size for name in names])
+        for name, start, stop in zip(names, offsets[:-1], offsets[1:]):
+            samples[name] = drawn[:, start:stop].reshape((n_samples,) + nominal[name].shape)
+
+    rows = {}
+    for name, ensemble in (ensembles or {}).items():
+        _parameter_names(name)
+        ensemble = np.asarray(ensemble, dtype=float)
+        if ensemble.shape[1:] != nominal[name].shape:
+            raise ValueError(f"Samples of {name} have shape {ensemble.shape[1:]}, expected {nominal[name].shape}")
+        if len(ensemble) == n_samples:
+            samples[name] = ensemble
+        else:
+            if len(ensemble) not in rows:
+                rows[len(ensemble)] = rng.integers(len(ensemble), size=n_samples)
+            samples[name] = ensemble[rows[len(ensemble)]]
+    return samples
+
+
+def load_parameter_uncertainties(filename):
+    """
+    Read parameter uncertainties from a file.
+    A JSON file holds an optional "covariance" object (see sample_parameters; correlated parameters use a
+    comma-separated key) and an optional "ensemble" object mapping parameter names to lists of samples.
+    An .npz file holds one sample ensemble per parameter name.
+    filename: File name
+    Returns: Dictionaries of covariances and ensembles, as taken by sample_parameters
+    """
+    if os.path.splitext(filename)[1].lower() == ".npz":
+        with np.load(filename) as data:
+            return {}, {name: data[name] for name in data.files}
+    with open(filename) as f:
+        data = json.load(f)
+    return data.get("covariance", {}), data.get("ensemble", {})
+
+
+def with_parameters(pipeline, samples):
+    """
+    Build a pipeline evaluating every parameter sample at once.
+    Each sampled parameter is replaced by (n_samples, 1) columns, so that evaluating the copy with
+    shape=(n_samples, n_points) broadcasts the samples along the first axis (see ElasticPipeline.compute).
+    pipeline: ElasticPipeline instance holding the nominal parameters
+    samples: Dictionary returned by sample_parameters
+    Returns: ElasticPipeline with copies of the components and no stage cache
+    """
+    thermal = copy.copy(pipeline.thermal)
+    calculator = copy.copy(pipeline.calculator)
+    components = {"thermal": thermal, "calculator": calculator}
+    for name, values in samples.items():
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            setattr(components[UNCERTAIN_PARAMETERS[name]], name, values[:, None])
+        else:
+            setattr(components[UNCERTAIN_PARAMETERS[name]], name, [column[:, None] for column in values.T])
+    # The inverse EOS table of the nominal parameters does not apply to the samples, so volumes are root-solved
+    return ElasticPipeline(thermal, calculator, copy.copy(pipeline.convertion), InverseEOSCalculator(thermal))
+
+
+def propagate_uncertainty(pipeline, mode, temperatures, values, samples, quantities=UNCERTAINTY_QUANTITIES,
+                          percentiles=DEFAULT_PERCENTILES, max_elements=DEFAULT_MAX_ELEMENTS):
+    """
+    Propagate parameter samples through the pipeline and summarize the distribution of the results at each point.
+    The pipeline is evaluated on a (samples x points) grid, in chunks of points holding at most
+    max_elements elements, so memory use does not grow with the number of points.
+    Samples for which a point cannot be calculated (non-zero status) are left out of its statistics.
+    pipeline: ElasticPipeline instance holding the nominal parameters
+    mode: 'density' or 'pressure', see ElasticPipeline.compute
+    temperatures: Temperatures (K)
+    values: Densities (g/cm³) or pressures (GPa), broadcastable with temperatures
+    samples: Dictionary returned by sample_parameters
+    quantities: Result columns to summarize
+    percentiles: Percentiles to report (0-100)
+    max_elements: Maximum number of sample x point elements per evaluation
+    Returns: DataFrame with one row per (flattened) point: T, rho or P, the fraction of samples that
+             could be calculated ('valid_fraction') and, per quantity, '<name>_mean', '<name>_std' and
+             '<name>_p<percentile>'
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unsupported mode '{mode}', expected one of {MODES}")
+    T, values = np.broadcast_arrays(np.ravel(np.asarray(temperatures, dtype=float)),
+                                    np.ravel(np.asarray(values, dtype=float)))
+    sizes = {len(value) for value in samples.values()}
+    if len(sizes) != 1:
+        raise ValueError("All parameters need the same number of samples")
+    n_samples = sizes.pop()
+    sampled = with_parameters(pipeline, samples)
+
+    columns = {"T": T, "rho" if mode == "density" else "P": values, "valid_fraction": np.empty(T.size)}
+    for quantity in quantities:
+        columns[f"{quantity}_mean"] = np.empty(T.size)
+        columns[f"{quantity}_std"] = np.empty(T.size)
+        for percentile in percentiles:
+            columns[f"{quantity}_p{percentile:g}"] = np.empty(T.size)
+
+    step = max(1, max_elements // n_samples)
+    for start in range(0, T.size, step):
+        chunk = slice(start, min(start + step, T.size))
+        # Stages without sampled parameters are evaluated once per point and broadcast over the samples
+        results = sampled.compute(mode, T[chunk], values[chunk], shape=(n_samples, chunk.stop - chunk.start))
+        valid = results["status"] == STATUS_OK
+        columns["valid_fraction"][chunk] = valid.mean(axis=0)
+
+        with warnings.catch_warnings():
+            # Points without any valid sample are reported as NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for quantity in quantities:
+                data = np.where(valid, results[quantity], np.nan)
+                columns[f"{quantity}_mean"][chunk] = np.nanmean(data, axis=0)
+                columns[f"{quantity}_std"][chunk] = np.nanstd(data, axis=0, ddof=1)
+                # np.percentile is much faster than np.nanpercentile when nothing is missing
+                spread = np.percentile(data, percentiles, axis=0) if valid.all() else \
+                    np.nanpercentile(data, percentiles, axis=0)
+                for percentile, value in zip(percentiles, spread):
+                    columns[f"{quantity}_p{percentile:g}"][chunk] = value
+    return pd.DataFrame(columns)